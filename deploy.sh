@@ -44,7 +44,12 @@ npm run build
 
 # 5. Configure Nginx
 echo ">>> Configuring Nginx..."
+mkdir -p /var/cache/nginx/tripoint-api
 cat > /etc/nginx/sites-available/tripoint <<EOL
+# Only responses the API marks cacheable (Cache-Control: public, max-age)
+# are stored; private/no-cache and admin responses always go upstream.
+proxy_cache_path /var/cache/nginx/tripoint-api levels=1:2 keys_zone=tripoint_api:10m max_size=100m inactive=1d use_temp_path=off;
+
 server {
     listen 80;
     server_name $DOMAIN www.$DOMAIN;
@@ -69,6 +74,11 @@ server {
         proxy_set_header X-Real-IP \$remote_addr;
         proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
         proxy_set_header X-Forwarded-Proto \$scheme;
+        proxy_cache tripoint_api;
+        proxy_cache_revalidate on;
+        proxy_cache_use_stale error timeout updating;
+        proxy_cache_lock on;
+        add_header X-Cache-Status \$upstream_cache_status always;
     }
 }
 EOL
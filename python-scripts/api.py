@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import html
 import json
 import logging
@@ -9,45 +10,46 @@ from pathlib import Path
 from urllib.parse import quote
 from dataclasses import dataclass
 from datetime import date, datetime, time, timedelta, timezone
-from typing import Any
+from typing import Any, Literal
 
 import requests
-import smtplib
-import ssl
-from email.message import EmailMessage
 import WazeRouteCalculator
 from fastapi import Cookie, FastAPI, File, Form, HTTPException, Header, Depends, Request, Response, UploadFile
 
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, ValidationError
 from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 
 load_dotenv()
 
 from email_templates import EmailTemplateService
+from services.mailer import SMTPSession, build_message, smtp_settings
+from records import dumps
+from services.http_cache import PRIVATE_NO_CACHE, PUBLIC_STATIC, HTTPCache, Precomputed, content_etag
+from services.pagination import TTLCache, clamp_page_size, decode_cursor, encode_cursor
+from services.timeseries import DEFAULT_CHART_POINTS, MAX_CHART_POINTS
 from db import (
     STATUS_CANCELLED,
     STATUS_COMPLETED_PAID,
     STATUS_COMPLETED_UNPAID,
     STATUS_DEPOSIT_PAID,
     STATUS_PENDING_DEPOSIT,
+    SlotConflictError,
     expire_old_pending_bookings,
     generate_booking_id,
     generate_payment_token,
     get_blocked_slot_intervals,
     get_booking_by_id,
-    get_booking_by_stripe_session,
     get_booking_by_token,
     init_db,
     insert_booking,
-    payment_event_exists,
     record_payment_event,
+    set_calendar_event_id,
     set_stripe_balance_session,
     set_stripe_deposit_session,
-    update_booking_balance_paid,
-    update_booking_deposit_paid,
+    transition_booking,
 )
 
 try:
@@ -90,6 +92,13 @@ async def startup_event():
     app.mount("/media", StaticFiles(directory=str(media_path)), name="media")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    from db_pool import close_pool
+
+    await close_pool()
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -112,6 +121,7 @@ EARLY_LATE_MARKERS = [m.strip().lower() for m in os.getenv("EARLY_LATE_SHIFT_MAR
 CALENDAR_ID = os.getenv("GOOGLE_CALENDAR_ID", "primary")
 SITE_URL = os.getenv("SITE_URL", "https://tripointdiagnostics.co.uk")
 PENDING_BOOKING_TTL_MINS = int(os.getenv("PENDING_BOOKING_TTL_MINS", "30"))
+CALENDAR_BUSY_CACHE_SECS = int(os.getenv("CALENDAR_BUSY_CACHE_SECS", "60"))
 
 
 @dataclass(frozen=True)
@@ -309,6 +319,13 @@ class SendTestEmailRequest(BaseModel):
     force: bool = False
 
 
+class CampaignRunRequest(BaseModel):
+    days: int | None = Field(default=None, ge=1)
+    rate_per_minute: int | None = Field(default=None, ge=1, le=600)
+    limit: int = Field(default=5000, ge=1, le=20000)
+    dry_run: bool = False
+
+
 class DepositSessionRequest(BaseModel):
     token: str = Field(min_length=10)
 
@@ -410,6 +427,26 @@ class MediaPatchRequest(BaseModel):
     caption: str | None = None
 
 
+MAX_BATCH_OPERATIONS = 500
+
+
+class ReportBatchOperation(BaseModel):
+    op: Literal["create", "patch", "delete", "reorder"]
+    entity: Literal["vehicle", "fault", "test", "media"]
+    id: str | None = None
+    # create: a "$name" later operations can use wherever an id goes
+    ref: str | None = Field(None, pattern=r"^\$")
+    # create fault/test: the vehicle; reorder faults/tests: the vehicle
+    parent_id: str | None = None
+    data: dict[str, Any] = Field(default_factory=dict)
+    # reorder: children in their new order
+    ids: list[str] | None = None
+
+
+class ReportBatchRequest(BaseModel):
+    operations: list[ReportBatchOperation] = Field(min_length=1, max_length=MAX_BATCH_OPERATIONS)
+
+
 class ContactSubmitRequest(BaseModel):
     name: str = Field(min_length=2)
     email: EmailStr
@@ -590,6 +627,37 @@ def _fetch_busy_intervals(window_start: datetime, window_end: datetime) -> list[
     return intervals
 
 
+# Busy intervals per local calendar day (each one overlapping that day), so
+# availability's multi-day window and reserve's single-day check share entries
+_calendar_busy_cache = TTLCache(ttl=CALENDAR_BUSY_CACHE_SECS)
+# Fetched beyond the missing days so events whose buffer reaches into them count
+_CALENDAR_FETCH_MARGIN = timedelta(hours=6)
+
+
+def _day_bounds(day: date) -> tuple[datetime, datetime]:
+    start = datetime.combine(day, time(0, tzinfo=LOCAL_TZ))
+    return start, datetime.combine(day + timedelta(days=1), time(0, tzinfo=LOCAL_TZ))
+
+
+def _cached_busy_intervals(window_start: datetime, window_end: datetime) -> list[tuple[datetime, datetime]]:
+    """Busy intervals overlapping the window; days not cached come from one calendar call."""
+    first, last = window_start.astimezone(LOCAL_TZ).date(), window_end.astimezone(LOCAL_TZ).date()
+    days = [first + timedelta(days=n) for n in range((last - first).days + 1)]
+    per_day = {day: _calendar_busy_cache.get(day) for day in days}
+    missing = [day for day, intervals in per_day.items() if intervals is None]
+    if missing:
+        fetch_start, fetch_end = _day_bounds(missing[0])[0], _day_bounds(missing[-1])[1]
+        fetched = _fetch_busy_intervals(fetch_start - _CALENDAR_FETCH_MARGIN, fetch_end + _CALENDAR_FETCH_MARGIN)
+        for n in range((missing[-1] - missing[0]).days + 1):
+            day = missing[0] + timedelta(days=n)
+            day_start, day_end = _day_bounds(day)
+            per_day[day] = [(s, e) for s, e in fetched if s < day_end and e > day_start]
+            _calendar_busy_cache.set(day, per_day[day])
+    # An interval spanning midnight is cached under both days
+    intervals = dict.fromkeys(i for day in days for i in per_day[day] or ())
+    return [(s, e) for s, e in intervals if s < window_end and e > window_start]
+
+
 def _round_to_half_hour(dt: datetime) -> datetime:
     minute = 30 if dt.minute >= 30 else 0
     rounded = dt.replace(minute=minute, second=0, microsecond=0)
@@ -702,48 +770,24 @@ def _send_zoho_email(
     raise_for_status: bool = False,
     attachments: list[tuple[str, bytes, str]] | None = None,
 ) -> bool:
-    smtp_host = os.getenv("ZOHO_SMTP_HOST", "smtp.zoho.eu")
-    smtp_port = int(os.getenv("ZOHO_SMTP_PORT", 465))
-    smtp_user = os.getenv("ZOHO_SMTP_USER")
-    smtp_pass = os.getenv("ZOHO_SMTP_PASS")
-    # from_email fallback
-    from_email = os.getenv("ZOHO_FROM_EMAIL", smtp_user)
-
-    if not (smtp_user and smtp_pass):
+    settings = smtp_settings()
+    if not settings.configured:
          logger.warning("Zoho SMTP not configured - skipping outbound email")
          return False
 
     try:
-        msg = EmailMessage()
-        msg["Subject"] = subject
-        msg["From"] = from_email
-        msg["To"] = ", ".join(to_emails)
-        
-        if reply_to:
-            msg["Reply-To"] = reply_to
-
-        # Set plain text body first
-        if text_body:
-             msg.set_content(text_body)
-        else:
-             msg.set_content("This email requires an HTML-compatible viewer.")
-
-        # Add HTML version
-        msg.add_alternative(html_body, subtype="html")
-
-        # Add attachments
-        if attachments:
-            for filename, content, mimetype in attachments:
-                msg.add_attachment(content, maintype=mimetype.split("/")[0], subtype=mimetype.split("/")[-1], filename=filename)
+        msg = build_message(
+            from_email=settings.from_email,
+            subject=subject,
+            html_body=html_body,
+            to_emails=to_emails,
+            text_body=text_body,
+            reply_to=reply_to,
+            attachments=attachments,
+        )
+        with SMTPSession(settings) as session:
+            session.send(msg)
 
-        context = ssl.create_default_context()
-        
-        logger.info(f"Connecting to SMTP {smtp_host}:{smtp_port} as {smtp_user}...")
-        
-        with smtplib.SMTP_SSL(smtp_host, smtp_port, context=context) as server:
-            server.login(smtp_user, smtp_pass)
-            server.send_message(msg)
-            
         logger.info(f"Email sent successfully to {to_emails}")
         return True
 
@@ -772,18 +816,22 @@ async def calculate_zone(postcode: str):
     return calculate_zone_and_drive_time(postcode)
 
 
+# The catalog is fixed for the life of the process: serialise it once
+_SERVICES_BODY = Precomputed([
+    ServicePublic(
+        id=service.id,
+        label=service.label,
+        duration_minutes=service.duration_minutes,
+        min_notice_hours=service.min_notice_hours,
+        zone_price=service.zone_price,
+    ).model_dump()
+    for service in SERVICE_CATALOG.values()
+])
+
+
 @app.get("/booking/services", response_model=list[ServicePublic])
-async def get_services():
-    return [
-        ServicePublic(
-            id=service.id,
-            label=service.label,
-            duration_minutes=service.duration_minutes,
-            min_notice_hours=service.min_notice_hours,
-            zone_price=service.zone_price,
-        )
-        for service in SERVICE_CATALOG.values()
-    ]
+async def get_services(cache: HTTPCache = Depends()):
+    return cache.respond(_SERVICES_BODY, cache_control=PUBLIC_STATIC)
 
 
 @app.get("/booking/availability", response_model=AvailabilityResponse)
@@ -818,7 +866,7 @@ async def get_booking_availability(postcode: str, service_ids: str, from_date: s
     window_start = datetime.combine(start_day, time(hour=WORKDAY_START_HOUR, tzinfo=LOCAL_TZ)) - timedelta(hours=4)
     window_end = window_start + timedelta(days=BOOKING_WINDOW_DAYS + 2)
     await expire_old_pending_bookings(PENDING_BOOKING_TTL_MINS)
-    calendar_intervals = _fetch_busy_intervals(window_start, window_end)
+    calendar_intervals = _cached_busy_intervals(window_start, window_end)
     db_intervals = await get_blocked_slot_intervals(window_start, window_end, travel_buffer)
     blocked_intervals = list(calendar_intervals) + list(db_intervals)
     slots = _generate_available_slots(now_local, start_day, service_duration, travel_buffer, min_notice, blocked_intervals)
@@ -840,7 +888,17 @@ async def get_booking_availability(postcode: str, service_ids: str, from_date: s
 
 
 @app.post("/booking/reserve", response_model=BookingResponse)
-async def reserve_booking(payload: BookingRequest):
+async def reserve_booking(
+    payload: BookingRequest,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+):
+    """Hold a slot and email the deposit link. Retries with the same Idempotency-Key replay the first result."""
+    from services.idempotency import idempotent
+
+    return await idempotent("reserve", idempotency_key, payload, lambda: _reserve_booking(payload))
+
+
+async def _reserve_booking(payload: BookingRequest) -> BookingResponse:
     if not payload.safe_location_confirmed:
         raise HTTPException(status_code=400, detail="Safe working location confirmation is required")
 
@@ -883,32 +941,48 @@ async def reserve_booking(payload: BookingRequest):
     payment_token = generate_payment_token()
     payment_url = f"{SITE_URL}/pay/{payment_token}"
 
-    await insert_booking(
-        id=booking_id,
-        payment_link_token=payment_token,
-        full_name=payload.full_name,
-        email=payload.email,
-        phone=payload.phone,
-        postcode=payload.postcode,
-        address_line_1=payload.address_line_1,
-        town_city=payload.town_city,
-        vehicle_reg=payload.vehicle_registration,
-        vehicle_make=payload.vehicle_make,
-        vehicle_model=payload.vehicle_model,
-        approx_mileage=payload.approximate_mileage,
-        symptoms=payload.symptoms,
-        additional_notes=payload.additional_notes,
-        safe_location=payload.safe_location_confirmed,
-        service_ids=",".join(payload.service_ids),
-        slot_start_iso=slot_start.isoformat(),
-        slot_end_iso=slot_end.isoformat(),
-        zone=zone_data.zone,
-        drive_time_mins=drive_time_mins,
-        travel_buffer=travel_buffer,
-        total_amount=total_pence,
-        deposit_amount=deposit_pence,
-        balance_due=balance_pence,
-    )
+    # Re-check the slot: availability may be minutes old and another customer
+    # may be reserving it right now. insert_booking checks held/paid bookings
+    # in the same transaction as the insert; the calendar set is cached.
+    await expire_old_pending_bookings(PENDING_BOOKING_TTL_MINS)
+    day_start = datetime.combine(slot_start.date(), time(0, tzinfo=LOCAL_TZ))
+    try:
+        busy_intervals = _cached_busy_intervals(day_start - timedelta(hours=6), day_start + timedelta(hours=30))
+    except Exception as e:
+        logger.warning("Calendar check skipped for reserve: %s", e)
+        busy_intervals = []
+
+    try:
+        await insert_booking(
+            id=booking_id,
+            payment_link_token=payment_token,
+            full_name=payload.full_name,
+            email=payload.email,
+            phone=payload.phone,
+            postcode=payload.postcode,
+            address_line_1=payload.address_line_1,
+            town_city=payload.town_city,
+            vehicle_reg=payload.vehicle_registration,
+            vehicle_make=payload.vehicle_make,
+            vehicle_model=payload.vehicle_model,
+            approx_mileage=payload.approximate_mileage,
+            symptoms=payload.symptoms,
+            additional_notes=payload.additional_notes,
+            safe_location=payload.safe_location_confirmed,
+            service_ids=",".join(payload.service_ids),
+            slot_start_iso=slot_start.isoformat(),
+            slot_end_iso=slot_end.isoformat(),
+            zone=zone_data.zone,
+            drive_time_mins=drive_time_mins,
+            travel_buffer=travel_buffer,
+            total_amount=total_pence,
+            deposit_amount=deposit_pence,
+            balance_due=balance_pence,
+            busy_intervals=busy_intervals,
+        )
+    except SlotConflictError as e:
+        logger.info("Reserve rejected: %s", e)
+        raise HTTPException(status_code=409, detail="Sorry, that slot has just been taken. Please choose another time.")
 
     tech_name = os.getenv("TECH_NAME", "TriPoint Team")
     client_first_name = payload.full_name.strip().split()[0] if payload.full_name.strip() else "there"
@@ -971,6 +1045,7 @@ async def reserve_booking(payload: BookingRequest):
 async def cancel_booking(payload: CancelRequest):
     service = _get_calendar_service()
     service.events().delete(calendarId=CALENDAR_ID, eventId=payload.event_id, sendUpdates="all").execute()
+    _calendar_busy_cache.clear()
     return {"status": "cancelled", "event_id": payload.event_id}
 
 
@@ -988,6 +1063,7 @@ async def reschedule_booking(payload: RescheduleRequest):
     event["end"] = {"dateTime": end.isoformat(), "timeZone": str(LOCAL_TZ)}
 
     updated = service.events().update(calendarId=CALENDAR_ID, eventId=payload.event_id, body=event, sendUpdates="all").execute()
+    _calendar_busy_cache.clear()
     return {"status": "rescheduled", "event_id": updated.get("id"), "start": start.isoformat()}
 
 
@@ -1090,19 +1166,128 @@ async def admin_logout(response: Response):
     return {"authenticated": False}
 
 
+# Totals for admin lists, keyed by endpoint + filters
+_admin_count_cache = TTLCache()
+
+
+class RecordResponse(Response):
+    """JSON straight from db records (records.dumps), skipping jsonable_encoder."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
 @app.get("/admin/bookings")
 async def admin_list_bookings(
     status: str | None = None,
     date_from: str | None = None,
     date_to: str | None = None,
     limit: int = 200,
+    cursor: str | None = None,
+    include_total: bool = False,
+    archived: bool = False,
+    _: dict = Depends(verify_admin_session),
+):
+    """
+    List bookings for admin dashboard, one keyset page at a time (pass back next_cursor).
+    archived=true lists bookings moved to the archive database instead.
+    """
+    from db import count_bookings, list_bookings
+
+    limit = clamp_page_size(limit)
+    try:
+        after = decode_cursor(cursor, 2) if cursor else None
+        rows = await list_bookings(
+            status=status, date_from=date_from, date_to=date_to, limit=limit, after=after, archived=archived
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor or date_from/date_to")
+    last = rows[-1] if len(rows) == limit else None
+    result: dict[str, Any] = {
+        "bookings": rows,
+        "next_cursor": encode_cursor(last["slot_start_ts"], last["id"]) if last else None,
+    }
+    if include_total:
+        key = ("bookings", status, date_from, date_to, archived)
+        total = _admin_count_cache.get(key)
+        if total is None:
+            total = await count_bookings(status=status, date_from=date_from, date_to=date_to, archived=archived)
+            _admin_count_cache.set(key, total)
+        result["total"] = total
+    return RecordResponse(result)
+
+
+@app.get("/admin/bookings/{booking_id}")
+async def admin_get_booking(
+    booking_id: str,
+    _: dict = Depends(verify_admin_session),
+):
+    """One booking, read through to the archive database if it has been archived."""
+    from archive import get_archived_booking
+
+    booking = await get_booking_by_id(booking_id)
+    if booking:
+        return {**booking, "archived": False}
+    booking = await get_archived_booking(booking_id)
+    if not booking:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    return {**booking, "archived": True}
+
+
+@app.post("/admin/archive/run")
+async def admin_run_archive(
+    dry_run: bool = False,
+    _: dict = Depends(verify_admin_session),
+):
+    """Move bookings past ARCHIVE_RETENTION_DAYS (and their reports) to the archive database."""
+    from archive import archive_old_bookings
+
+    return await archive_old_bookings(dry_run=dry_run)
+
+
+@app.post("/admin/media/gc")
+async def admin_run_media_gc(
+    dry_run: bool = False,
+    _: dict = Depends(verify_admin_session),
+):
+    """Remove (or quarantine) files in MEDIA_DIR that no media row references."""
+    from media_gc import collect_media_garbage
+
+    try:
+        return await collect_media_garbage(dry_run=dry_run)
+    except ValueError as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+
+
+def _stats_dates(date_from: str | None, date_to: str | None) -> None:
+    try:
+        for value in (date_from, date_to):
+            if value:
+                date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date_from/date_to must be YYYY-MM-DD")
+
+
+@app.get("/admin/stats")
+async def admin_stats(
+    date_from: str | None = None,
+    date_to: str | None = None,
     _: dict = Depends(verify_admin_session),
 ):
-    """List bookings for admin dashboard."""
-    from db import list_bookings
+    """
+    Dashboard totals by status, zone, service and day for slot dates
+    date_from..date_to (YYYY-MM-DD, inclusive; both optional). Amounts in pence.
+    """
+    from db import booking_stats
 
-    rows = await list_bookings(status=status, date_from=date_from, date_to=date_to, limit=limit)
-    return {"bookings": rows}
+    _stats_dates(date_from, date_to)
+    stats = await booking_stats(date_from=date_from, date_to=date_to)
+    for service_id, entry in stats["by_service"].items():
+        service = SERVICE_CATALOG.get(service_id)
+        entry["label"] = service.label if service else service_id
+    return stats
 
 
 @app.post("/admin/bookings/{booking_id}/complete")
@@ -1111,15 +1296,13 @@ async def admin_complete_booking(
     _: dict = Depends(verify_admin_session),
 ):
     """Mark booking as job completed (COMPLETED_UNPAID)."""
-    from db import update_booking_status
     from services.calendar_service import update_event_colour
 
-    booking = await get_booking_by_id(booking_id)
+    booking = await transition_booking(booking_id, STATUS_DEPOSIT_PAID, STATUS_COMPLETED_UNPAID)
     if not booking:
-        raise HTTPException(status_code=404, detail="Booking not found")
-    if booking.get("status") != STATUS_DEPOSIT_PAID:
+        if not await get_booking_by_id(booking_id):
+            raise HTTPException(status_code=404, detail="Booking not found")
         raise HTTPException(status_code=400, detail="Can only complete bookings with deposit paid")
-    await update_booking_status(booking_id, STATUS_COMPLETED_UNPAID)
     event_id = booking.get("calendar_event_id")
     if event_id:
         try:
@@ -1135,16 +1318,22 @@ async def admin_mark_paid(
     _: dict = Depends(verify_admin_session),
 ):
     """Admin override: mark balance as paid without Stripe."""
-    from db import record_payment_event, update_booking_status
     from services.calendar_service import update_event_colour
 
     booking = await get_booking_by_id(booking_id)
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
-    if booking.get("status") != STATUS_COMPLETED_UNPAID:
+    # Compare-and-set: a Stripe balance payment landing meanwhile wins instead
+    won = await transition_booking(
+        booking_id,
+        STATUS_COMPLETED_UNPAID,
+        STATUS_COMPLETED_PAID,
+        stripe_event_id=f"admin-mark-paid-{booking_id}",
+        event_type="admin_mark_paid",
+        amount=booking.get("balance_due"),
+    )
+    if not won:
         raise HTTPException(status_code=400, detail="Can only mark paid for completed-unpaid bookings")
-    await record_payment_event(booking_id, f"admin-mark-paid-{booking_id}", "admin_mark_paid", booking.get("balance_due"))
-    await update_booking_status(booking_id, STATUS_COMPLETED_PAID)
     event_id = booking.get("calendar_event_id")
     if event_id:
         try:
@@ -1192,10 +1381,70 @@ async def admin_generate_balance_link(
     return {"payment_url": payment_url, "payment_page_url": payment_url, "email_sent": bool(result)}
 
 
+# ── Email campaigns ───────────────────────────────────────────────────────
+
+from email_campaigns import CAMPAIGNS, campaign_status, run_campaign
+
+# One background task per campaign name; sends run off the request path
+_campaign_tasks: dict[str, asyncio.Task] = {}
+
+
+def _campaign_service_labels() -> dict[str, str]:
+    return {sid: s.label for sid, s in SERVICE_CATALOG.items()}
+
+
+def _log_campaign_result(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Campaign run failed: %s", task.exception())
+
+
+@app.post("/admin/campaigns/{name}/run")
+async def admin_run_campaign(
+    name: str,
+    payload: CampaignRunRequest,
+    _: dict = Depends(verify_admin_session),
+):
+    """Queue and send a batch campaign in the background. dry_run returns counts only."""
+    if name not in CAMPAIGNS:
+        raise HTTPException(status_code=404, detail=f"Unknown campaign '{name}'")
+    running = _campaign_tasks.get(name)
+    if running and not running.done():
+        raise HTTPException(status_code=409, detail="Campaign is already running")
+    kwargs = dict(
+        templates=template_service,
+        service_labels=_campaign_service_labels(),
+        days=payload.days,
+        rate_per_minute=payload.rate_per_minute,
+        limit=payload.limit,
+    )
+    if payload.dry_run:
+        return await run_campaign(name, dry_run=True, **kwargs)
+    if not smtp_settings().configured:
+        raise HTTPException(status_code=500, detail="Zoho SMTP not configured")
+    task = asyncio.create_task(run_campaign(name, **kwargs))
+    task.add_done_callback(_log_campaign_result)
+    _campaign_tasks[name] = task
+    return {"campaign": name, "status": "started"}
+
+
+@app.get("/admin/campaigns/{name}")
+async def admin_get_campaign(
+    name: str,
+    _: dict = Depends(verify_admin_session),
+):
+    """Per-status send counts and whether a run is in progress."""
+    if name not in CAMPAIGNS:
+        raise HTTPException(status_code=404, detail=f"Unknown campaign '{name}'")
+    status = await campaign_status(name)
+    task = _campaign_tasks.get(name)
+    status["running"] = bool(task and not task.done())
+    return status
+
+
 # ── Report endpoints ───────────────────────────────────────────────────────
 
 import report_db
-from services.media_storage import MEDIA_DIR, get_serve_url, save_upload, delete_file
+from services.media_storage import MEDIA_DIR, delete_files, get_serve_url, save_upload
 
 
 @app.post("/admin/reports")
@@ -1230,11 +1479,48 @@ async def admin_list_reports(
     q: str | None = None,
     date_from: str | None = None,
     date_to: str | None = None,
+    limit: int = 100,
+    cursor: str | None = None,
+    include_total: bool = False,
+    archived: bool = False,
     _: dict = Depends(verify_admin_session),
 ):
-    """List reports with optional filters."""
-    rows = await report_db.list_reports(status=status, q=q, date_from=date_from, date_to=date_to)
-    return {"reports": rows}
+    """
+    List reports with optional filters, one keyset page at a time (pass back next_cursor).
+    With q, returns the best full-text matches instead (ranked, with snippets, one page).
+    archived=true lists the archive database (no q search there).
+    """
+    limit = clamp_page_size(limit)
+    if archived and q:
+        raise HTTPException(status_code=400, detail="Search is not available for archived reports")
+    if q and q.strip():
+        rows = await report_db.search_reports(
+            q, status=status, date_from=date_from, date_to=date_to, limit=limit
+        )
+        result: dict[str, Any] = {"reports": rows, "next_cursor": None}
+    else:
+        try:
+            after = decode_cursor(cursor, 2) if cursor else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        rows = await report_db.list_reports(
+            status=status, date_from=date_from, date_to=date_to, limit=limit, after=after, archived=archived
+        )
+        last = rows[-1] if len(rows) == limit else None
+        result = {
+            "reports": rows,
+            "next_cursor": encode_cursor(last["created_at"], last["id"]) if last else None,
+        }
+    if include_total:
+        key = ("reports", status, q, date_from, date_to, archived)
+        total = _admin_count_cache.get(key)
+        if total is None:
+            total = await report_db.count_reports(
+                status=status, q=q, date_from=date_from, date_to=date_to, archived=archived
+            )
+            _admin_count_cache.set(key, total)
+        result["total"] = total
+    return RecordResponse(result)
 
 
 @app.get("/admin/reports/{report_id}")
@@ -1242,25 +1528,15 @@ async def admin_get_report(
     report_id: str,
     _: dict = Depends(verify_admin_session),
 ):
-    """Get full nested report (vehicles, faults, tests, media)."""
-    report = await report_db.get_report_by_id(report_id)
-    if not report:
+    """Get full nested report (vehicles, faults, tests, media); archived reports are read-only."""
+    from archive import get_archived_report
+
+    result = await report_db.load_report_tree(report_id) or await get_archived_report(report_id)
+    if not result:
         raise HTTPException(status_code=404, detail="Report not found")
-    vehicles = await report_db.list_vehicles_by_report(report_id)
-    result = dict(report)
-    result["vehicles"] = []
-    for v in vehicles:
-        faults = await report_db.list_faults_by_vehicle(v["id"])
-        tests = await report_db.list_tests_by_vehicle(v["id"])
-        v_copy = dict(v)
-        v_copy["faults"] = faults
-        v_copy["tests"] = tests
-        result["vehicles"].append(v_copy)
-    media = await report_db.list_media_by_report(report_id)
-    for m in media:
+    for m in result["media"]:
         m["url"] = get_serve_url(m["storage_key"])
-    result["media"] = media
-    return result
+    return RecordResponse(result)
 
 
 @app.patch("/admin/reports/{report_id}")
@@ -1324,6 +1600,11 @@ async def admin_patch_report(
             report_id,
             **{k: v for k, v in updates.items() if k in ("status", "customer_name", "customer_email", "customer_phone", "customer_address", "customer_postcode", "report_email_sent", "completed_at")},
         )
+    if updates.get("status") == "COMPLETED":
+        # Freeze the share view now so the customer's first open is a stored read
+        tree = await report_db.load_report_tree(report_id)
+        if tree and tree["status"] == "COMPLETED":
+            await _materialize_share_snapshot(tree)
     return await admin_get_report(report_id)
 
 
@@ -1350,12 +1631,9 @@ async def admin_create_vehicle(
     if not report:
         raise HTTPException(status_code=404, detail="Report not found")
     vehicle_id = report_db.generate_entity_id("veh")
-    vehicles = await report_db.list_vehicles_by_report(report_id)
-    sort_order = max((v.get("sort_order", 0) for v in vehicles), default=0) + 1
     await report_db.insert_vehicle(
         id=vehicle_id,
         report_id=report_id,
-        sort_order=sort_order,
         reg=payload.reg,
         vin=payload.vin,
         make=payload.make,
@@ -1368,6 +1646,81 @@ async def admin_create_vehicle(
     return {"id": vehicle_id}
 
 
+def _dtc_code(code: str) -> str:
+    code = code.strip().upper()
+    if not report_db.DTC_CODE_RE.fullmatch(code):
+        raise HTTPException(status_code=400, detail="code must be a DTC such as P0302")
+    return code
+
+
+@app.get("/admin/stats/dtcs")
+async def admin_dtc_stats(
+    date_from: str | None = None,
+    date_to: str | None = None,
+    make: str | None = None,
+    model: str | None = None,
+    code: str | None = None,
+    limit: int = 20,
+    _: dict = Depends(verify_admin_session),
+):
+    """
+    Most frequent fault codes for faults recorded date_from..date_to
+    (YYYY-MM-DD, inclusive), optionally for one make / model (any case) or
+    one code, including archived reports. Counts faults and distinct vehicles.
+    """
+    _stats_dates(date_from, date_to)
+    codes = await report_db.dtc_counts(
+        date_from=date_from,
+        date_to=date_to,
+        make=make,
+        model=model,
+        code=_dtc_code(code) if code else None,
+        limit=max(1, min(limit, 200)),
+    )
+    return {"date_from": date_from, "date_to": date_to, "make": make, "model": model, "codes": codes}
+
+
+@app.get("/admin/stats/dtcs/{code}/co-occurring")
+async def admin_co_occurring_dtcs(
+    code: str,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    make: str | None = None,
+    model: str | None = None,
+    limit: int = 20,
+    _: dict = Depends(verify_admin_session),
+):
+    """Codes seen on the same vehicles as `code`, with the share of those vehicles."""
+    _stats_dates(date_from, date_to)
+    result = await report_db.co_occurring_dtcs(
+        _dtc_code(code),
+        date_from=date_from,
+        date_to=date_to,
+        make=make,
+        model=model,
+        limit=max(1, min(limit, 200)),
+    )
+    return {"date_from": date_from, "date_to": date_to, "make": make, "model": model, **result}
+
+
+@app.get("/admin/vehicle-history")
+async def admin_vehicle_history(
+    reg: str | None = None,
+    vin: str | None = None,
+    _: dict = Depends(verify_admin_session),
+):
+    """
+    A vehicle's bookings, reports and faults (with DTCs), newest first,
+    including archived ones. reg / VIN match regardless of spacing or case.
+    """
+    from migrations import vehicle_key
+
+    if not vehicle_key(reg) and not vehicle_key(vin):
+        raise HTTPException(status_code=400, detail="Give a registration (reg) or VIN (vin)")
+    events = await report_db.vehicle_timeline(reg=reg, vin=vin)
+    return RecordResponse({"reg_key": vehicle_key(reg), "vin_key": vehicle_key(vin), "events": events})
+
+
 @app.patch("/admin/vehicles/{vehicle_id}")
 async def admin_patch_vehicle(
     vehicle_id: str,
@@ -1391,7 +1744,8 @@ async def admin_delete_vehicle(
     vehicle = await report_db.get_vehicle_by_id(vehicle_id)
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found")
-    await report_db.delete_vehicle(vehicle_id)
+    # Files go only after the rows are committed
+    delete_files(await report_db.delete_vehicle(vehicle_id))
     return {"deleted": True}
 
 
@@ -1405,12 +1759,9 @@ async def admin_create_fault(
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found")
     fault_id = report_db.generate_entity_id("flt")
-    faults = await report_db.list_faults_by_vehicle(vehicle_id)
-    sort_order = max((f.get("sort_order", 0) for f in faults), default=0) + 1
     await report_db.insert_fault(
         id=fault_id,
         vehicle_id=vehicle_id,
-        sort_order=sort_order,
         title=payload.title,
         severity=payload.severity,
         status=payload.status,
@@ -1450,7 +1801,7 @@ async def admin_delete_fault(
     fault = await report_db.get_fault_by_id(fault_id)
     if not fault:
         raise HTTPException(status_code=404, detail="Fault not found")
-    await report_db.delete_fault(fault_id)
+    delete_files(await report_db.delete_fault(fault_id))
     return {"deleted": True}
 
 
@@ -1464,13 +1815,10 @@ async def admin_create_test(
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found")
     test_id = report_db.generate_entity_id("tst")
-    tests = await report_db.list_tests_by_vehicle(vehicle_id)
-    sort_order = max((t.get("sort_order", 0) for t in tests), default=0) + 1
     await report_db.insert_test(
         id=test_id,
         vehicle_id=vehicle_id,
         fault_id=payload.fault_id,
-        sort_order=sort_order,
         test_name=payload.test_name,
         tool_used=payload.tool_used,
         result=payload.result,
@@ -1495,6 +1843,41 @@ async def admin_patch_test(
     return {"id": test_id}
 
 
+async def _series_response(series: Any, test_id: str, points: int, cache: HTTPCache) -> Response:
+    """(x, y) of a stored series for a chart, LTTB-downsampled to `points` (0: all)."""
+    if series is None:
+        raise HTTPException(status_code=404, detail="Series not found")
+    limit = None if points == 0 else max(3, min(points, MAX_CHART_POINTS))
+    # Decoding and downsampling a long capture is CPU work: keep it off the loop
+    x, y = await asyncio.to_thread(series.points, limit)
+    return cache.respond(
+        {
+            "test_id": test_id,
+            "name": series.name,
+            "points": len(series),
+            "x_name": series.x_name,
+            "x": x,
+            "y": y,
+        },
+        cache_control=PRIVATE_NO_CACHE,
+    )
+
+
+@app.get("/admin/tests/{test_id}/series/{name:path}")
+async def admin_get_test_series(
+    test_id: str,
+    name: str,
+    points: int = DEFAULT_CHART_POINTS,
+    cache: HTTPCache = Depends(),
+    _: dict = Depends(verify_admin_session),
+):
+    """
+    A live-data series from a test's readings (its "$series" stub names it),
+    downsampled to `points` for charting; points=0 returns every sample.
+    """
+    return await _series_response(await report_db.get_test_series(test_id, name), test_id, points, cache)
+
+
 @app.delete("/admin/tests/{test_id}")
 async def admin_delete_test(
     test_id: str,
@@ -1507,6 +1890,54 @@ async def admin_delete_test(
     return {"deleted": True}
 
 
+@app.post("/admin/vehicles/{vehicle_id}/scan-import")
+async def admin_import_scan(
+    vehicle_id: str,
+    file: UploadFile = File(...),
+    test_name: str | None = Form(None),
+    tool_used: str | None = Form(None),
+    fault_id: str | None = Form(None),
+    strict: bool = Form(False),
+    _: dict = Depends(verify_admin_session),
+):
+    """
+    Import a diagnostic tool's CSV / XML export (fault memory, actual-values
+    log, value list) as faults and tests of a vehicle, in one transaction.
+    The file is parsed as a stream off the event loop; rows that cannot be
+    mapped are skipped and listed by line, or with strict=true reject the
+    whole import. Imported tests are linked to fault_id when given.
+    """
+    from services.scan_import import SCAN_IMPORT_MAX_BYTES, ScanImportError, parse_scan_export
+
+    vehicle = await report_db.get_vehicle_by_id(vehicle_id)
+    if not vehicle:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    if fault_id:
+        fault = await report_db.get_fault_by_id(fault_id)
+        if not fault or fault.vehicle_id != vehicle_id:
+            raise HTTPException(status_code=400, detail="fault_id must be a fault of this vehicle")
+    if file.size is not None and file.size > SCAN_IMPORT_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"File too large: {file.size} bytes (max {SCAN_IMPORT_MAX_BYTES})")
+
+    def parse() -> tuple[Any, list[dict[str, Any]], list[Any]]:
+        scan = parse_scan_export(file.file, file.filename or "")
+        if strict and scan.error_count:
+            return scan, [], []
+        return scan, scan.fault_records(), scan.test_records(test_name, tool_used, fault_id)
+
+    try:
+        scan, faults, tests = await asyncio.to_thread(parse)
+    except ScanImportError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    summary = scan.summary()
+    if strict and scan.error_count:
+        raise HTTPException(status_code=422, detail=summary)
+    if not faults and not tests:
+        raise HTTPException(status_code=422, detail={**summary, "message": "Nothing to import"})
+    fault_ids, test_ids = await report_db.import_scan(vehicle_id, faults, tests)
+    return {"fault_ids": fault_ids, "test_ids": test_ids, **summary}
+
+
 @app.post("/admin/reports/{report_id}/media")
 async def admin_upload_media(
     report_id: str,
@@ -1569,18 +2000,116 @@ async def admin_delete_media(
     media = await report_db.get_media_by_id(media_id)
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
-    delete_file(media["storage_key"])
-    await report_db.delete_media(media_id)
+    delete_files(await report_db.delete_media(media_id))
     return {"deleted": True}
 
 
-@app.get("/reports/share/{share_token}")
-async def public_get_report_by_share(share_token: str):
-    """Public endpoint: get completed report by share token. No auth."""
-    report = await report_db.get_report_by_share_token(share_token)
+_BATCH_MODELS: dict[tuple[str, str], type[BaseModel]] = {
+    ("create", "vehicle"): VehicleCreateRequest,
+    ("create", "fault"): FaultCreateRequest,
+    ("create", "test"): TestCreateRequest,
+    ("patch", "vehicle"): VehiclePatchRequest,
+    ("patch", "fault"): FaultPatchRequest,
+    ("patch", "test"): TestPatchRequest,
+    ("patch", "media"): MediaPatchRequest,
+}
+_BATCH_ID_PREFIX = {"vehicle": "veh", "fault": "flt", "test": "tst"}
+
+
+@app.post("/admin/reports/{report_id}/batch")
+async def admin_report_batch(
+    report_id: str,
+    payload: ReportBatchRequest,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+    _: dict = Depends(verify_admin_session),
+):
+    """
+    Apply many vehicle / fault / test / media edits in one request and one
+    transaction: all of them or none. `data` takes the same fields as the
+    single-entity endpoints; media can be patched and deleted here but is
+    still created by upload. A create may name itself with a "$ref" that
+    later operations use in place of its id. Returns each operation's id, in
+    order, and the ref -> id map. Retries with the same Idempotency-Key
+    replay the first result.
+    """
+    from services.idempotency import idempotent
+
+    return await idempotent(
+        "report-batch",
+        idempotency_key,
+        {"report_id": report_id, **payload.model_dump()},
+        lambda: _apply_report_batch(report_id, payload),
+    )
+
+
+async def _apply_report_batch(report_id: str, payload: ReportBatchRequest) -> dict[str, Any]:
+    report = await report_db.get_report_by_id(report_id)
     if not report:
-        raise HTTPException(status_code=404, detail="Report not found or not yet completed")
-    vehicles = await report_db.list_vehicles_by_report(report["id"])
+        raise HTTPException(status_code=404, detail="Report not found")
+
+    refs: dict[str, str] = {}
+
+    def resolve(index: int, value: str | None) -> str | None:
+        if value is None or not value.startswith("$"):
+            return value
+        if value not in refs:
+            raise HTTPException(status_code=400, detail=f"Operation {index}: unknown ref {value}")
+        return refs[value]
+
+    operations: list[dict[str, Any]] = []
+    for index, item in enumerate(payload.operations):
+        model = _BATCH_MODELS.get((item.op, item.entity))
+        data: dict[str, Any] = {}
+        if item.op in ("create", "patch"):
+            if model is None:
+                raise HTTPException(status_code=400, detail=f"Operation {index}: cannot {item.op} {item.entity} in a batch")
+            try:
+                parsed = model.model_validate(item.data)
+            except ValidationError as exc:
+                errors = exc.errors(include_url=False, include_context=False)
+                raise HTTPException(
+                    status_code=422,
+                    detail=[{**e, "loc": ["operations", index, "data", *e["loc"]]} for e in errors],
+                )
+            data = parsed.model_dump(exclude_unset=item.op == "patch")
+            for field in ("vehicle_id", "fault_id", "test_id"):
+                if field in data:
+                    data[field] = resolve(index, data[field])
+
+        if item.op == "create":
+            entity_id = report_db.generate_entity_id(_BATCH_ID_PREFIX[item.entity])
+            if item.ref:
+                if item.ref in refs:
+                    raise HTTPException(status_code=400, detail=f"Operation {index}: ref {item.ref} used twice")
+                refs[item.ref] = entity_id
+        else:
+            entity_id = resolve(index, item.id)
+        parent_id = resolve(index, item.parent_id)
+        ids = [resolve(index, i) for i in item.ids or []]
+
+        if item.op in ("patch", "delete") and not entity_id:
+            raise HTTPException(status_code=400, detail=f"Operation {index}: {item.op} needs an id")
+        if item.entity in ("fault", "test") and item.op in ("create", "reorder") and not parent_id:
+            raise HTTPException(status_code=400, detail=f"Operation {index}: {item.op} {item.entity} needs parent_id (the vehicle)")
+        if item.op == "reorder" and (item.entity == "media" or not ids):
+            raise HTTPException(status_code=400, detail=f"Operation {index}: reorder needs ids of vehicles, faults or tests")
+        operations.append(
+            {"op": item.op, "entity": item.entity, "id": entity_id, "parent_id": parent_id, "data": data, "ids": ids}
+        )
+
+    try:
+        storage_keys = await report_db.apply_report_batch(report_id, operations)
+    except report_db.BatchError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    delete_files(storage_keys)
+    return {
+        "results": [{"op": o["op"], "entity": o["entity"], "id": o["id"]} for o in operations],
+        "refs": refs,
+    }
+
+
+def _public_report_view(report: dict[str, Any]) -> dict[str, Any]:
+    """The customer-facing subset of a report tree (load_report_tree)."""
     result = {
         "id": report["id"],
         "status": report["status"],
@@ -1592,9 +2121,7 @@ async def public_get_report_by_share(share_token: str):
         "completed_at": report.get("completed_at"),
         "vehicles": [],
     }
-    for v in vehicles:
-        faults = await report_db.list_faults_by_vehicle(v["id"])
-        tests = await report_db.list_tests_by_vehicle(v["id"])
+    for v in report["vehicles"]:
         v_public = {
             "id": v["id"],
             "reg": v["reg"],
@@ -1605,11 +2132,10 @@ async def public_get_report_by_share(share_token: str):
             "mileage": v["mileage"],
             "drivability_status": v["drivability_status"],
             "notes": v["notes"],
-            "faults": faults,
-            "tests": tests,
+            "faults": v["faults"],
+            "tests": v["tests"],
         }
         result["vehicles"].append(v_public)
-    media = await report_db.list_media_by_report(report["id"])
     result["media"] = [
         {
             "id": m["id"],
@@ -1622,16 +2148,76 @@ async def public_get_report_by_share(share_token: str):
             "fault_id": m.get("fault_id"),
             "test_id": m.get("test_id"),
         }
-        for m in media
+        for m in report["media"]
     ]
     return result
 
 
+def _render_public_report(report: dict[str, Any]) -> tuple[str, bytes]:
+    """(strong etag, JSON body) for a report tree's public view."""
+    body = dumps(_public_report_view(report))
+    return content_etag(body), body
+
+
+async def _materialize_share_snapshot(report: dict[str, Any]) -> tuple[str, bytes]:
+    """Render a completed report's public view and store it for the share link.
+
+    Stored under the revision read with the tree, so an edit racing with this
+    leaves a snapshot that is already stale and never served.
+    """
+    etag, body = _render_public_report(report)
+    await report_db.save_report_snapshot(report["id"], report["revision"], etag, body)
+    return etag, body
+
+
+@app.get("/reports/share/{share_token}")
+async def public_get_report_by_share(share_token: str, cache: HTTPCache = Depends()):
+    """Public endpoint: get completed report by share token. No auth.
+
+    Served from the snapshot stored at completion; rebuilt and stored again
+    only after the report has been edited. Answers 304 to a matching
+    If-None-Match.
+    """
+    from archive import get_archived_report
+
+    snapshot = await report_db.get_report_snapshot(share_token)
+    if snapshot:
+        etag, body = snapshot
+    else:
+        report = await report_db.load_report_tree(share_token=share_token)
+        if report:
+            etag, body = await _materialize_share_snapshot(report)
+        else:
+            # Old share links keep working after the report is archived
+            report = await get_archived_report(share_token=share_token)
+            if not report:
+                raise HTTPException(status_code=404, detail="Report not found or not yet completed")
+            etag, body = _render_public_report(report)
+    return cache.respond(body, etag=etag, cache_control=PRIVATE_NO_CACHE)
+
+
+@app.get("/reports/share/{share_token}/tests/{test_id}/series/{name:path}")
+async def public_get_test_series(
+    share_token: str,
+    test_id: str,
+    name: str,
+    points: int = DEFAULT_CHART_POINTS,
+    cache: HTTPCache = Depends(),
+):
+    """Public endpoint: a chart series of a completed report's test. No auth."""
+    series = await report_db.get_test_series(test_id, name, share_token=share_token)
+    return await _series_response(series, test_id, points, cache)
+
+
 # ── Payment endpoints ─────────────────────────────────────────────────────
 
 @app.get("/payments/{token}/details")
-async def get_payment_details(token: str):
-    """Public endpoint: get booking summary for payment page."""
+async def get_payment_details(token: str, cache: HTTPCache = Depends()):
+    """Public endpoint: get booking summary for payment page.
+
+    Revalidated on every load (ETag of the body), so a refresh of an
+    unchanged booking is a 304.
+    """
     booking = await get_booking_by_token(token)
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found or link expired")
@@ -1646,7 +2232,7 @@ async def get_payment_details(token: str):
     slot_end = datetime.fromisoformat(booking["slot_end_iso"].replace("Z", "+00:00")).astimezone(LOCAL_TZ)
     deposit_pence = booking.get("deposit_amount") or 0
     balance_pence = booking.get("balance_due") or 0
-    return {
+    return cache.respond({
         "booking_id": booking["id"],
         "status": status,
         "full_name": booking["full_name"],
@@ -1660,12 +2246,21 @@ async def get_payment_details(token: str):
         "deposit_gbp": deposit_pence // 100,
         "balance_gbp": balance_pence // 100,
         "total_gbp": (deposit_pence + balance_pence) // 100 if deposit_pence or balance_pence else None,
-    }
+    })
 
 
 @app.post("/payments/deposit-session")
-async def create_deposit_session(payload: DepositSessionRequest):
+async def create_deposit_session(
+    payload: DepositSessionRequest,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+):
     """Create Stripe Checkout session for deposit payment."""
+    from services.idempotency import idempotent
+
+    return await idempotent("deposit-session", idempotency_key, payload, lambda: _create_deposit_session(payload))
+
+
+async def _create_deposit_session(payload: DepositSessionRequest) -> dict[str, str]:
     from services.stripe_service import create_deposit_checkout_session
 
     booking = await get_booking_by_token(payload.token)
@@ -1692,8 +2287,17 @@ async def create_deposit_session(payload: DepositSessionRequest):
 
 
 @app.post("/payments/balance-session")
-async def create_balance_session(payload: DepositSessionRequest):
+async def create_balance_session(
+    payload: DepositSessionRequest,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+):
     """Create Stripe Checkout session for balance payment (customer-facing, no admin auth)."""
+    from services.idempotency import idempotent
+
+    return await idempotent("balance-session", idempotency_key, payload, lambda: _create_balance_session(payload))
+
+
+async def _create_balance_session(payload: DepositSessionRequest) -> dict[str, str]:
     from services.stripe_service import create_balance_checkout_session
 
     booking = await get_booking_by_token(payload.token)
@@ -1719,6 +2323,14 @@ async def create_balance_session(payload: DepositSessionRequest):
     return {"checkout_url": result["url"]}
 
 
+async def _record_unapplied_payment(booking_id: str, stripe_event_id: str, amount: int) -> None:
+    """Keep a payment that did not move its booking (already moved on, or a retry) in payment_events."""
+    if not await get_booking_by_id(booking_id):
+        logger.warning("Stripe webhook: booking not found for %s", booking_id)
+        return
+    await record_payment_event(booking_id, stripe_event_id, "checkout.session.completed", amount)
+
+
 @app.post("/webhooks/stripe")
 async def stripe_webhook(request: Request, stripe_signature: str | None = Header(None, alias="Stripe-Signature")):
     """Handle Stripe webhooks. Must receive raw body for signature verification."""
@@ -1740,21 +2352,23 @@ async def stripe_webhook(request: Request, stripe_signature: str | None = Header
         logger.warning("Stripe webhook: missing metadata booking_id or payment_type")
         return {"received": True}
     stripe_event_id = event.get("id", "")
-    if await payment_event_exists(stripe_event_id):
-        return {"received": True}
-    booking = await get_booking_by_stripe_session(session_id)
-    if not booking:
-        booking = await get_booking_by_id(booking_id)
-    if not booking:
-        logger.warning("Stripe webhook: booking not found for %s", booking_id)
-        return {"received": True}
     amount = session.get("amount_total") or 0
     if payment_type == "deposit":
-        if booking.get("status") != STATUS_PENDING_DEPOSIT:
-            await record_payment_event(booking_id, stripe_event_id, "checkout.session.completed", amount)
-            return {"received": True}
-        inserted = await record_payment_event(booking_id, stripe_event_id, "checkout.session.completed", amount)
-        if not inserted:
+        # Status check, event dedupe and update in one transaction; None if a
+        # retry or another delivery got there first
+        booking = await transition_booking(
+            booking_id,
+            STATUS_PENDING_DEPOSIT,
+            STATUS_DEPOSIT_PAID,
+            stripe_event_id=stripe_event_id,
+            event_type="checkout.session.completed",
+            amount=amount,
+            stripe_checkout_session_id=session_id,
+            stripe_payment_intent_id=session.get("payment_intent"),
+            stripe_customer_id=session.get("customer") or (session.get("customer_details") or {}).get("email"),
+        )
+        if not booking:
+            await _record_unapplied_payment(booking_id, stripe_event_id, amount)
             return {"received": True}
         service_ids = (booking.get("service_ids") or "").split(",")
         service_labels = ", ".join(SERVICE_CATALOG[s].label for s in service_ids if s in SERVICE_CATALOG) or "Diagnostic"
@@ -1764,13 +2378,9 @@ async def stripe_webhook(request: Request, stripe_signature: str | None = Header
         except Exception as e:
             logger.exception("Failed to create calendar event: %s", e)
             event_id = None
-        await update_booking_deposit_paid(
-            booking_id=booking_id,
-            stripe_checkout_session_id=session_id,
-            stripe_payment_intent_id=session.get("payment_intent"),
-            stripe_customer_id=session.get("customer") or (session.get("customer_details") or {}).get("email"),
-            calendar_event_id=event_id,
-        )
+        if event_id:
+            _calendar_busy_cache.clear()
+            await set_calendar_event_id(booking_id, event_id)
         tech_name = os.getenv("TECH_NAME", "TriPoint Team")
         client_first_name = (booking.get("full_name") or "").strip().split()[0] or "there"
         vehicle_make_model = f"{booking.get('vehicle_make') or ''} {booking.get('vehicle_model') or ''}".strip() or "-"
@@ -1810,13 +2420,19 @@ async def stripe_webhook(request: Request, stripe_signature: str | None = Header
                 logger.warning("Could not generate deposit invoice PDF: %s", e)
             _send_zoho_email(result.subject, result.html, [booking["email"]], result.text, reply_to="contact@tripointdiagnostics.co.uk", attachments=attachments or None)
     elif payment_type == "balance":
-        if booking.get("status") != STATUS_COMPLETED_UNPAID:
-            await record_payment_event(booking_id, stripe_event_id, "checkout.session.completed", amount)
-            return {"received": True}
-        inserted = await record_payment_event(booking_id, stripe_event_id, "checkout.session.completed", amount)
-        if not inserted:
+        booking = await transition_booking(
+            booking_id,
+            STATUS_COMPLETED_UNPAID,
+            STATUS_COMPLETED_PAID,
+            stripe_event_id=stripe_event_id,
+            event_type="checkout.session.completed",
+            amount=amount,
+            stripe_balance_session_id=session_id,
+            balance_due=0,
+        )
+        if not booking:
+            await _record_unapplied_payment(booking_id, stripe_event_id, amount)
             return {"received": True}
-        await update_booking_balance_paid(booking_id=booking_id, stripe_balance_session_id=session_id)
         event_id = booking.get("calendar_event_id")
         if event_id:
             try:
@@ -1858,6 +2474,13 @@ async def list_email_templates():
     return template_service.list_templates()
 
 
+@app.post("/api/email/templates/reload", dependencies=[Depends(verify_admin_key)])
+async def reload_email_templates():
+    """Rescan email-templates/ now instead of waiting for the periodic check."""
+    await asyncio.to_thread(template_service.reload)
+    return {"reloaded": True, "templates": len(template_service.list_templates())}
+
+
 @app.get("/api/email/templates/{slug}", dependencies=[Depends(verify_admin_key)])
 async def get_email_template(slug: str, format: str | None = None):
     record = template_service.get_template(slug)
@@ -0,0 +1,234 @@
+"""Move cold bookings out of the hot database.
+
+Paid-up completed jobs and cancelled bookings whose slot is older than the
+retention window (abandoned deposit holds after a much shorter one) are
+moved, with their payment_events and reports (vehicles, faults and their
+fault_dtcs rows, tests and their series, media rows), into the archive
+database that db_pool attaches to every connection as "archive". The hot
+tables and their indexes then only hold live work.
+
+Each batch is two write transactions: copy into the archive (INSERT OR
+REPLACE, so a rerun is harmless), then delete from main. In WAL mode a
+transaction spanning two attached databases is not atomic across them, so the
+copy always commits before anything is deleted. A booking edited between the
+two steps is left in main and picked up by the next run.
+
+Archived rows stay readable: get_archived_booking / get_archived_report here,
+and list_bookings / list_reports(archived=True). Media files are not moved.
+
+    python archive.py                 # archive with the configured retention
+    python archive.py --days 180 --dry-run
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any
+
+from db import STATUS_CANCELLED, STATUS_COMPLETED_PAID
+from db_pool import _require_aiosqlite, read_connection, write_transaction
+from migrations import ARCHIVED_TABLES
+from records import Booking
+from report_db import load_report_tree
+
+logger = logging.getLogger("tripoint.archive")
+
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "365"))
+# Cancelled bookings that never took a deposit (expired holds)
+ARCHIVE_HOLD_RETENTION_DAYS = int(os.getenv("ARCHIVE_HOLD_RETENTION_DAYS", "7"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "200"))
+
+# Rows of each table that belong to the bookings in {ids}, looked up in main
+_SCOPES = {
+    "bookings": "id IN ({ids})",
+    "payment_events": "booking_id IN ({ids})",
+    "diagnostic_reports": "booking_id IN ({ids})",
+    "report_vehicles": "report_id IN (SELECT id FROM main.diagnostic_reports WHERE booking_id IN ({ids}))",
+    "vehicle_faults": """vehicle_id IN (
+        SELECT v.id FROM main.report_vehicles v JOIN main.diagnostic_reports r ON r.id = v.report_id
+        WHERE r.booking_id IN ({ids}))""",
+    "fault_dtcs": """vehicle_id IN (
+        SELECT v.id FROM main.report_vehicles v JOIN main.diagnostic_reports r ON r.id = v.report_id
+        WHERE r.booking_id IN ({ids}))""",
+    "fault_tests": """vehicle_id IN (
+        SELECT v.id FROM main.report_vehicles v JOIN main.diagnostic_reports r ON r.id = v.report_id
+        WHERE r.booking_id IN ({ids}))""",
+    "test_series": """test_id IN (
+        SELECT t.id FROM main.fault_tests t JOIN main.report_vehicles v ON v.id = t.vehicle_id
+        JOIN main.diagnostic_reports r ON r.id = v.report_id WHERE r.booking_id IN ({ids}))""",
+    "media_assets": "report_id IN (SELECT id FROM main.diagnostic_reports WHERE booking_id IN ({ids}))",
+}
+
+
+async def _table_columns(conn: Any, table: str) -> str:
+    async with conn.execute(f"PRAGMA main.table_info({table})") as cursor:
+        return ", ".join(row[1] for row in await cursor.fetchall())
+
+
+async def _candidate_ids(cutoff_ts: int, hold_cutoff_ts: int, limit: int) -> list[str]:
+    async with read_connection() as conn:
+        async with conn.execute(
+            """
+            SELECT id FROM bookings WHERE status = ? AND slot_start_ts < ?
+            UNION ALL
+            SELECT id FROM bookings WHERE status = ? AND slot_start_ts < ?
+                AND (deposit_paid_at IS NULL OR slot_start_ts < ?)
+            LIMIT ?
+            """,
+            (STATUS_COMPLETED_PAID, cutoff_ts, STATUS_CANCELLED, hold_cutoff_ts, cutoff_ts, limit),
+        ) as cursor:
+            return [row[0] async for row in cursor]
+
+
+async def _copy_batch(ids: list[str]) -> dict[str, int]:
+    marks = ", ".join("?" * len(ids))
+    copied: dict[str, int] = {}
+    async with write_transaction() as conn:
+        for table in ARCHIVED_TABLES:
+            columns = await _table_columns(conn, table)
+            cursor = await conn.execute(
+                f"""
+                INSERT OR REPLACE INTO archive.{table} ({columns})
+                SELECT {columns} FROM main.{table} WHERE {_SCOPES[table].format(ids=marks)}
+                """,
+                ids,
+            )
+            copied[table] = cursor.rowcount
+    return copied
+
+
+async def _delete_batch(ids: list[str]) -> dict[str, int]:
+    marks = ", ".join("?" * len(ids))
+    deleted: dict[str, int] = {}
+    async with write_transaction() as conn:
+        # Only bookings unchanged since the copy; the ledger also tells the
+        # stats trigger these rows still count
+        await conn.execute(
+            f"""
+            INSERT OR IGNORE INTO archived_bookings (id, archived_at)
+            SELECT b.id, ? FROM main.bookings b
+            WHERE b.id IN ({marks})
+              AND b.updated_at IS (SELECT a.updated_at FROM archive.bookings a WHERE a.id = b.id)
+            """,
+            [datetime.now(timezone.utc).isoformat(), *ids],
+        )
+        async with conn.execute(f"SELECT id FROM archived_bookings WHERE id IN ({marks})", ids) as cursor:
+            moved = [row[0] async for row in cursor]
+        if not moved:
+            return {}
+        moved_marks = ", ".join("?" * len(moved))
+        # Children first: their scopes look up parents that are still in main
+        for table in reversed(ARCHIVED_TABLES):
+            cursor = await conn.execute(
+                f"DELETE FROM main.{table} WHERE {_SCOPES[table].format(ids=moved_marks)}",
+                moved,
+            )
+            deleted[table] = cursor.rowcount
+    return deleted
+
+
+async def archive_old_bookings(
+    *,
+    retention_days: int | None = None,
+    hold_retention_days: int | None = None,
+    batch_size: int | None = None,
+    max_batches: int | None = None,
+    dry_run: bool = False,
+) -> dict[str, Any]:
+    """Move bookings past retention (and their report rows) to the archive database.
+
+    max_batches bounds one call; the rest is picked up by the next run.
+    """
+    _require_aiosqlite()
+    now = time.time()
+    cutoff_ts = int(now - 86400 * (retention_days if retention_days is not None else ARCHIVE_RETENTION_DAYS))
+    hold_days = hold_retention_days if hold_retention_days is not None else ARCHIVE_HOLD_RETENTION_DAYS
+    hold_cutoff_ts = max(cutoff_ts, int(now - 86400 * hold_days))
+    batch_size = max(1, batch_size or ARCHIVE_BATCH_SIZE)
+
+    summary: dict[str, Any] = {"bookings": 0, "moved": {table: 0 for table in ARCHIVED_TABLES}}
+    if dry_run:
+        ids = await _candidate_ids(cutoff_ts, hold_cutoff_ts, 1_000_000)
+        summary["bookings"] = len(ids)
+        return summary
+
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batches += 1
+        ids = await _candidate_ids(cutoff_ts, hold_cutoff_ts, batch_size)
+        if not ids:
+            break
+        await _copy_batch(ids)
+        deleted = await _delete_batch(ids)
+        if not deleted:
+            # Every candidate changed under us; leave them for the next run
+            break
+        summary["bookings"] += deleted.get("bookings", 0)
+        for table, count in deleted.items():
+            summary["moved"][table] += count
+        if len(ids) < batch_size:
+            break
+    logger.info("Archived %d bookings: %s", summary["bookings"], summary["moved"])
+    return summary
+
+
+# ─── Read-through ───────────────────────────────────────────────────────────
+
+
+async def get_archived_booking(booking_id: str) -> Booking | None:
+    _require_aiosqlite()
+    async with read_connection() as conn:
+        async with conn.execute(f"SELECT {Booking.select()} FROM archive.bookings WHERE id = ?", (booking_id,)) as cursor:
+            row = await cursor.fetchone()
+            return Booking.from_row(row) if row else None
+
+
+async def get_archived_report(
+    report_id: str | None = None,
+    *,
+    share_token: str | None = None,
+) -> dict[str, Any] | None:
+    """
+    An archived report with its vehicles (each with faults and tests) and
+    media, in the same shape as report_db.load_report_tree.
+    """
+    report = await load_report_tree(report_id, share_token=share_token, schema="archive")
+    if report:
+        report["archived"] = True
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move old bookings to the archive database")
+    parser.add_argument("--days", type=int, default=None, help="Retention for completed/cancelled bookings")
+    parser.add_argument("--hold-days", type=int, default=None, help="Retention for never-paid cancelled holds")
+    parser.add_argument("--batch", type=int, default=None, help="Bookings per copy/delete transaction")
+    parser.add_argument("--dry-run", action="store_true", help="Count candidates only")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from db import init_db
+    from db_pool import close_pool
+
+    async def _run() -> dict[str, Any]:
+        await init_db()
+        try:
+            return await archive_old_bookings(
+                retention_days=args.days,
+                hold_retention_days=args.hold_days,
+                batch_size=args.batch,
+                dry_run=args.dry_run,
+            )
+        finally:
+            await close_pool()
+
+    print(asyncio.run(_run()))
+
+
+if __name__ == "__main__":
+    main()
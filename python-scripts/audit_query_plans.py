@@ -0,0 +1,380 @@
+"""
+Query-plan audit for the SQL in db.py and report_db.py.
+
+Builds a throwaway database of realistic size, calls every helper in both
+modules against it while recording the SQL they send (connection trace
+callback), then runs EXPLAIN QUERY PLAN on each distinct statement.
+
+A statement from a hot-path helper FAILS if its plan contains a full table
+scan ("SCAN <table>" with no index). Sorting through a temp b-tree is
+reported as WARN. Helpers marked cold (admin maintenance jobs) are listed
+but never fail the run. The trace callback sees statements with their
+parameters inlined, so the plans are for the literal values used here.
+
+Usage:
+    python audit_query_plans.py
+    python audit_query_plans.py --bookings 50000 --reports 10000 --verbose
+    python audit_query_plans.py --keep /tmp/audit.db
+
+Exit status is 1 when any hot-path statement scans a table.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+# "--" lines are trigger programs reported by the trace callback
+SKIP_PREFIXES = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "PRAGMA", "--")
+FULL_SCAN_RE = re.compile(r"^SCAN (\w+)$")
+FIRST_NAMES = ["James", "Olivia", "Amir", "Chloe", "Daniel", "Priya", "Tom", "Grace", "Kwame", "Sophie"]
+LAST_NAMES = ["Smith", "Jones", "Patel", "Brown", "Taylor", "Khan", "Wilson", "Evans", "Okafor", "Clarke"]
+STATUSES = ["PENDING_DEPOSIT", "DEPOSIT_PAID", "COMPLETED_UNPAID", "COMPLETED_PAID", "CANCELLED"]
+
+
+# ─── Synthetic data ─────────────────────────────────────────────────────────
+
+
+def seed(path, n_bookings, n_reports, rng):
+    """Bulk-load bookings, payments, reports and their children; returns sample keys."""
+    conn = sqlite3.connect(path)
+    start = datetime(2025, 1, 6, 8, 0, tzinfo=timezone.utc)
+    bookings, events = [], []
+    for i in range(n_bookings):
+        slot = start + timedelta(days=i * 730 // max(1, n_bookings), hours=rng.randrange(0, 9))
+        status = rng.choice(STATUSES)
+        created = slot - timedelta(days=rng.randrange(1, 20))
+        completed = (slot + timedelta(hours=2)).isoformat() if status.startswith("COMPLETED") else None
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        bookings.append((
+            f"TPD-{slot:%Y%m%d}-{i:05X}", status, f"tok_{i}", name,
+            f"{name.replace(' ', '.').lower()}{i}@example.com", "07700900000", "SE1 7PB",
+            "1 High Street", "London", f"AB{i % 100:02d}CDE", "Ford", "Focus", "60000",
+            "Engine light", "", 1, "diagnostic", slot.isoformat(),
+            (slot + timedelta(hours=1)).isoformat(), int(slot.timestamp()), int(slot.timestamp()) + 3600, "A", 25, 30, 12000, 3000, 9000,
+            f"cs_test_{i}", f"pi_{i}", f"cus_{i}", f"cs_bal_{i}" if completed else None,
+            created.isoformat(), created.isoformat(), completed,
+        ))
+        if status != "PENDING_DEPOSIT":
+            events.append((bookings[-1][0], f"evt_{i}", "checkout.session.completed", 3000, created.isoformat()))
+    conn.executemany(
+        """
+        INSERT INTO bookings (
+            id, status, payment_link_token, full_name, email, phone, postcode,
+            address_line_1, town_city, vehicle_reg, vehicle_make, vehicle_model,
+            approx_mileage, symptoms, additional_notes, safe_location, service_ids,
+            slot_start_iso, slot_end_iso, slot_start_ts, slot_end_ts, zone, drive_time_mins,
+            travel_buffer, total_amount, deposit_amount, balance_due, stripe_checkout_session_id,
+            stripe_payment_intent_id, stripe_customer_id, stripe_balance_session_id,
+            created_at, updated_at, completed_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        bookings,
+    )
+    conn.executemany(
+        "INSERT INTO payment_events (booking_id, stripe_event_id, event_type, amount, created_at) VALUES (?, ?, ?, ?, ?)",
+        events,
+    )
+
+    reports, vehicles, faults, tests, media = [], [], [], [], []
+    for i, b in enumerate(rng.sample(bookings, min(n_reports, len(bookings)))):
+        rid = f"RPT-{b[17][:10].replace('-', '')}-{i:05X}"
+        created = b[17]
+        reports.append((rid, b[0], rng.choice(["DRAFT", "COMPLETED", "ARCHIVED"]), f"share_{i}",
+                        b[3], b[4], created, created))
+        for v in range(rng.randrange(1, 3)):
+            vid = f"veh_{i}_{v}"
+            vehicles.append((vid, rid, v, b[9], created, created))
+            for f in range(2):
+                fid = f"flt_{i}_{v}_{f}"
+                faults.append((fid, vid, f, "Misfire cylinder 2", '["P0302"]', created, created))
+                tests.append((f"tst_{i}_{v}_{f}", vid, fid, f, "Compression test", created, created))
+            media.append((f"med_{i}_{v}", rid, vid, f"flt_{i}_{v}_0", None, "image", "photo.jpg",
+                          f"reports/{rid}/photo_{v}.jpg", "image/jpeg", 120_000, created))
+    conn.executemany(
+        """
+        INSERT INTO diagnostic_reports (id, booking_id, status, share_token, customer_name,
+            customer_email, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        reports,
+    )
+    conn.executemany(
+        "INSERT INTO report_vehicles (id, report_id, sort_order, reg, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+        vehicles,
+    )
+    conn.executemany(
+        """
+        INSERT INTO vehicle_faults (id, vehicle_id, sort_order, title, dtcs, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        faults,
+    )
+    conn.executemany(
+        """
+        INSERT INTO fault_tests (id, vehicle_id, fault_id, sort_order, test_name, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        tests,
+    )
+    conn.executemany(
+        """
+        INSERT INTO media_assets (id, report_id, vehicle_id, fault_id, test_id, media_type, filename,
+            storage_key, content_type, size_bytes, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        media,
+    )
+    conn.commit()
+    conn.close()
+    b, r = bookings[len(bookings) // 2], reports[len(reports) // 2]
+    return {
+        "booking_id": b[0], "token": b[2], "session": b[27], "slot": datetime.fromisoformat(b[17]),
+        "report_id": r[0], "share_token": r[3], "customer": r[4],
+        "vehicle_id": vehicles[-1][0], "fault_id": faults[-1][0], "test_id": tests[-1][0],
+        "media_id": media[-1][0], "reg": b[9],
+    }
+
+
+# ─── Helper calls ───────────────────────────────────────────────────────────
+
+
+async def _reserve(db, start):
+    try:
+        await db.insert_booking(
+            id="TP-AUDIT-RESERVE", payment_link_token="audit_reserve", full_name="Audit", email="audit@example.com",
+            phone="07700900000", postcode="MK1 1AA", address_line_1="1 Audit St", town_city="Milton Keynes",
+            vehicle_reg="AB12CDE", vehicle_make="Ford", vehicle_model="Focus", approx_mileage="60000", symptoms="",
+            additional_notes=None, safe_location=True, service_ids="diagnostic", slot_start_iso=start.isoformat(),
+            slot_end_iso=(start + timedelta(hours=1)).isoformat(), zone="A", drive_time_mins=20, travel_buffer=30,
+            total_amount=12000, deposit_amount=3000, balance_due=9000,
+        )
+    except db.SlotConflictError:
+        pass
+
+
+async def _first_archived_report(report_db, archive):
+    rows = await report_db.list_reports(archived=True, limit=1)
+    return await archive.get_archived_report(rows[0]["id"]) if rows else None
+
+
+def exercises(db, report_db, k):
+    """(label, hot, zero-arg coroutine factory) for every helper in both modules."""
+    import archive
+    import media_gc
+
+    now = datetime.now(timezone.utc)
+    bid, rid, vid = k["booking_id"], k["report_id"], k["vehicle_id"]
+    return [
+        ("get_booking_by_token", True, lambda: db.get_booking_by_token(k["token"])),
+        ("get_booking_by_id", True, lambda: db.get_booking_by_id(bid)),
+        ("get_booking_by_stripe_session", True, lambda: db.get_booking_by_stripe_session(k["session"])),
+        ("record_payment_event", True, lambda: db.record_payment_event(bid, "evt_audit", "checkout.session.completed", 3000)),
+        ("set_stripe_deposit_session", True, lambda: db.set_stripe_deposit_session(bid, "cs_audit")),
+        ("set_stripe_balance_session", True, lambda: db.set_stripe_balance_session(bid, "cs_audit_bal")),
+        ("transition_booking(deposit)", True, lambda: db.transition_booking(
+            bid, tuple(STATUSES), "DEPOSIT_PAID", stripe_event_id="evt_audit_dep",
+            event_type="checkout.session.completed", amount=3000, stripe_checkout_session_id="cs_audit")),
+        ("transition_booking(complete)", True, lambda: db.transition_booking(bid, "DEPOSIT_PAID", "COMPLETED_UNPAID")),
+        ("transition_booking(balance)", True, lambda: db.transition_booking(
+            bid, "COMPLETED_UNPAID", "COMPLETED_PAID", stripe_event_id="evt_audit_bal",
+            event_type="checkout.session.completed", amount=9000, stripe_balance_session_id="cs_audit_bal", balance_due=0)),
+        ("set_calendar_event_id", True, lambda: db.set_calendar_event_id(bid, "cal_audit")),
+        ("insert_booking", True, lambda: _reserve(db, k["slot"] + timedelta(minutes=30))),
+        ("claim_idempotency_key", True, lambda: db.claim_idempotency_key("reserve", "audit-key", "hash", 3600)),
+        ("save_idempotent_response", True, lambda: db.save_idempotent_response("reserve", "audit-key", 200, "{}")),
+        ("claim_idempotency_key(replay)", True, lambda: db.claim_idempotency_key("reserve", "audit-key", "hash", 3600)),
+        ("get_idempotency_key", True, lambda: db.get_idempotency_key("reserve", "audit-key")),
+        ("release_idempotency_key", True, lambda: db.release_idempotency_key("reserve", "audit-key")),
+        ("get_blocked_slot_intervals", True, lambda: db.get_blocked_slot_intervals(k["slot"], k["slot"] + timedelta(days=14), 30)),
+        ("list_bookings", True, lambda: db.list_bookings()),
+        ("list_bookings(status)", True, lambda: db.list_bookings(status="DEPOSIT_PAID")),
+        ("list_bookings(dates)", True, lambda: db.list_bookings(date_from=k["slot"].date().isoformat(), date_to=(k["slot"] + timedelta(days=7)).date().isoformat())),
+        ("expire_old_pending_bookings", True, lambda: db.expire_old_pending_bookings(30)),
+        ("enqueue_campaign_targets", False, lambda: db.enqueue_campaign_targets(
+            "review-request", status="COMPLETED_PAID", completed_after=(now - timedelta(days=400)).isoformat(), limit=50)),
+        ("release_stale_campaign_sends", True, lambda: db.release_stale_campaign_sends("review-request", "2024-01-01")),
+        ("skip_stale_campaign_sends", True, lambda: db.skip_stale_campaign_sends("review-request", "COMPLETED_PAID")),
+        ("list_pending_campaign_sends", False, lambda: db.list_pending_campaign_sends("review-request", "COMPLETED_PAID", limit=50)),
+        ("claim_campaign_send", True, lambda: db.claim_campaign_send(1, "COMPLETED_PAID")),
+        ("mark_campaign_send", True, lambda: db.mark_campaign_send(1, "SENT")),
+        ("campaign_send_counts", True, lambda: db.campaign_send_counts("review-request")),
+        ("insert_report", True, lambda: report_db.insert_report(id="RPT-AUDIT-0001", booking_id=bid, customer_name="Audit", customer_email="a@example.com")),
+        ("get_report_by_id", True, lambda: report_db.get_report_by_id(rid)),
+        ("get_report_by_share_token", True, lambda: report_db.get_report_by_share_token(k["share_token"])),
+        ("booking_stats(all days)", False, lambda: db.booking_stats()),
+        ("booking_stats(month)", True, lambda: db.booking_stats("2025-06-01", "2025-06-30")),
+        ("dtc_counts(all time)", False, lambda: report_db.dtc_counts()),
+        ("dtc_counts(quarter)", True, lambda: report_db.dtc_counts(date_from="2025-04-01", date_to="2025-06-30")),
+        ("dtc_counts(model)", True, lambda: report_db.dtc_counts(model="sprinter", date_from="2025-01-01")),
+        ("dtc_counts(code)", True, lambda: report_db.dtc_counts(code="P0302", date_from="2025-04-01", date_to="2025-06-30")),
+        ("co_occurring_dtcs", True, lambda: report_db.co_occurring_dtcs("P0300", date_from="2025-01-01")),
+        ("list_reports", True, lambda: report_db.list_reports()),
+        ("list_reports(status)", True, lambda: report_db.list_reports(status="COMPLETED")),
+        ("list_reports(q=name)", True, lambda: report_db.list_reports(q=k["customer"].split()[0].lower())),
+        ("list_reports(q=id)", True, lambda: report_db.list_reports(q=rid[:12].lower())),
+        ("list_reports(dates)", True, lambda: report_db.list_reports(date_from="2025-06-01", date_to="2025-06-30")),
+        ("search_reports(name)", True, lambda: report_db.search_reports(k["customer"].split()[0])),
+        ("search_reports(dtc)", True, lambda: report_db.search_reports("P0302", status="COMPLETED")),
+        ("update_report", True, lambda: report_db.update_report(rid, customer_name="Audit Name")),
+        ("ensure_share_token", True, lambda: report_db.ensure_share_token(rid)),
+        ("insert_vehicle", True, lambda: report_db.insert_vehicle(id="veh_audit", report_id=rid, reg="AU01DIT")),
+        ("get_vehicle_by_id", True, lambda: report_db.get_vehicle_by_id(vid)),
+        ("list_vehicles_by_report", True, lambda: report_db.list_vehicles_by_report(rid)),
+        ("update_vehicle", True, lambda: report_db.update_vehicle(vid, notes="audit")),
+        ("insert_fault", True, lambda: report_db.insert_fault(id="flt_audit", vehicle_id="veh_audit", title="Audit", dtcs=["P0300"])),
+        ("get_fault_by_id", True, lambda: report_db.get_fault_by_id(k["fault_id"])),
+        ("list_faults_by_vehicle", True, lambda: report_db.list_faults_by_vehicle(vid)),
+        ("update_fault", True, lambda: report_db.update_fault(k["fault_id"], severity="HIGH")),
+        ("insert_test", True, lambda: report_db.insert_test(id="tst_audit", vehicle_id="veh_audit", fault_id="flt_audit", test_name="Audit")),
+        ("get_test_by_id", True, lambda: report_db.get_test_by_id(k["test_id"])),
+        ("list_tests_by_vehicle", True, lambda: report_db.list_tests_by_vehicle(vid)),
+        ("update_test", True, lambda: report_db.update_test(k["test_id"], result="PASS")),
+        ("update_test(readings)", True, lambda: report_db.update_test(k["test_id"], readings={"t": list(range(100)), "v": [0.5] * 100})),
+        ("get_test_series", True, lambda: report_db.get_test_series(k["test_id"], "v")),
+        ("get_test_series(share)", True, lambda: report_db.get_test_series(k["test_id"], "v", share_token=k["share_token"])),
+        ("insert_media", True, lambda: report_db.insert_media(
+            id="med_audit", report_id=rid, vehicle_id="veh_audit", fault_id="flt_audit", test_id="tst_audit",
+            media_type="image", filename="a.jpg", storage_key="reports/audit/a.jpg", content_type="image/jpeg", size_bytes=1)),
+        ("get_media_by_id", True, lambda: report_db.get_media_by_id(k["media_id"])),
+        ("list_media_by_report", True, lambda: report_db.list_media_by_report(rid)),
+        ("load_report_tree", True, lambda: report_db.load_report_tree(rid)),
+        ("load_report_tree(share)", True, lambda: report_db.load_report_tree(share_token=k["share_token"])),
+        ("save_report_snapshot", True, lambda: report_db.save_report_snapshot(rid, 0, '"audit"', b"{}")),
+        ("get_report_snapshot", True, lambda: report_db.get_report_snapshot(k["share_token"])),
+        ("update_media", True, lambda: report_db.update_media(k["media_id"], caption="audit")),
+        ("apply_report_batch", True, lambda: report_db.apply_report_batch(rid, [
+            {"op": "create", "entity": "fault", "id": "flt_batch", "parent_id": "veh_audit", "data": {"title": "Batch"}},
+            {"op": "patch", "entity": "fault", "id": "flt_batch", "data": {"severity": "LOW"}},
+            {"op": "patch", "entity": "media", "id": "med_audit", "data": {"caption": "batch"}},
+            {"op": "reorder", "entity": "fault", "parent_id": "veh_audit", "ids": ["flt_batch", "flt_audit"]},
+            {"op": "delete", "entity": "fault", "id": "flt_batch"},
+        ])),
+        ("delete_test", True, lambda: report_db.delete_test("tst_audit")),
+        ("delete_fault", True, lambda: report_db.delete_fault("flt_audit")),
+        ("delete_media", True, lambda: report_db.delete_media("med_audit")),
+        ("delete_vehicle", True, lambda: report_db.delete_vehicle(vid)),
+        ("archive_report", True, lambda: report_db.archive_report(rid)),
+        ("archive_old_bookings", True, lambda: archive.archive_old_bookings(batch_size=50, max_batches=1)),
+        ("list_bookings(archived)", True, lambda: db.list_bookings(archived=True, status="COMPLETED_PAID")),
+        ("list_reports(archived)", True, lambda: report_db.list_reports(archived=True, limit=100)),
+        ("get_archived_booking", True, lambda: archive.get_archived_booking(bid)),
+        ("get_archived_report", True, lambda: _first_archived_report(report_db, archive)),
+        ("vehicle_timeline(reg)", True, lambda: report_db.vehicle_timeline(reg=k["reg"].lower())),
+        ("vehicle_timeline(vin)", True, lambda: report_db.vehicle_timeline(vin="WBA00000000000000")),
+        ("media_gc._referenced", True, lambda: media_gc._referenced(["audit/a.jpg", "audit/b.jpg"])),
+        ("media_gc._drop_archived_media", False, lambda: media_gc._drop_archived_media(36500, None, True)),
+    ]
+
+
+async def capture(path, n_bookings, n_reports, rng):
+    import db
+    import report_db
+    from db_pool import close_pool, get_pool
+
+    await db.init_db()
+    keys = seed(path, n_bookings, n_reports, rng)
+
+    pool = await get_pool()
+    captured = []
+    current = {"label": None}
+
+    def on_sql(sql):
+        captured.append((current["label"], sql))
+
+    for conn in [pool._writer, *pool._readers]:
+        await conn.set_trace_callback(on_sql)
+
+    timings = {}
+    hot = {}
+    try:
+        for label, is_hot, call in exercises(db, report_db, keys):
+            current["label"] = label
+            hot[label] = is_hot
+            start = time.perf_counter()
+            await call()
+            timings[label] = time.perf_counter() - start
+    finally:
+        await close_pool()
+    return captured, timings, hot
+
+
+# ─── Plans ──────────────────────────────────────────────────────────────────
+
+
+def explain(conn, sql):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+
+
+def classify(plan):
+    # Scanning a materialized subquery reads its (bounded) result, not a table
+    materialized = {line.split()[-1] for line in plan if line.startswith("MATERIALIZE ")}
+    scans = (FULL_SCAN_RE.match(line) for line in plan)
+    if any(m and m.group(1) not in materialized for m in scans):
+        return "FAIL"
+    if any("TEMP B-TREE" in line for line in plan):
+        return "WARN"
+    return "OK"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN QUERY PLAN audit of db.py / report_db.py")
+    parser.add_argument("--bookings", type=int, default=20000, help="Synthetic bookings to seed")
+    parser.add_argument("--reports", type=int, default=5000, help="Synthetic reports to seed")
+    parser.add_argument("--seed", type=int, default=7, help="Random seed")
+    parser.add_argument("--keep", metavar="PATH", help="Write the synthetic DB here and keep it")
+    parser.add_argument("--verbose", action="store_true", help="Print the plan of every statement")
+    args = parser.parse_args()
+
+    tmp = None
+    if args.keep:
+        path = args.keep
+        if os.path.exists(path):
+            sys.exit(f"{path} already exists")
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name, "audit.db")
+    # Read by db_pool at import time
+    os.environ["BOOKINGS_DB_PATH"] = path
+
+    captured, timings, hot = asyncio.run(capture(path, args.bookings, args.reports, random.Random(args.seed)))
+
+    from db_pool import ARCHIVE_DB_PATH
+
+    conn = sqlite3.connect(path)
+    conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_PATH,))
+    seen = set()
+    failures = warnings = 0
+    print(f"Seeded {args.bookings} bookings / {args.reports} reports, SQLite {sqlite3.sqlite_version}\n")
+    print(f"{'RESULT':<6} {'HELPER':<30} {'MS':>7}  STATEMENT")
+    print("-" * 100)
+    for label, sql in captured:
+        statement = " ".join(sql.split())
+        if statement.upper().startswith(SKIP_PREFIXES) or (label, statement) in seen:
+            continue
+        seen.add((label, statement))
+        plan = explain(conn, statement)
+        result = classify(plan)
+        if result == "FAIL" and not hot[label]:
+            result = "cold"
+        failures += result == "FAIL"
+        warnings += result == "WARN"
+        print(f"{result:<6} {label:<30} {timings[label] * 1000:>7.2f}  {statement[:120]}")
+        if args.verbose or result in ("FAIL", "cold"):
+            for line in plan:
+                print(f"{'':<46}  | {line}")
+    conn.close()
+    if tmp is not None:
+        tmp.cleanup()
+
+    print("-" * 100)
+    print(f"{len(seen)} statements, {failures} full scans on hot paths, {warnings} temp b-tree sorts")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark for SQLite write throughput under concurrent writers.
+
+Fires N concurrent small write transactions (one payment_events insert each)
+at a scratch database and reports writes/sec for:
+
+  connect  - a fresh aiosqlite connection + commit per write (pre-pool behaviour)
+  percall  - one shared connection, BEGIN IMMEDIATE / COMMIT per write
+  group    - db_pool's writer task with group commit (what db.py uses)
+
+Usage:
+    python bench_db_writes.py
+    python bench_db_writes.py --writes 5000 --concurrency 200
+    python bench_db_writes.py --synchronous FULL   # fsync per commit
+
+With the default synchronous=NORMAL a WAL commit does not fsync, so batching
+mostly saves lock churn; with FULL every commit is an fsync and group commit
+pays for itself.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import aiosqlite
+
+INSERT_SQL = (
+    "INSERT INTO payment_events (stripe_event_id, booking_id, event_type, amount, created_at) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+
+
+def _params(i):
+    return (f"evt_bench_{i}", "TP-BENCH", "checkout.session.completed", 2000, "2026-01-01T00:00:00Z")
+
+
+async def _run_concurrent(write, writes, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            await write(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(writes)))
+    return time.perf_counter() - start
+
+
+async def bench_connect(path, writes, concurrency):
+    from db_pool import CONNECTION_PRAGMAS
+
+    async def write(i):
+        async with aiosqlite.connect(path, timeout=30) as conn:
+            for pragma in CONNECTION_PRAGMAS:
+                await conn.execute(pragma)
+            await conn.execute(INSERT_SQL, _params(i))
+            await conn.commit()
+
+    return await _run_concurrent(write, writes, concurrency), None
+
+
+async def bench_percall(path, writes, concurrency):
+    from db_pool import CONNECTION_PRAGMAS
+
+    conn = await aiosqlite.connect(path, isolation_level=None)
+    for pragma in CONNECTION_PRAGMAS:
+        await conn.execute(pragma)
+    lock = asyncio.Lock()
+
+    async def write(i):
+        async with lock:
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                await conn.execute(INSERT_SQL, _params(i))
+            except BaseException:
+                await conn.execute("ROLLBACK")
+                raise
+            await conn.execute("COMMIT")
+
+    try:
+        return await _run_concurrent(write, writes, concurrency), None
+    finally:
+        await conn.close()
+
+
+async def bench_group(path, writes, concurrency):
+    from db_pool import ConnectionPool
+
+    pool = ConnectionPool(path, readers=1)
+    await pool.open()
+
+    async def write(i):
+        async with pool.transaction() as conn:
+            await conn.execute(INSERT_SQL, _params(i))
+
+    try:
+        return await _run_concurrent(write, writes, concurrency), dict(pool.stats)
+    finally:
+        await pool.close()
+
+
+MODES = {"connect": bench_connect, "percall": bench_percall, "group": bench_group}
+
+
+async def main_async(args):
+    from db_pool import SYNCHRONOUS
+    from migrations import run_migrations
+
+    print(f"{args.writes} writes, concurrency {args.concurrency}, synchronous={SYNCHRONOUS}")
+    print(f"{'MODE':<9} {'SECONDS':>8} {'WRITES/S':>10} {'TXNS':>7} {'BLOCKS/TXN':>11}")
+    print("-" * 50)
+    baseline = None
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            async with aiosqlite.connect(path, isolation_level=None) as conn:
+                await run_migrations(conn)
+            elapsed, stats = await MODES[mode](path, args.writes, args.concurrency)
+        rate = args.writes / elapsed
+        baseline = baseline or rate
+        txns = stats["transactions"] if stats else args.writes
+        print(
+            f"{mode:<9} {elapsed:>8.2f} {rate:>10.0f} {txns:>7} {args.writes / max(1, txns):>11.1f}"
+            f"   ({rate / baseline:.1f}x vs {args.modes[0]})"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SQLite write throughput")
+    parser.add_argument("--writes", type=int, default=2000, help="Total write transactions")
+    parser.add_argument("--concurrency", type=int, default=100, help="Writers in flight at once")
+    parser.add_argument("--synchronous", choices=["NORMAL", "FULL"], default=None, help="Override DB_SYNCHRONOUS")
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=["connect", "percall", "group"])
+    args = parser.parse_args()
+    if args.synchronous:
+        # Read by db_pool at import time
+        os.environ["DB_SYNCHRONOUS"] = args.synchronous
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
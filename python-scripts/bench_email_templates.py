@@ -0,0 +1,93 @@
+"""
+Benchmark for EmailTemplateService rendering.
+
+Renders every template in email-templates/ with the sample data from
+test_email_api.py, comparing the precompiled segment renderer against the
+previous regex-substitution approach (kept here only as a baseline).
+
+Usage:
+    python bench_email_templates.py
+    python bench_email_templates.py --iterations 5000
+"""
+
+import argparse
+import html
+import time
+
+from email_templates import (
+    HTML_FRAGMENT_PLACEHOLDERS,
+    _PLACEHOLDER_RE,
+    EmailTemplateService,
+    minify_html,
+)
+from test_email_api import SAMPLE_DATA
+
+
+def legacy_render(record, data):
+    """The pre-compilation renderer: regex sub per field, then findall for missing keys."""
+
+    def replace(template, escape_html):
+        def replacer(match):
+            key = match.group(1)
+            if key not in data:
+                return match.group(0)
+            value = data[key]
+            if escape_html and key not in HTML_FRAGMENT_PLACEHOLDERS:
+                value = html.escape(value)
+            return value
+
+        return _PLACEHOLDER_RE.sub(replacer, template)
+
+    rendered_html = replace(record.html or "", True)
+    rendered_text = replace(record.text or "", False)
+    rendered_subject = replace(record.subject, False)
+    remaining = set()
+    for content in (rendered_html, rendered_text, rendered_subject):
+        remaining.update(_PLACEHOLDER_RE.findall(content))
+    return rendered_html, rendered_text, rendered_subject, sorted(remaining)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark email template rendering")
+    parser.add_argument("--iterations", type=int, default=2000, help="Renders per template")
+    args = parser.parse_args()
+
+    service = EmailTemplateService()
+    templates = service.list_templates()
+    if not templates:
+        print("No templates found")
+        return
+
+    data = dict(SAMPLE_DATA)
+    records = [service.get_template(t["slug"]) for t in templates]
+
+    print(f"{'SLUG':<28} {'HTML':>7} {'MINIFIED':>9} {'LEGACY us':>10} {'COMPILED us':>12} {'SPEEDUP':>8}")
+    print("-" * 80)
+    total_legacy = total_compiled = 0.0
+    for record in records:
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            legacy_render(record, data)
+        legacy = (time.perf_counter() - start) / args.iterations
+
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            service.render(record.slug, data)
+        compiled = (time.perf_counter() - start) / args.iterations
+
+        total_legacy += legacy
+        total_compiled += compiled
+        print(
+            f"{record.slug:<28} {len(record.html or ''):>7} {len(minify_html(record.html or '')):>9} "
+            f"{legacy * 1e6:>10.1f} {compiled * 1e6:>12.1f} {legacy / compiled:>7.1f}x"
+        )
+
+    print("-" * 80)
+    print(
+        f"{'ALL (' + str(len(records)) + ' templates)':<28} {'':>7} {'':>9} "
+        f"{total_legacy * 1e6:>10.1f} {total_compiled * 1e6:>12.1f} {total_legacy / total_compiled:>7.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
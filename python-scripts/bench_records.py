@@ -0,0 +1,141 @@
+"""
+Benchmark for listing bookings: dict(aiosqlite.Row) vs typed records.
+
+Seeds a scratch database with N bookings and times one full listing plus its
+JSON serialisation, as the admin bookings endpoint does it:
+
+  dicts    - SELECT *, dict(row) per row, FastAPI's jsonable_encoder + json.dumps
+             (pre-records behaviour)
+  records  - db.list_bookings (explicit columns, slotted Booking records)
+             + records.dumps (orjson when installed)
+
+and reports wall time, tracemalloc peak memory, and the memory still held by
+the listed rows once the response body is gone.
+
+Usage:
+    python bench_records.py
+    python bench_records.py --bookings 50000 --rounds 5
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import aiosqlite
+
+
+async def _seed(path, count):
+    from migrations import run_migrations
+
+    async with aiosqlite.connect(path, isolation_level=None) as conn:
+        await run_migrations(conn)
+        await conn.execute("BEGIN")
+        base = 1_790_000_000
+        rows = []
+        for i in range(count):
+            start = base + i * 1800
+            rows.append((
+                f"TP-BENCH{i:06d}", "COMPLETED_PAID", f"tok{i:06d}", f"Customer {i}",
+                f"c{i}@example.com", "07700900000", "MK1 1AA", "1 Test Street", "Milton Keynes",
+                f"AB{i % 100:02d} CDE", "Ford", "Transit", "80000", "Engine light on", None, 1,
+                "diagnostic,coding", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(start)),
+                time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(start + 3600)), "A", 25, 30,
+                15000, 5000, 10000, "gbp", "2026-01-01T00:00:00Z", "2026-01-01T00:00:00Z",
+            ))
+        await conn.executemany(
+            """
+            INSERT INTO bookings (
+                id, status, payment_link_token, full_name, email, phone, postcode, address_line_1,
+                town_city, vehicle_reg, vehicle_make, vehicle_model, approx_mileage, symptoms,
+                additional_notes, safe_location, service_ids, slot_start_iso, slot_end_iso, zone,
+                drive_time_mins, travel_buffer, total_amount, deposit_amount, balance_due, currency,
+                created_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        await conn.execute("COMMIT")
+
+
+async def list_dicts(count):
+    from fastapi.encoders import jsonable_encoder
+
+    from db_pool import read_connection
+
+    async with read_connection() as conn:
+        async with conn.execute("SELECT * FROM bookings ORDER BY slot_start_ts DESC LIMIT ?", (count,)) as cursor:
+            rows = [dict(r) async for r in cursor]
+    return rows, json.dumps(jsonable_encoder({"items": rows})).encode()
+
+
+async def list_records(count):
+    import db
+    from records import dumps
+
+    rows = await db.list_bookings(limit=count)
+    return rows, dumps({"items": rows})
+
+
+MODES = {"dicts": list_dicts, "records": list_records}
+
+
+async def _measure(fn, count, rounds):
+    await fn(count)  # warm the page cache and statement cache
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await fn(count)
+        best = min(best, time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    rows, body = await fn(count)
+    size = len(body)
+    del body
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, retained, len(rows), size
+
+
+async def main_async(args, path):
+    import db
+    from db_pool import close_pool
+
+    await _seed(path, args.bookings)
+    await db.init_db()
+    try:
+        print(f"{args.bookings} bookings, best of {args.rounds}")
+        print(f"{'MODE':<9} {'SECONDS':>8} {'PEAK MB':>8} {'ROWS MB':>8} {'COUNT':>6} {'JSON KB':>8}")
+        print("-" * 54)
+        baseline = None
+        for mode in args.modes:
+            elapsed, peak, retained, rows, size = await _measure(MODES[mode], args.bookings, args.rounds)
+            baseline = baseline or elapsed
+            print(
+                f"{mode:<9} {elapsed:>8.3f} {peak / 2**20:>8.1f} {retained / 2**20:>8.1f} {rows:>6} {size / 1024:>8.0f}"
+                f"   ({baseline / elapsed:.1f}x vs {args.modes[0]})"
+            )
+    finally:
+        await close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark listing bookings as dicts vs records")
+    parser.add_argument("--bookings", type=int, default=10000, help="Bookings to seed and list")
+    parser.add_argument("--rounds", type=int, default=3, help="Timed rounds per mode (best is reported)")
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=["dicts", "records"])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        # Read by db_pool at import time
+        os.environ["BOOKINGS_DB_PATH"] = path
+        asyncio.run(main_async(args, path))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,24 @@
 """
 SQLite database module for TriPoint bookings.
-Uses aiosqlite for async operations.
+Uses aiosqlite for async operations via the shared connections in db_pool.
 """
 from __future__ import annotations
 
 import os
 import secrets
-from datetime import datetime, timedelta, timezone
-from pathlib import Path
-from typing import Any
-
-try:
-    import aiosqlite
-except ImportError:
-    aiosqlite = None  # type: ignore
-
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# Database path: same directory as api.py
-_script_dir = Path(__file__).resolve().parent
-DB_PATH = os.getenv("BOOKINGS_DB_PATH") or str(_script_dir / "bookings.db")
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Sequence
+from zoneinfo import ZoneInfo
+
+from db_pool import (
+    DB_PATH,
+    _require_aiosqlite,
+    exclusive_connection,
+    read_connection,
+    write_transaction,
+)
+from migrations import SCHEMA, ensure_archive_schema, run_migrations
+from records import Booking
 
 # Status enum values
 STATUS_PENDING_DEPOSIT = "PENDING_DEPOSIT"
@@ -30,169 +27,52 @@ STATUS_COMPLETED_UNPAID = "COMPLETED_UNPAID"
 STATUS_COMPLETED_PAID = "COMPLETED_PAID"
 STATUS_CANCELLED = "CANCELLED"
 
-SCHEMA = """
-CREATE TABLE IF NOT EXISTS bookings (
-    id                      TEXT PRIMARY KEY,
-    status                  TEXT NOT NULL DEFAULT 'PENDING_DEPOSIT',
-    payment_link_token      TEXT NOT NULL UNIQUE,
-    full_name               TEXT NOT NULL,
-    email                   TEXT NOT NULL,
-    phone                   TEXT NOT NULL,
-    postcode                TEXT NOT NULL,
-    address_line_1          TEXT,
-    town_city               TEXT,
-    vehicle_reg             TEXT,
-    vehicle_make            TEXT,
-    vehicle_model           TEXT,
-    approx_mileage          TEXT,
-    symptoms                TEXT,
-    additional_notes        TEXT,
-    safe_location           INTEGER NOT NULL DEFAULT 0,
-    service_ids             TEXT NOT NULL,
-    slot_start_iso          TEXT NOT NULL,
-    slot_end_iso            TEXT NOT NULL,
-    zone                    TEXT,
-    drive_time_mins         INTEGER,
-    travel_buffer           INTEGER,
-    total_amount            INTEGER,
-    deposit_amount          INTEGER,
-    balance_due             INTEGER,
-    currency                TEXT NOT NULL DEFAULT 'gbp',
-    stripe_checkout_session_id TEXT,
-    stripe_payment_intent_id   TEXT,
-    stripe_customer_id         TEXT,
-    stripe_balance_session_id  TEXT,
-    calendar_event_id       TEXT,
-    created_at              TEXT NOT NULL,
-    updated_at              TEXT NOT NULL,
-    deposit_paid_at         TEXT,
-    completed_at            TEXT
-);
-
-CREATE TABLE IF NOT EXISTS payment_events (
-    id              INTEGER PRIMARY KEY AUTOINCREMENT,
-    booking_id      TEXT NOT NULL,
-    stripe_event_id TEXT UNIQUE,
-    event_type      TEXT NOT NULL,
-    amount          INTEGER,
-    created_at      TEXT NOT NULL,
-    FOREIGN KEY (booking_id) REFERENCES bookings(id)
-);
-
-CREATE INDEX IF NOT EXISTS idx_bookings_token ON bookings(payment_link_token);
-CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings(status);
-CREATE INDEX IF NOT EXISTS idx_bookings_slot ON bookings(slot_start_iso, slot_end_iso);
-CREATE INDEX IF NOT EXISTS idx_payment_events_stripe ON payment_events(stripe_event_id);
-
-CREATE TABLE IF NOT EXISTS diagnostic_reports (
-    id                  TEXT PRIMARY KEY,
-    booking_id          TEXT NOT NULL,
-    status              TEXT NOT NULL DEFAULT 'DRAFT',
-    share_token         TEXT UNIQUE,
-    customer_name       TEXT NOT NULL,
-    customer_email      TEXT NOT NULL,
-    customer_phone      TEXT,
-    customer_address    TEXT,
-    customer_postcode   TEXT,
-    report_email_sent   INTEGER NOT NULL DEFAULT 0,
-    created_at          TEXT NOT NULL,
-    updated_at          TEXT NOT NULL,
-    completed_at        TEXT,
-    FOREIGN KEY (booking_id) REFERENCES bookings(id)
-);
-
-CREATE TABLE IF NOT EXISTS report_vehicles (
-    id                  TEXT PRIMARY KEY,
-    report_id           TEXT NOT NULL,
-    sort_order          INTEGER NOT NULL DEFAULT 0,
-    reg                 TEXT,
-    vin                 TEXT,
-    make                TEXT,
-    model               TEXT,
-    variant             TEXT,
-    mileage             TEXT,
-    drivability_status  TEXT,
-    notes               TEXT,
-    created_at          TEXT NOT NULL,
-    updated_at          TEXT NOT NULL,
-    FOREIGN KEY (report_id) REFERENCES diagnostic_reports(id)
-);
-
-CREATE TABLE IF NOT EXISTS vehicle_faults (
-    id              TEXT PRIMARY KEY,
-    vehicle_id      TEXT NOT NULL,
-    sort_order      INTEGER NOT NULL DEFAULT 0,
-    title           TEXT NOT NULL,
-    severity        TEXT,
-    status          TEXT,
-    impact          TEXT,
-    dtcs            TEXT,
-    root_causes     TEXT,
-    conclusion      TEXT,
-    action_plan     TEXT,
-    parts_required  TEXT,
-    coding_required TEXT,
-    explanation     TEXT,
-    solution        TEXT,
-    created_at      TEXT NOT NULL,
-    updated_at      TEXT NOT NULL,
-    FOREIGN KEY (vehicle_id) REFERENCES report_vehicles(id)
-);
-
-CREATE TABLE IF NOT EXISTS fault_tests (
-    id          TEXT PRIMARY KEY,
-    vehicle_id  TEXT NOT NULL,
-    fault_id    TEXT,
-    sort_order  INTEGER NOT NULL DEFAULT 0,
-    test_name   TEXT NOT NULL,
-    tool_used   TEXT,
-    result      TEXT,
-    readings    TEXT,
-    notes       TEXT,
-    created_at  TEXT NOT NULL,
-    updated_at  TEXT NOT NULL,
-    FOREIGN KEY (vehicle_id) REFERENCES report_vehicles(id),
-    FOREIGN KEY (fault_id) REFERENCES vehicle_faults(id)
-);
-
-CREATE TABLE IF NOT EXISTS media_assets (
-    id          TEXT PRIMARY KEY,
-    report_id   TEXT NOT NULL,
-    vehicle_id  TEXT,
-    fault_id    TEXT,
-    test_id     TEXT,
-    media_type  TEXT NOT NULL,
-    filename    TEXT NOT NULL,
-    storage_key TEXT NOT NULL,
-    content_type TEXT NOT NULL,
-    size_bytes  INTEGER NOT NULL,
-    caption     TEXT,
-    created_at  TEXT NOT NULL,
-    FOREIGN KEY (report_id) REFERENCES diagnostic_reports(id),
-    FOREIGN KEY (vehicle_id) REFERENCES report_vehicles(id),
-    FOREIGN KEY (fault_id) REFERENCES vehicle_faults(id),
-    FOREIGN KEY (test_id) REFERENCES fault_tests(id)
-);
-
-CREATE INDEX IF NOT EXISTS idx_reports_booking ON diagnostic_reports(booking_id);
-CREATE INDEX IF NOT EXISTS idx_reports_status ON diagnostic_reports(status);
-CREATE INDEX IF NOT EXISTS idx_reports_share_token ON diagnostic_reports(share_token);
-CREATE INDEX IF NOT EXISTS idx_vehicles_report ON report_vehicles(report_id);
-CREATE INDEX IF NOT EXISTS idx_faults_vehicle ON vehicle_faults(vehicle_id);
-CREATE INDEX IF NOT EXISTS idx_tests_vehicle ON fault_tests(vehicle_id);
-CREATE INDEX IF NOT EXISTS idx_media_report ON media_assets(report_id);
-"""
+# Email campaign send status values
+SEND_PENDING = "PENDING"
+SEND_SENDING = "SENDING"
+SEND_SENT = "SENT"
+SEND_FAILED = "FAILED"
+# The booking left the campaign's status (paid, cancelled) before it was sent
+SEND_SKIPPED = "SKIPPED"
+
+
+# Longest a single booking can span; bounds interval lookups to an index range
+MAX_SLOT_SECONDS = 24 * 3600
+# Largest travel buffer either side of a booking (api caps it at 180 minutes)
+MAX_TRAVEL_BUFFER_MINS = 180
+
+# Statuses whose slot is taken
+_HOLDING_STATUSES = (STATUS_PENDING_DEPOSIT, STATUS_DEPOSIT_PAID)
 
 
-def _require_aiosqlite() -> None:
-    if aiosqlite is None:
-        raise RuntimeError("aiosqlite is required. Install with: pip install aiosqlite")
+class SlotConflictError(Exception):
+    """The requested slot overlaps a held or paid booking or a busy calendar event."""
 
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def _local_tz() -> ZoneInfo:
+    return ZoneInfo(os.getenv("TRIPOINT_TIMEZONE", "Europe/London"))
+
+
+def iso_to_epoch(value: str, *, end_of_day: bool = False) -> int:
+    """UTC epoch seconds for an ISO datetime or date.
+
+    A bare date means local midnight at its start (or, with end_of_day, the
+    next midnight). Naive datetimes are taken as local time.
+    """
+    if len(value) == 10:
+        day = date.fromisoformat(value) + timedelta(days=1 if end_of_day else 0)
+        dt = datetime.combine(day, time(0), tzinfo=_local_tz())
+    else:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=_local_tz())
+    return int(dt.timestamp())
+
+
 def generate_booking_id() -> str:
     """Generate a unique booking ID: TPD-YYYYMMDD-XXXX"""
     date_part = datetime.now().strftime("%Y%m%d")
@@ -206,22 +86,11 @@ def generate_payment_token() -> str:
 
 
 async def init_db() -> None:
-    """Create tables if they don't exist."""
+    """Bring the schema up to date and mirror it into the archive database."""
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.executescript(SCHEMA)
-        await conn.commit()
-        # Migration: add explanation and solution to vehicle_faults (if missing)
-        try:
-            await conn.execute("ALTER TABLE vehicle_faults ADD COLUMN explanation TEXT")
-            await conn.commit()
-        except Exception:
-            pass
-        try:
-            await conn.execute("ALTER TABLE vehicle_faults ADD COLUMN solution TEXT")
-            await conn.commit()
-        except Exception:
-            pass
+    async with exclusive_connection() as conn:
+        await run_migrations(conn)
+        await ensure_archive_schema(conn)
 
 
 async def insert_booking(
@@ -250,172 +119,187 @@ async def insert_booking(
     total_amount: int | None,
     deposit_amount: int | None,
     balance_due: int | None,
+    busy_intervals: Sequence[tuple[datetime, datetime]] = (),
 ) -> None:
+    """
+    Insert a PENDING_DEPOSIT booking, holding its slot.
+
+    The slot plus travel_buffer either side must not overlap busy_intervals
+    (calendar events, already buffered) or another held / paid booking with
+    its own buffer. The booking check and the insert run in one write
+    transaction, so concurrent reserves of the same slot cannot both win; the
+    loser gets SlotConflictError.
+    """
     _require_aiosqlite()
     now = _now_iso()
-    async with aiosqlite.connect(DB_PATH) as conn:
+    start_ts, end_ts = iso_to_epoch(slot_start_iso), iso_to_epoch(slot_end_iso)
+    buffer_secs = (travel_buffer or 0) * 60
+    blocked_start, blocked_end = start_ts - buffer_secs, end_ts + buffer_secs
+    for busy_start, busy_end in busy_intervals:
+        if blocked_start < busy_end.timestamp() and blocked_end > busy_start.timestamp():
+            raise SlotConflictError(f"{slot_start_iso} overlaps a calendar event")
+    async with write_transaction() as conn:
+        # Range on (status, slot_start_ts) wide enough for the longest slot and
+        # buffer; the last two terms are the exact buffered overlap test
+        async with conn.execute(
+            """
+            SELECT id FROM bookings
+            WHERE status IN (?, ?)
+            AND slot_start_ts > ?
+            AND slot_start_ts < ?
+            AND slot_end_ts + COALESCE(travel_buffer, ?) * 60 > ?
+            AND slot_start_ts - COALESCE(travel_buffer, ?) * 60 < ?
+            LIMIT 1
+            """,
+            (
+                *_HOLDING_STATUSES,
+                blocked_start - MAX_SLOT_SECONDS - MAX_TRAVEL_BUFFER_MINS * 60,
+                blocked_end + MAX_TRAVEL_BUFFER_MINS * 60,
+                travel_buffer or 0, blocked_start,
+                travel_buffer or 0, blocked_end,
+            ),
+        ) as cursor:
+            clash = await cursor.fetchone()
+        if clash:
+            raise SlotConflictError(f"{slot_start_iso} overlaps booking {clash[0]}")
         await conn.execute(
             """
             INSERT INTO bookings (
                 id, status, payment_link_token, full_name, email, phone, postcode,
                 address_line_1, town_city, vehicle_reg, vehicle_make, vehicle_model,
                 approx_mileage, symptoms, additional_notes, safe_location,
-                service_ids, slot_start_iso, slot_end_iso, zone, drive_time_mins,
-                travel_buffer, total_amount, deposit_amount, balance_due,
-                created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                service_ids, slot_start_iso, slot_end_iso, slot_start_ts, slot_end_ts,
+                zone, drive_time_mins, travel_buffer, total_amount, deposit_amount,
+                balance_due, created_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
             (
                 id, STATUS_PENDING_DEPOSIT, payment_link_token, full_name, email, phone, postcode,
                 address_line_1, town_city, vehicle_reg, vehicle_make, vehicle_model,
                 approx_mileage, symptoms, additional_notes or "", 1 if safe_location else 0,
-                service_ids, slot_start_iso, slot_end_iso, zone, drive_time_mins,
-                travel_buffer, total_amount, deposit_amount, balance_due,
-                now, now,
+                service_ids, slot_start_iso, slot_end_iso, start_ts, end_ts,
+                zone, drive_time_mins, travel_buffer, total_amount, deposit_amount,
+                balance_due, now, now,
             ),
         )
-        await conn.commit()
 
 
-async def get_booking_by_token(token: str) -> dict[str, Any] | None:
+async def get_booking_by_token(token: str) -> Booking | None:
     """Get booking by payment_link_token. Returns None if not found."""
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    async with read_connection() as conn:
         async with conn.execute(
-            "SELECT * FROM bookings WHERE payment_link_token = ?", (token,)
+            f"SELECT {Booking.select()} FROM bookings WHERE payment_link_token = ?", (token,)
         ) as cursor:
             row = await cursor.fetchone()
-            return dict(row) if row else None
+            return Booking.from_row(row) if row else None
 
 
-async def get_booking_by_id(booking_id: str) -> dict[str, Any] | None:
+async def get_booking_by_id(booking_id: str) -> Booking | None:
     """Get booking by id. Returns None if not found."""
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
-        async with conn.execute("SELECT * FROM bookings WHERE id = ?", (booking_id,)) as cursor:
+    async with read_connection() as conn:
+        async with conn.execute(f"SELECT {Booking.select()} FROM bookings WHERE id = ?", (booking_id,)) as cursor:
             row = await cursor.fetchone()
-            return dict(row) if row else None
+            return Booking.from_row(row) if row else None
 
 
-async def get_booking_by_stripe_session(session_id: str) -> dict[str, Any] | None:
+async def get_booking_by_stripe_session(session_id: str) -> Booking | None:
     """Get booking by stripe_checkout_session_id or stripe_balance_session_id."""
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    async with read_connection() as conn:
         async with conn.execute(
-            """
-            SELECT * FROM bookings
+            f"""
+            SELECT {Booking.select()} FROM bookings
             WHERE stripe_checkout_session_id = ? OR stripe_balance_session_id = ?
             """,
             (session_id, session_id),
         ) as cursor:
             row = await cursor.fetchone()
-            return dict(row) if row else None
+            return Booking.from_row(row) if row else None
 
 
-async def update_booking_deposit_paid(
-    booking_id: str,
-    stripe_checkout_session_id: str,
-    stripe_payment_intent_id: str | None = None,
-    stripe_customer_id: str | None = None,
-    calendar_event_id: str | None = None,
-) -> None:
-    """Update booking to DEPOSIT_PAID after deposit payment."""
-    _require_aiosqlite()
-    now = _now_iso()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute(
-            """
-            UPDATE bookings SET
-                status = ?,
-                stripe_checkout_session_id = ?,
-                stripe_payment_intent_id = COALESCE(?, stripe_payment_intent_id),
-                stripe_customer_id = COALESCE(?, stripe_customer_id),
-                calendar_event_id = COALESCE(?, calendar_event_id),
-                deposit_paid_at = ?,
-                updated_at = ?
-            WHERE id = ?
-            """,
-            (
-                STATUS_DEPOSIT_PAID,
-                stripe_checkout_session_id,
-                stripe_payment_intent_id,
-                stripe_customer_id,
-                calendar_event_id,
-                now,
-                now,
-                booking_id,
-            ),
-        )
-        await conn.commit()
+# Timestamp column stamped when a booking enters each status
+_STATUS_TIMESTAMPS = {
+    STATUS_DEPOSIT_PAID: "deposit_paid_at",
+    STATUS_COMPLETED_UNPAID: "completed_at",
+    STATUS_COMPLETED_PAID: "completed_at",
+}
+_TRANSITION_FIELDS = frozenset(Booking.COLUMNS) - {"id", "status", "updated_at", "slot_start_ts", "slot_end_ts"}
 
 
-async def update_booking_balance_paid(
+async def transition_booking(
     booking_id: str,
-    stripe_balance_session_id: str,
-) -> None:
-    """Update booking to COMPLETED_PAID after balance payment."""
-    _require_aiosqlite()
-    now = _now_iso()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute(
-            """
-            UPDATE bookings SET
-                status = ?,
-                stripe_balance_session_id = ?,
-                balance_due = 0,
-                completed_at = ?,
-                updated_at = ?
-            WHERE id = ?
-            """,
-            (STATUS_COMPLETED_PAID, stripe_balance_session_id, now, now, booking_id),
-        )
-        await conn.commit()
+    from_status: str | tuple[str, ...],
+    to_status: str,
+    *,
+    stripe_event_id: str | None = None,
+    event_type: str | None = None,
+    amount: int | None = None,
+    **fields: Any,
+) -> Booking | None:
+    """
+    Compare-and-set a booking's status in one write transaction.
 
+    Moves the booking to to_status only if it is currently in from_status,
+    setting any extra booking columns in fields (None values are left
+    unchanged) and stamping deposit_paid_at / completed_at. With
+    stripe_event_id the payment event is recorded in the same transaction,
+    and a duplicate event makes the whole transition a no-op, so webhook
+    retries cannot apply a payment twice.
 
-async def update_booking_status(
-    booking_id: str,
-    status: str,
-    calendar_event_id: str | None = None,
-    stripe_checkout_session_id: str | None = None,
-    stripe_balance_session_id: str | None = None,
-) -> None:
-    """Generic status update."""
+    Returns the booking as it was before the update if this call won, None
+    if the booking is missing, in another status, or the event was seen.
+    """
     _require_aiosqlite()
+    unknown = set(fields) - _TRANSITION_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown booking fields: {', '.join(sorted(unknown))}")
+    if stripe_event_id is not None and not event_type:
+        raise ValueError("event_type is required with stripe_event_id")
+    allowed = (from_status,) if isinstance(from_status, str) else tuple(from_status)
     now = _now_iso()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        updates = ["status = ?", "updated_at = ?"]
-        params: list[Any] = [status, now]
-
-        if calendar_event_id is not None:
-            updates.append("calendar_event_id = ?")
-            params.append(calendar_event_id)
-        if stripe_checkout_session_id is not None:
-            updates.append("stripe_checkout_session_id = ?")
-            params.append(stripe_checkout_session_id)
-        if stripe_balance_session_id is not None:
-            updates.append("stripe_balance_session_id = ?")
-            params.append(stripe_balance_session_id)
-
-        if status == STATUS_COMPLETED_UNPAID or status == STATUS_COMPLETED_PAID:
-            updates.append("completed_at = ?")
-            params.append(now)
-
-        params.append(booking_id)
+    updates = ["status = ?", "updated_at = ?"]
+    params: list[Any] = [to_status, now]
+    stamp = _STATUS_TIMESTAMPS.get(to_status)
+    if stamp and fields.get(stamp) is None:
+        fields[stamp] = now
+    for column, value in fields.items():
+        if value is not None:
+            updates.append(f"{column} = ?")
+            params.append(value)
+
+    async with write_transaction() as conn:
+        async with conn.execute(f"SELECT {Booking.select()} FROM bookings WHERE id = ?", (booking_id,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        booking = Booking.from_row(row)
+        if booking.status not in allowed:
+            return None
+        if stripe_event_id is not None:
+            cursor = await conn.execute(
+                """
+                INSERT OR IGNORE INTO payment_events (booking_id, stripe_event_id, event_type, amount, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (booking_id, stripe_event_id, event_type, amount, now),
+            )
+            if cursor.rowcount == 0:
+                return None
+        # The writer holds the only write lock, so the status read above still holds
         await conn.execute(
-            f"UPDATE bookings SET {', '.join(updates)} WHERE id = ?",
-            params,
+            f"UPDATE bookings SET {', '.join(updates)} WHERE id = ? AND status = ?",
+            [*params, booking_id, booking.status],
         )
-        await conn.commit()
+    return booking
 
 
 async def set_stripe_deposit_session(booking_id: str, session_id: str) -> None:
     """Store Stripe Checkout session ID before redirect (for deposit)."""
     _require_aiosqlite()
     now = _now_iso()
-    async with aiosqlite.connect(DB_PATH) as conn:
+    async with write_transaction() as conn:
         await conn.execute(
             """
             UPDATE bookings SET
@@ -425,14 +309,13 @@ async def set_stripe_deposit_session(booking_id: str, session_id: str) -> None:
             """,
             (session_id, now, booking_id),
         )
-        await conn.commit()
 
 
 async def set_stripe_balance_session(booking_id: str, session_id: str) -> None:
     """Store Stripe Checkout session ID for balance payment."""
     _require_aiosqlite()
     now = _now_iso()
-    async with aiosqlite.connect(DB_PATH) as conn:
+    async with write_transaction() as conn:
         await conn.execute(
             """
             UPDATE bookings SET
@@ -442,7 +325,22 @@ async def set_stripe_balance_session(booking_id: str, session_id: str) -> None:
             """,
             (session_id, now, booking_id),
         )
-        await conn.commit()
+
+
+async def set_calendar_event_id(booking_id: str, calendar_event_id: str) -> None:
+    """Store the Google Calendar event created for a booking."""
+    _require_aiosqlite()
+    now = _now_iso()
+    async with write_transaction() as conn:
+        await conn.execute(
+            """
+            UPDATE bookings SET
+                calendar_event_id = ?,
+                updated_at = ?
+            WHERE id = ?
+            """,
+            (calendar_event_id, now, booking_id),
+        )
 
 
 async def record_payment_event(
@@ -457,7 +355,7 @@ async def record_payment_event(
     _require_aiosqlite()
     now = _now_iso()
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with write_transaction() as conn:
             await conn.execute(
                 """
                 INSERT INTO payment_events (booking_id, stripe_event_id, event_type, amount, created_at)
@@ -465,7 +363,6 @@ async def record_payment_event(
                 """,
                 (booking_id, stripe_event_id, event_type, amount, now),
             )
-            await conn.commit()
             return True
     except Exception as e:
         if "UNIQUE" in str(e) or "unique" in str(e).lower():
@@ -473,17 +370,6 @@ async def record_payment_event(
         raise
 
 
-async def payment_event_exists(stripe_event_id: str) -> bool:
-    """Check if we've already processed this Stripe event."""
-    _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        async with conn.execute(
-            "SELECT 1 FROM payment_events WHERE stripe_event_id = ?", (stripe_event_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            return row is not None
-
-
 async def get_blocked_slot_intervals(
     window_start: datetime,
     window_end: datetime,
@@ -494,35 +380,31 @@ async def get_blocked_slot_intervals(
     Returns list of (blocked_start, blocked_end) in local time.
     """
     _require_aiosqlite()
-    from zoneinfo import ZoneInfo
-
-    tz = ZoneInfo(os.getenv("TRIPOINT_TIMEZONE", "Europe/London"))
-    ws = window_start.isoformat()
-    we = window_end.isoformat()
+    tz = _local_tz()
+    ws = int(window_start.timestamp())
+    we = int(window_end.timestamp())
 
     intervals: list[tuple[datetime, datetime]] = []
-    async with aiosqlite.connect(DB_PATH) as conn:
+    async with read_connection() as conn:
+        # The lower bound on slot_start_ts keeps this a range scan on
+        # (status, slot_start_ts); slot_end_ts > ws does the exact overlap test.
         async with conn.execute(
             """
-            SELECT slot_start_iso, slot_end_iso, travel_buffer
+            SELECT slot_start_ts, slot_end_ts, travel_buffer
             FROM bookings
             WHERE status IN (?, ?)
-            AND slot_end_iso > ?
-            AND slot_start_iso < ?
+            AND slot_start_ts > ?
+            AND slot_start_ts < ?
+            AND slot_end_ts > ?
             """,
-            (STATUS_PENDING_DEPOSIT, STATUS_DEPOSIT_PAID, ws, we),
+            (*_HOLDING_STATUSES, ws - MAX_SLOT_SECONDS, we, ws),
         ) as cursor:
-            async for row in cursor:
-                slot_start_s, slot_end_s, buf = row
+            async for start_ts, end_ts, buf in cursor:
                 buf = buf or travel_buffer_minutes
-                try:
-                    start = datetime.fromisoformat(slot_start_s.replace("Z", "+00:00")).astimezone(tz)
-                    end = datetime.fromisoformat(slot_end_s.replace("Z", "+00:00")).astimezone(tz)
-                    blocked_start = start - timedelta(minutes=buf)
-                    blocked_end = end + timedelta(minutes=buf)
-                    intervals.append((blocked_start, blocked_end))
-                except (ValueError, TypeError):
-                    continue
+                intervals.append((
+                    datetime.fromtimestamp(start_ts, tz) - timedelta(minutes=buf),
+                    datetime.fromtimestamp(end_ts, tz) + timedelta(minutes=buf),
+                ))
     return intervals
 
 
@@ -533,50 +415,375 @@ async def expire_old_pending_bookings(ttl_minutes: int = 30) -> int:
     """
     _require_aiosqlite()
     cutoff = (datetime.now(timezone.utc) - timedelta(minutes=ttl_minutes)).isoformat()
-    async with aiosqlite.connect(DB_PATH) as conn:
+    async with write_transaction() as conn:
         cursor = await conn.execute(
             """
             UPDATE bookings SET status = ? WHERE status = ? AND created_at < ?
             """,
             (STATUS_CANCELLED, STATUS_PENDING_DEPOSIT, cutoff),
         )
-        await conn.commit()
         return cursor.rowcount or 0
 
 
+def _booking_filters(
+    status: str | None,
+    date_from: str | None,
+    date_to: str | None,
+) -> tuple[list[str], list[Any]]:
+    conditions: list[str] = []
+    params: list[Any] = []
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    if date_from:
+        conditions.append("slot_start_ts >= ?")
+        params.append(iso_to_epoch(date_from))
+    if date_to:
+        # A bare date includes that whole (local) day
+        conditions.append("slot_start_ts < ?" if len(date_to) == 10 else "slot_start_ts <= ?")
+        params.append(iso_to_epoch(date_to, end_of_day=True))
+    return conditions, params
+
+
 async def list_bookings(
     status: str | None = None,
     date_from: str | None = None,
     date_to: str | None = None,
     limit: int = 200,
-) -> list[dict[str, Any]]:
-    """List bookings for admin dashboard with optional filters."""
+    after: tuple[int, str] | None = None,
+    archived: bool = False,
+) -> list[Booking]:
+    """
+    List bookings for admin dashboard with optional filters, newest slot first.
+    `after` is the (slot_start_ts, id) of the last row of the previous page.
+    archived=True lists the archive database instead (see archive.py).
+    """
     _require_aiosqlite()
-    conditions = []
-    params: list[Any] = []
+    conditions, params = _booking_filters(status, date_from, date_to)
+    if after is not None:
+        conditions.append("(slot_start_ts, id) < (?, ?)")
+        params.extend(after)
 
-    if status:
-        conditions.append("status = ?")
-        params.append(status)
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    params.append(limit)
+
+    async with read_connection() as conn:
+        async with conn.execute(
+            f"""
+            SELECT {Booking.select()} FROM {"archive" if archived else "main"}.bookings {where}
+            ORDER BY slot_start_ts DESC, id DESC
+            LIMIT ?
+            """,
+            params,
+        ) as cursor:
+            rows = await cursor.fetchall()
+            return [Booking.from_row(r) for r in rows]
+
+
+async def count_bookings(
+    status: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    archived: bool = False,
+) -> int:
+    _require_aiosqlite()
+    conditions, params = _booking_filters(status, date_from, date_to)
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    table = "archive.bookings" if archived else "main.bookings"
+    async with read_connection() as conn:
+        async with conn.execute(f"SELECT COUNT(*) FROM {table} {where}", params) as cursor:
+            row = await cursor.fetchone()
+            return row[0]
+
+
+# ─── Dashboard stats ────────────────────────────────────────────────────────
+
+# Statuses whose balance is still owed / whose value counts as booked work
+_OUTSTANDING_STATUSES = (STATUS_DEPOSIT_PAID, STATUS_COMPLETED_UNPAID)
+
+
+def _empty_stats() -> dict[str, Any]:
+    return {"bookings": 0, "by_status": {}, "booked_value": 0, "deposits_taken": 0, "outstanding_balance": 0}
+
+
+def _add_stats(into: dict[str, Any], status: str, bookings: int, total: int, deposits: int, balance: int) -> None:
+    into["bookings"] += bookings
+    into["by_status"][status] = into["by_status"].get(status, 0) + bookings
+    if status != STATUS_CANCELLED:
+        into["booked_value"] += total
+    into["deposits_taken"] += deposits
+    if status in _OUTSTANDING_STATUSES:
+        into["outstanding_balance"] += balance
+
+
+async def booking_stats(date_from: str | None = None, date_to: str | None = None) -> dict[str, Any]:
+    """
+    Dashboard totals from the booking_stats_* rollups (maintained by triggers),
+    for slot dates date_from..date_to inclusive (YYYY-MM-DD, local). Amounts in pence.
+    """
+    _require_aiosqlite()
+    conditions: list[str] = []
+    params: list[Any] = []
     if date_from:
-        conditions.append("slot_start_iso >= ?")
-        params.append(date_from)
+        conditions.append("day >= ?")
+        params.append(date_from[:10])
     if date_to:
-        conditions.append("slot_start_iso <= ?")
-        params.append(date_to)
-
+        conditions.append("day <= ?")
+        params.append(date_to[:10])
     where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
-    params.append(limit)
 
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    totals = _empty_stats()
+    days: dict[str, dict[str, Any]] = {}
+    zones: dict[str, dict[str, Any]] = {}
+    services: dict[str, dict[str, Any]] = {}
+    async with read_connection() as conn:
         async with conn.execute(
             f"""
-            SELECT * FROM bookings {where}
-            ORDER BY slot_start_iso DESC
+            SELECT day, zone, status, bookings, total_amount, deposits_paid, balance_due
+            FROM booking_stats_daily {where} ORDER BY day
+            """,
+            params,
+        ) as cursor:
+            async for day, zone, status, *values in cursor:
+                _add_stats(totals, status, *values)
+                _add_stats(days.setdefault(day, {"day": day, **_empty_stats()}), status, *values)
+                _add_stats(zones.setdefault(zone or "unknown", _empty_stats()), status, *values)
+        async with conn.execute(
+            f"""
+            SELECT service_id, status, SUM(bookings) FROM booking_stats_service_daily {where}
+            GROUP BY service_id, status
+            """,
+            params,
+        ) as cursor:
+            async for service_id, status, bookings in cursor:
+                entry = services.setdefault(service_id, {"bookings": 0, "by_status": {}})
+                entry["bookings"] += bookings
+                entry["by_status"][status] = bookings
+
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "totals": totals,
+        "by_zone": zones,
+        "by_service": services,
+        "days": list(days.values()),
+    }
+
+
+# ─── Email campaigns ────────────────────────────────────────────────────────
+
+
+async def enqueue_campaign_targets(
+    campaign: str,
+    *,
+    status: str,
+    completed_after: str | None = None,
+    completed_before: str | None = None,
+    limit: int = 5000,
+) -> int:
+    """
+    Queue PENDING sends for bookings in `status` whose completed_at falls in the window.
+    Bookings already queued for this campaign (in any state) are skipped.
+    Returns count of newly queued rows.
+    """
+    _require_aiosqlite()
+    params: list[Any] = [campaign, SEND_PENDING, _now_iso(), status]
+    conditions = ["b.status = ?", "b.email != ''"]
+    if completed_after:
+        conditions.append("b.completed_at >= ?")
+        params.append(completed_after)
+    if completed_before:
+        conditions.append("b.completed_at < ?")
+        params.append(completed_before)
+    params.extend([campaign, limit])
+
+    async with write_transaction() as conn:
+        cursor = await conn.execute(
+            f"""
+            INSERT OR IGNORE INTO email_campaign_sends (campaign, booking_id, email, status, created_at)
+            SELECT ?, b.id, b.email, ?, ?
+            FROM bookings b
+            WHERE {" AND ".join(conditions)}
+            AND NOT EXISTS (
+                SELECT 1 FROM email_campaign_sends s
+                WHERE s.campaign = ? AND s.booking_id = b.id
+            )
+            ORDER BY b.completed_at
             LIMIT ?
             """,
             params,
+        )
+        return cursor.rowcount or 0
+
+
+async def release_stale_campaign_sends(campaign: str, claimed_before: str) -> int:
+    """
+    Fail sends left in SENDING by a run that died mid-send (crash, restart,
+    cancelled task) and claimed before `claimed_before`, so they are retried
+    while they have attempts left and reported as failed otherwise.
+    """
+    _require_aiosqlite()
+    async with write_transaction() as conn:
+        cursor = await conn.execute(
+            """
+            UPDATE email_campaign_sends SET status = ?, error = 'interrupted while sending'
+            WHERE campaign = ? AND status = ? AND (claimed_at IS NULL OR claimed_at < ?)
+            """,
+            (SEND_FAILED, campaign, SEND_SENDING, claimed_before),
+        )
+        return cursor.rowcount or 0
+
+
+async def skip_stale_campaign_sends(campaign: str, booking_status: str) -> int:
+    """Mark unsent rows SKIPPED where the booking is no longer in `booking_status`."""
+    _require_aiosqlite()
+    async with write_transaction() as conn:
+        cursor = await conn.execute(
+            """
+            UPDATE email_campaign_sends SET status = ?, error = 'booking status changed'
+            WHERE campaign = ? AND status IN (?, ?)
+            AND NOT EXISTS (
+                SELECT 1 FROM bookings b WHERE b.id = email_campaign_sends.booking_id AND b.status = ?
+            )
+            """,
+            (SEND_SKIPPED, campaign, SEND_PENDING, SEND_FAILED, booking_status),
+        )
+        return cursor.rowcount or 0
+
+
+async def list_pending_campaign_sends(
+    campaign: str,
+    booking_status: str,
+    max_attempts: int = 3,
+    limit: int = 5000,
+) -> list[dict[str, Any]]:
+    """Pending (or retryable failed) sends whose booking is still in `booking_status`, joined with it."""
+    _require_aiosqlite()
+    async with read_connection() as conn:
+        async with conn.execute(
+            """
+            SELECT s.id AS send_id, s.attempts, b.*
+            FROM email_campaign_sends s
+            JOIN bookings b ON b.id = s.booking_id
+            WHERE s.campaign = ? AND s.status IN (?, ?) AND s.attempts < ? AND b.status = ?
+            ORDER BY s.id
+            LIMIT ?
+            """,
+            (campaign, SEND_PENDING, SEND_FAILED, max_attempts, booking_status, limit),
         ) as cursor:
             rows = await cursor.fetchall()
             return [dict(r) for r in rows]
+
+
+async def claim_campaign_send(send_id: int, booking_status: str) -> str | None:
+    """
+    Move a send to SENDING (counting the attempt) so a concurrent run can't
+    pick it up too. A run lasts hours at the campaign rate, so the booking is
+    re-checked here: if it has left `booking_status` the send is SKIPPED.
+    Returns SEND_SENDING or SEND_SKIPPED, or None if another run already
+    claimed or finished it.
+    """
+    _require_aiosqlite()
+    async with write_transaction() as conn:
+        cursor = await conn.execute(
+            """
+            UPDATE email_campaign_sends SET status = ?, claimed_at = ?, attempts = attempts + 1
+            WHERE id = ? AND status IN (?, ?)
+            AND EXISTS (SELECT 1 FROM bookings b WHERE b.id = email_campaign_sends.booking_id AND b.status = ?)
+            """,
+            (SEND_SENDING, _now_iso(), send_id, SEND_PENDING, SEND_FAILED, booking_status),
+        )
+        if cursor.rowcount:
+            return SEND_SENDING
+        cursor = await conn.execute(
+            "UPDATE email_campaign_sends SET status = ?, error = 'booking status changed' WHERE id = ? AND status IN (?, ?)",
+            (SEND_SKIPPED, send_id, SEND_PENDING, SEND_FAILED),
+        )
+        return SEND_SKIPPED if cursor.rowcount else None
+
+
+async def mark_campaign_send(send_id: int, status: str, error: str | None = None) -> None:
+    """Record the outcome of the attempt claim_campaign_send started."""
+    _require_aiosqlite()
+    now = _now_iso()
+    async with write_transaction() as conn:
+        await conn.execute(
+            """
+            UPDATE email_campaign_sends SET
+                status = ?,
+                error = ?,
+                sent_at = CASE WHEN ? = ? THEN ? ELSE sent_at END
+            WHERE id = ?
+            """,
+            (status, error, status, SEND_SENT, now, send_id),
+        )
+
+
+async def campaign_send_counts(campaign: str) -> dict[str, int]:
+    """Per-status counts for a campaign."""
+    _require_aiosqlite()
+    async with read_connection() as conn:
+        async with conn.execute(
+            "SELECT status, COUNT(*) FROM email_campaign_sends WHERE campaign = ? GROUP BY status",
+            (campaign,),
+        ) as cursor:
+            return {status: count async for status, count in cursor}
+
+
+# ─── Idempotency keys ───────────────────────────────────────────────────────
+
+
+async def claim_idempotency_key(scope: str, key: str, request_hash: str, ttl_secs: int) -> dict[str, Any] | None:
+    """
+    Claim (scope, key) for a new request. Returns None if this call now owns
+    the key, else the existing row (request_hash, status_code, response;
+    response is None while the owner is still running). Expired keys are
+    dropped first, so they can be claimed again.
+    """
+    _require_aiosqlite()
+    now = int(datetime.now(timezone.utc).timestamp())
+    async with write_transaction() as conn:
+        await conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+        cursor = await conn.execute(
+            """
+            INSERT OR IGNORE INTO idempotency_keys (scope, key, request_hash, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (scope, key, request_hash, now, now + ttl_secs),
+        )
+        if cursor.rowcount == 1:
+            return None
+        async with conn.execute(
+            "SELECT request_hash, status_code, response FROM idempotency_keys WHERE scope = ? AND key = ?",
+            (scope, key),
+        ) as cursor:
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+
+
+async def get_idempotency_key(scope: str, key: str) -> dict[str, Any] | None:
+    _require_aiosqlite()
+    async with read_connection() as conn:
+        async with conn.execute(
+            "SELECT request_hash, status_code, response FROM idempotency_keys WHERE scope = ? AND key = ?",
+            (scope, key),
+        ) as cursor:
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+
+
+async def save_idempotent_response(scope: str, key: str, status_code: int, response: str) -> None:
+    """Store the owner's response (JSON text) for replay."""
+    _require_aiosqlite()
+    async with write_transaction() as conn:
+        await conn.execute(
+            "UPDATE idempotency_keys SET status_code = ?, response = ? WHERE scope = ? AND key = ?",
+            (status_code, response, scope, key),
+        )
+
+
+async def release_idempotency_key(scope: str, key: str) -> None:
+    """Forget a claim whose request failed, so a retry runs it again."""
+    _require_aiosqlite()
+    async with write_transaction() as conn:
+        await conn.execute("DELETE FROM idempotency_keys WHERE scope = ? AND key = ?", (scope, key))
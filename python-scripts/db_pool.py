@@ -0,0 +1,371 @@
+"""
+Shared aiosqlite connections for the bookings database.
+
+One writer connection and a small pool of reader connections are opened once
+(at API startup, or lazily on first use from scripts) instead of a new
+connection and thread per query. The database runs in WAL mode so readers
+never block behind a write transaction, and every connection gets the same
+tuned PRAGMAs.
+
+All writes are serialised through one writer task that does group commit:
+write blocks queued while a transaction is open join it, each in its own
+SAVEPOINT, and every caller is released only after the shared COMMIT. Never
+open a write block from inside another one.
+
+Usage from db.py / report_db.py:
+
+    async with read_connection() as conn:
+        async with conn.execute("SELECT ...") as cursor: ...
+
+    async with write_transaction() as conn:
+        await conn.execute("UPDATE ...")   # committed on exit, rolled back on error
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, AsyncIterator
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None  # type: ignore
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("tripoint.db")
+
+# Database path: same directory as api.py
+_script_dir = Path(__file__).resolve().parent
+DB_PATH = os.getenv("BOOKINGS_DB_PATH") or str(_script_dir / "bookings.db")
+# Cold rows moved out by archive.py; attached to every connection as "archive"
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH") or str(Path(DB_PATH).with_name(Path(DB_PATH).stem + "-archive.db"))
+
+# NORMAL is safe in WAL mode (no corruption, last commits may roll back on
+# power loss); FULL fsyncs every commit, which group commit amortises.
+SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL").upper()
+READER_COUNT = int(os.getenv("DB_READER_CONNECTIONS", "4"))
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+CACHE_SIZE_KIB = int(os.getenv("DB_CACHE_SIZE_KIB", "16384"))
+MMAP_SIZE_BYTES = int(os.getenv("DB_MMAP_SIZE_BYTES", str(256 * 1024 * 1024)))
+# Most write blocks folded into one transaction (group commit)
+GROUP_COMMIT_MAX = int(os.getenv("DB_GROUP_COMMIT_MAX", "64"))
+
+# Applied to every connection. journal_mode=WAL is persistent in the file but
+# is cheap to re-assert; the rest are per-connection settings.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    f"PRAGMA synchronous = {SYNCHRONOUS}",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    f"PRAGMA cache_size = -{CACHE_SIZE_KIB}",
+    f"PRAGMA mmap_size = {MMAP_SIZE_BYTES}",
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+def _require_aiosqlite() -> None:
+    if aiosqlite is None:
+        raise RuntimeError("aiosqlite is required. Install with: pip install aiosqlite")
+
+
+class _WriteSlot:
+    """One queued write_transaction() / exclusive_connection() block."""
+
+    __slots__ = ("exclusive", "granted", "done", "committed")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, exclusive: bool = False):
+        self.exclusive = exclusive
+        # writer -> caller: the connection is yours (SAVEPOINT already open)
+        self.granted: asyncio.Future = loop.create_future()
+        # caller -> writer: block finished, result is the exception or None
+        self.done: asyncio.Future = loop.create_future()
+        # writer -> caller: the enclosing transaction committed (or why not)
+        self.committed: asyncio.Future = loop.create_future()
+
+
+def _resolve(fut: asyncio.Future, exc: BaseException | None = None) -> None:
+    if fut.done():
+        return
+    if exc is None:
+        fut.set_result(None)
+    else:
+        fut.set_exception(exc)
+
+
+# Set while the current task is inside a write block; nesting would deadlock
+_in_write: ContextVar[bool] = ContextVar("tripoint_db_in_write", default=False)
+
+
+class ConnectionPool:
+    """One writer plus `readers` reader connections bound to one event loop.
+
+    Writes go through a single writer task. Blocks queued while a transaction
+    is being built are folded into it (each in its own SAVEPOINT), so a burst
+    of N writes costs one BEGIN IMMEDIATE / COMMIT instead of N.
+    """
+
+    def __init__(self, path: str, readers: int = READER_COUNT, archive_path: str | None = None):
+        self.path = path
+        self.archive_path = archive_path
+        self.reader_count = max(1, readers)
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._writer: Any = None
+        self._readers: list[Any] = []
+        self._idle: asyncio.Queue | None = None
+        self._pending: asyncio.Queue | None = None
+        self._writer_task: asyncio.Task | None = None
+        self._opening: asyncio.Future | None = None
+        self.stats = {"transactions": 0, "blocks": 0}
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, *, read_only: bool) -> Any:
+        # isolation_level=None: no implicit BEGIN, transactions are explicit
+        conn = await aiosqlite.connect(self.path, isolation_level=None)
+        conn.row_factory = aiosqlite.Row
+        for pragma in CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        if self.archive_path:
+            await conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+            if not read_only:
+                await conn.execute("PRAGMA archive.journal_mode = WAL")
+                await conn.execute(f"PRAGMA archive.synchronous = {SYNCHRONOUS}")
+        if read_only:
+            await conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    async def _open(self) -> None:
+        _require_aiosqlite()
+        self.loop = asyncio.get_running_loop()
+        # Writer first so WAL is enabled before readers attach
+        self._writer = await self._connect(read_only=False)
+        self._readers = [await self._connect(read_only=True) for _ in range(self.reader_count)]
+        self._idle = asyncio.Queue()
+        for conn in self._readers:
+            self._idle.put_nowait(conn)
+        self._pending = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._write_loop(), name="tripoint-db-writer")
+        logger.info("SQLite pool open: %s (1 writer, %d readers)", self.path, self.reader_count)
+
+    async def open(self) -> None:
+        """Open all connections; concurrent callers share one open."""
+        if self.is_open:
+            return
+        if self._opening is None:
+            self._opening = asyncio.ensure_future(self._open())
+        await asyncio.shield(self._opening)
+
+    async def close(self) -> None:
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+        conns = [self._writer, *self._readers]
+        self._writer = None
+        self._readers = []
+        self._opening = None
+        for conn in conns:
+            if conn is not None:
+                await conn.close()
+
+    def abandon(self) -> None:
+        """Stop worker threads of a pool whose event loop is gone (no awaiting possible)."""
+        for conn in [self._writer, *self._readers]:
+            if conn is not None and hasattr(conn, "stop"):
+                conn.stop()
+        self._writer = None
+        self._readers = []
+        self._writer_task = None
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[Any]:
+        assert self._idle is not None
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    # ─── Writer task ──────────────────────────────────────────────────────
+
+    def _next_slot(self) -> _WriteSlot | None:
+        assert self._pending is not None
+        while not self._pending.empty():
+            slot = self._pending.get_nowait()
+            if not slot.granted.cancelled():
+                return slot
+        return None
+
+    async def _run_block(self, slot: _WriteSlot) -> BaseException | None:
+        """Hand the writer to one caller and wait until its block exits."""
+        if slot.granted.cancelled():
+            # Caller gave up while this block was being set up
+            return None
+        _resolve(slot.granted)
+        return await slot.done
+
+    async def _run_exclusive(self, slot: _WriteSlot) -> None:
+        await self._run_block(slot)
+        _resolve(slot.committed)
+
+    async def _run_batch(self, first: _WriteSlot) -> _WriteSlot | None:
+        """One transaction holding `first` plus whatever queues up meanwhile.
+
+        Returns an exclusive slot that ended the batch early, if any.
+        """
+        conn = self._writer
+        members: list[_WriteSlot] = []
+        slot: _WriteSlot | None = first
+        carry: _WriteSlot | None = None
+        try:
+            await conn.execute("BEGIN IMMEDIATE")
+            while slot is not None:
+                await conn.execute("SAVEPOINT block")
+                running, slot = slot, None
+                error = await self._run_block(running)
+                if error is not None:
+                    # Undo only this caller's statements; the rest of the batch stands
+                    await conn.execute("ROLLBACK TO block")
+                    _resolve(running.committed)
+                else:
+                    members.append(running)
+                await conn.execute("RELEASE block")
+                if len(members) >= GROUP_COMMIT_MAX:
+                    break
+                slot = self._next_slot()
+                if slot is None:
+                    # Let tasks that are ready to write enqueue before committing
+                    await asyncio.sleep(0)
+                    slot = self._next_slot()
+                if slot is not None and slot.exclusive:
+                    carry, slot = slot, None
+            await conn.execute("COMMIT")
+        except Exception as exc:
+            logger.exception("SQLite write batch failed; rolling back %d block(s)", len(members))
+            if conn.in_transaction:
+                try:
+                    await conn.execute("ROLLBACK")
+                except Exception:
+                    logger.exception("ROLLBACK after failed write batch also failed")
+            if slot is not None and not slot.granted.done():
+                slot.granted.set_exception(exc)
+            for member in members:
+                _resolve(member.committed, exc)
+            return carry
+        for member in members:
+            _resolve(member.committed)
+        self.stats["transactions"] += 1
+        self.stats["blocks"] += len(members)
+        return carry
+
+    async def _write_loop(self) -> None:
+        assert self._pending is not None
+        carry: _WriteSlot | None = None
+        while True:
+            slot = carry or await self._pending.get()
+            carry = None
+            if slot.granted.cancelled():
+                continue
+            if slot.exclusive:
+                await self._run_exclusive(slot)
+            else:
+                carry = await self._run_batch(slot)
+
+    async def _submit(self, exclusive: bool) -> _WriteSlot:
+        if _in_write.get():
+            raise RuntimeError("Nested write transaction: use the connection already held")
+        assert self._pending is not None
+        slot = _WriteSlot(asyncio.get_running_loop(), exclusive=exclusive)
+        self._pending.put_nowait(slot)
+        try:
+            await slot.granted
+        except asyncio.CancelledError:
+            # Writer skips slots whose grant was cancelled before it got there
+            if slot.granted.done() and not slot.granted.cancelled():
+                _resolve(slot.done)
+            raise
+        return slot
+
+    @asynccontextmanager
+    async def _hold(self, exclusive: bool) -> AsyncIterator[Any]:
+        slot = await self._submit(exclusive)
+        token = _in_write.set(True)
+        try:
+            yield self._writer
+        except BaseException as exc:
+            # Handed to the writer as a value so it rolls back this block only
+            if not slot.done.done():
+                slot.done.set_result(exc)
+            raise
+        finally:
+            _in_write.reset(token)
+            _resolve(slot.done)
+        # Return only once the enclosing transaction is durable
+        await asyncio.shield(slot.committed)
+
+    def transaction(self):
+        """A block inside the writer's current transaction; committed before it returns.
+
+        If the block raises, only its own statements are rolled back.
+        """
+        return self._hold(exclusive=False)
+
+    def exclusive(self):
+        """The writer with no transaction opened, e.g. for DDL scripts."""
+        return self._hold(exclusive=True)
+
+
+_pool: ConnectionPool | None = None
+
+
+async def get_pool() -> ConnectionPool:
+    """The process-wide pool, opened on first use in the running event loop."""
+    global _pool
+    loop = asyncio.get_running_loop()
+    if _pool is None or (_pool.loop is not None and _pool.loop is not loop):
+        if _pool is not None:
+            # A previous asyncio.run() loop owned these connections
+            _pool.abandon()
+        _pool = ConnectionPool(DB_PATH, archive_path=ARCHIVE_DB_PATH)
+    await _pool.open()
+    return _pool
+
+
+async def close_pool() -> None:
+    """Close the shared pool (API shutdown, end of scripts)."""
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+
+@asynccontextmanager
+async def read_connection() -> AsyncIterator[Any]:
+    pool = await get_pool()
+    async with pool.reader() as conn:
+        yield conn
+
+
+@asynccontextmanager
+async def write_transaction() -> AsyncIterator[Any]:
+    pool = await get_pool()
+    async with pool.transaction() as conn:
+        yield conn
+
+
+@asynccontextmanager
+async def exclusive_connection() -> AsyncIterator[Any]:
+    pool = await get_pool()
+    async with pool.exclusive() as conn:
+        yield conn
@@ -0,0 +1,251 @@
+"""Batch email campaigns (review requests, overdue invoice reminders).
+
+Selects target bookings from the DB, queues one row per recipient in
+email_campaign_sends, then renders and sends each one over a single reused
+SMTP session at a fixed rate. Every attempt is recorded, so reruns only
+pick up rows that are still pending (or failed with attempts left). A send
+whose booking has left the campaign's status by the time it comes up (the
+invoice was paid, the job cancelled) is marked SKIPPED instead, and one left
+SENDING by a run that died is failed over after CAMPAIGN_SEND_TIMEOUT_SECS.
+
+Runs either from the admin API as a background task or from cron:
+
+    python email_campaigns.py review-request --days 7
+    python email_campaigns.py overdue-invoice --days 14 --dry-run
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+from db import (
+    SEND_FAILED,
+    SEND_SENDING,
+    SEND_SENT,
+    SEND_SKIPPED,
+    STATUS_COMPLETED_PAID,
+    STATUS_COMPLETED_UNPAID,
+    campaign_send_counts,
+    claim_campaign_send,
+    enqueue_campaign_targets,
+    list_pending_campaign_sends,
+    mark_campaign_send,
+    release_stale_campaign_sends,
+    skip_stale_campaign_sends,
+)
+from email_templates import EmailTemplateService
+from services.mailer import REPLY_TO, SMTPSession, build_message, smtp_settings
+
+logger = logging.getLogger("tripoint.campaigns")
+
+SITE_URL = os.getenv("SITE_URL", "https://tripointdiagnostics.co.uk")
+REVIEW_LINK = os.getenv("REVIEW_LINK", "https://g.page/r/CRdMTF53rudiEBM/review")
+INVOICE_DUE_DAYS = int(os.getenv("INVOICE_DUE_DAYS", "7"))
+CAMPAIGN_RATE_PER_MINUTE = int(os.getenv("CAMPAIGN_RATE_PER_MINUTE", "20"))
+CAMPAIGN_MAX_ATTEMPTS = 3
+# A send still SENDING after this long belongs to a run that died; it is failed over
+CAMPAIGN_SEND_TIMEOUT_SECS = int(os.getenv("CAMPAIGN_SEND_TIMEOUT_SECS", "900"))
+
+
+def _common_data(booking: dict[str, Any], service_labels: dict[str, str]) -> dict[str, str]:
+    service_ids = (booking.get("service_ids") or "").split(",")
+    return {
+        "CLIENT_FIRST_NAME": ((booking.get("full_name") or "").strip().split() or ["there"])[0],
+        "BOOKING_ID": booking["id"],
+        "SERVICE_NAME": ", ".join(service_labels[s] for s in service_ids if s in service_labels) or "Diagnostic",
+        "VEHICLE_REG": booking.get("vehicle_reg") or "",
+        "VEHICLE_MAKE_MODEL": f"{booking.get('vehicle_make') or ''} {booking.get('vehicle_model') or ''}".strip() or "-",
+        "TECH_NAME": os.getenv("TECH_NAME", "TriPoint Team"),
+    }
+
+
+def _review_request_data(booking: dict[str, Any], service_labels: dict[str, str]) -> dict[str, str]:
+    return {**_common_data(booking, service_labels), "REVIEW_LINK": REVIEW_LINK}
+
+
+def _overdue_invoice_data(booking: dict[str, Any], service_labels: dict[str, str]) -> dict[str, str]:
+    balance_gbp = (booking.get("balance_due") or 0) // 100
+    completed = datetime.fromisoformat(booking["completed_at"].replace("Z", "+00:00"))
+    return {
+        **_common_data(booking, service_labels),
+        "INVOICE_ID": booking["id"],
+        "INVOICE_TOTAL": f"£{balance_gbp}",
+        "INVOICE_DUE_DATE": (completed + timedelta(days=INVOICE_DUE_DAYS)).strftime("%d %B %Y"),
+        "INVOICE_LINE_ITEMS_HTML": f"Balance outstanding: £{balance_gbp}<br>",
+        "PAYMENT_LINK": f"{SITE_URL}/pay/{booking['payment_link_token']}",
+        "PAYMENT_METHODS": "Card (Stripe), bank transfer",
+    }
+
+
+def _recent_window(days: int, now: datetime) -> tuple[str | None, str | None]:
+    """Jobs finished in the last `days`, but at least a day ago."""
+    return (now - timedelta(days=days)).isoformat(), (now - timedelta(hours=24)).isoformat()
+
+
+def _older_than_window(days: int, now: datetime) -> tuple[str | None, str | None]:
+    """Jobs finished more than `days` ago."""
+    return None, (now - timedelta(days=days)).isoformat()
+
+
+@dataclass(frozen=True)
+class CampaignDef:
+    name: str
+    template: str
+    booking_status: str
+    default_days: int
+    # (days, now) -> (completed_after, completed_before)
+    window: Callable[[int, datetime], tuple[str | None, str | None]]
+    build_data: Callable[[dict[str, Any], dict[str, str]], dict[str, str]]
+
+
+CAMPAIGNS: dict[str, CampaignDef] = {
+    "review-request": CampaignDef(
+        name="review-request",
+        template="06-review-request",
+        booking_status=STATUS_COMPLETED_PAID,
+        default_days=7,
+        window=_recent_window,
+        build_data=_review_request_data,
+    ),
+    "overdue-invoice": CampaignDef(
+        name="overdue-invoice",
+        template="07-overdue-invoice",
+        booking_status=STATUS_COMPLETED_UNPAID,
+        default_days=14,
+        window=_older_than_window,
+        build_data=_overdue_invoice_data,
+    ),
+}
+
+
+async def run_campaign(
+    name: str,
+    *,
+    templates: EmailTemplateService,
+    service_labels: dict[str, str],
+    days: int | None = None,
+    rate_per_minute: int | None = None,
+    limit: int = 5000,
+    dry_run: bool = False,
+) -> dict[str, Any]:
+    """Queue targets for a campaign and send everything still pending."""
+    campaign = CAMPAIGNS[name]
+    now = datetime.now(timezone.utc)
+    completed_after, completed_before = campaign.window(
+        days if days is not None else campaign.default_days,
+        now,
+    )
+    interrupted = await release_stale_campaign_sends(
+        name, (now - timedelta(seconds=CAMPAIGN_SEND_TIMEOUT_SECS)).isoformat()
+    )
+    queued = await enqueue_campaign_targets(
+        name,
+        status=campaign.booking_status,
+        completed_after=completed_after,
+        completed_before=completed_before,
+        limit=limit,
+    )
+    # Bookings paid or cancelled since they were queued
+    skipped = await skip_stale_campaign_sends(name, campaign.booking_status)
+    pending = await list_pending_campaign_sends(
+        name, campaign.booking_status, max_attempts=CAMPAIGN_MAX_ATTEMPTS, limit=limit
+    )
+    summary: dict[str, Any] = {
+        "campaign": name,
+        "queued": queued,
+        "interrupted": interrupted,
+        "pending": len(pending),
+        "sent": 0,
+        "failed": 0,
+        "skipped": skipped,
+    }
+    if dry_run or not pending:
+        return summary
+
+    settings = smtp_settings()
+    if not settings.configured:
+        raise RuntimeError("Zoho SMTP not configured - cannot run campaign")
+
+    interval = 60.0 / max(1, rate_per_minute or CAMPAIGN_RATE_PER_MINUTE)
+    session = SMTPSession(settings)
+    try:
+        for row in pending:
+            claim = await claim_campaign_send(row["send_id"], campaign.booking_status)
+            if claim == SEND_SKIPPED:
+                summary["skipped"] += 1
+            if claim != SEND_SENDING:
+                continue
+            try:
+                result = templates.render(campaign.template, campaign.build_data(row, service_labels))
+                if result is None:
+                    raise RuntimeError(f"Template '{campaign.template}' not found")
+                msg = build_message(
+                    from_email=settings.from_email,
+                    subject=result.subject,
+                    html_body=result.html,
+                    to_emails=[row["email"]],
+                    text_body=result.text,
+                    reply_to=REPLY_TO,
+                )
+                # smtplib blocks; keep it off the event loop
+                await asyncio.to_thread(session.send, msg)
+            except Exception as exc:
+                logger.warning("Campaign %s: send to %s failed: %s", name, row["email"], exc)
+                await mark_campaign_send(row["send_id"], SEND_FAILED, str(exc)[:500])
+                summary["failed"] += 1
+                await asyncio.to_thread(session.close)
+            else:
+                await mark_campaign_send(row["send_id"], SEND_SENT)
+                summary["sent"] += 1
+            await asyncio.sleep(interval)
+    finally:
+        await asyncio.to_thread(session.close)
+
+    logger.info("Campaign %s finished: %s", name, summary)
+    return summary
+
+
+async def campaign_status(name: str) -> dict[str, Any]:
+    return {"campaign": name, "counts": await campaign_send_counts(name)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Send a batch email campaign")
+    parser.add_argument("campaign", choices=sorted(CAMPAIGNS))
+    parser.add_argument("--days", type=int, default=None, help="Selection window in days")
+    parser.add_argument("--rate", type=int, default=None, help="Max emails per minute")
+    parser.add_argument("--limit", type=int, default=5000, help="Max recipients this run")
+    parser.add_argument("--dry-run", action="store_true", help="Queue and count only, do not send")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from api import SERVICE_CATALOG, template_service
+    from db import init_db
+    from db_pool import close_pool
+
+    async def _run() -> dict[str, Any]:
+        await init_db()
+        try:
+            return await run_campaign(
+                args.campaign,
+                templates=template_service,
+                service_labels={sid: s.label for sid, s in SERVICE_CATALOG.items()},
+                days=args.days,
+                rate_per_minute=args.rate,
+                limit=args.limit,
+                dry_run=args.dry_run,
+            )
+        finally:
+            await close_pool()
+
+    print(asyncio.run(_run()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,26 @@
 """Email template loader, renderer, and manager for TriPoint Diagnostics.
 
 Reads HTML/TXT templates from the email-templates/ directory,
-renders them by replacing [PLACEHOLDER] tokens with provided data,
+compiles each one into literal segments and placeholder slots at load time,
+renders them by joining the segments with the provided data,
 and exposes a clean interface for the API layer.
 """
 
 from __future__ import annotations
 
 import html
+import logging
 import os
 import re
+import threading
+import time
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
 from typing import Any
 
+logger = logging.getLogger("tripoint.email_templates")
+
 # ── Subject-line suggestions (from README.md table) ──────────────────────────
 
 SUBJECT_SUGGESTIONS: dict[str, str] = {
@@ -40,6 +46,58 @@ HTML_FRAGMENT_PLACEHOLDERS = frozenset({
 # Regex to match [ALL_CAPS_UNDERSCORES] placeholders
 _PLACEHOLDER_RE = re.compile(r"\[([A-Z][A-Z0-9_]*)\]")
 
+# HTML comments, except conditional ones: <!--[if mso]> ... <![endif]--> and the
+# downlevel-revealed <!--[if !mso]><!--> ... <!--<![endif]--> (body starts with [, > or <!)
+_HTML_COMMENT_RE = re.compile(r"<!--(?![\[>]|<!)(?:(?!-->).)*-->", re.DOTALL)
+
+
+def minify_html(source: str) -> str:
+    """Strip comments and indentation from template HTML.
+
+    Conservative on purpose: line breaks are kept (they render as a single
+    space, same as the indentation they replace) and conditional comments
+    for Outlook are preserved.
+    """
+    source = _HTML_COMMENT_RE.sub("", source)
+    lines = (line.strip() for line in source.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """A template split into literal segments and placeholder slots.
+
+    ``literals`` always has one more entry than ``slots``; rendering interleaves
+    them, so ``literals[i]`` precedes ``slots[i]``.
+    """
+
+    literals: tuple[str, ...]
+    slots: tuple[str, ...]
+    placeholders: frozenset[str]
+
+    @classmethod
+    def compile(cls, source: str) -> CompiledTemplate:
+        parts = _PLACEHOLDER_RE.split(source)
+        # re.split with one group alternates literal, key, literal, key, ..., literal
+        literals = tuple(parts[0::2])
+        slots = tuple(parts[1::2])
+        return cls(literals=literals, slots=slots, placeholders=frozenset(slots))
+
+    def render(self, values: dict[str, str]) -> str:
+        """Join segments, leaving unknown placeholders as ``[KEY]``."""
+        if not self.slots:
+            return self.literals[0]
+        out = [self.literals[0]]
+        append = out.append
+        for key, literal in zip(self.slots, self.literals[1:]):
+            value = values.get(key)
+            append(f"[{key}]" if value is None else value)
+            append(literal)
+        return "".join(out)
+
+
+_EMPTY_TEMPLATE = CompiledTemplate.compile("")
+
 
 @dataclass
 class TemplateRecord:
@@ -47,6 +105,40 @@ class TemplateRecord:
     html: str | None = None
     text: str | None = None
     subject: str = ""
+    compiled_html: CompiledTemplate = _EMPTY_TEMPLATE
+    compiled_text: CompiledTemplate = _EMPTY_TEMPLATE
+    compiled_subject: CompiledTemplate = _EMPTY_TEMPLATE
+    placeholders: frozenset[str] = frozenset()
+    # (html (mtime_ns, size), txt (mtime_ns, size) or None) at load time
+    stamp: tuple[Any, ...] = ()
+
+    @classmethod
+    def build(
+        cls,
+        slug: str,
+        html: str | None,
+        text: str | None,
+        subject: str,
+        stamp: tuple[Any, ...] = (),
+    ) -> TemplateRecord:
+        compiled_html = CompiledTemplate.compile(minify_html(html or ""))
+        compiled_text = CompiledTemplate.compile(text or "")
+        compiled_subject = CompiledTemplate.compile(subject)
+        return cls(
+            slug=slug,
+            html=html,
+            text=text,
+            subject=subject,
+            compiled_html=compiled_html,
+            compiled_text=compiled_text,
+            compiled_subject=compiled_subject,
+            placeholders=(
+                compiled_html.placeholders
+                | compiled_text.placeholders
+                | compiled_subject.placeholders
+            ),
+            stamp=stamp,
+        )
 
 
 @dataclass
@@ -59,45 +151,97 @@ class RenderResult:
 
 
 class EmailTemplateService:
-    """Loads and renders email templates from disk with in-memory caching."""
+    """Loads and renders email templates from disk with in-memory caching.
+
+    The cache is a plain dict that is only ever replaced, never mutated, so a
+    render always sees one consistent generation. At most every
+    ``check_interval`` seconds an access schedules a background rescan that
+    stats the template files and recompiles only the ones whose mtime or size
+    changed. ``check_interval=0`` disables hot reload.
+    """
 
-    def __init__(self, templates_dir: str | Path | None = None):
+    def __init__(self, templates_dir: str | Path | None = None, check_interval: float | None = None):
         if templates_dir is None:
             # Default: ../email-templates/ relative to this script
             templates_dir = Path(__file__).resolve().parent.parent / "email-templates"
+        if check_interval is None:
+            check_interval = float(os.getenv("EMAIL_TEMPLATES_CHECK_SECS", "5"))
         self._dir = Path(templates_dir)
+        self._check_interval = check_interval
         self._cache: dict[str, TemplateRecord] | None = None
+        self._next_check = 0.0
+        self._refresh_lock = threading.Lock()
 
     # ── Cache management ─────────────────────────────────────────────────
 
-    def _ensure_cache(self) -> None:
-        if self._cache is not None:
-            return
-        self._cache = {}
-        if not self._dir.is_dir():
-            return
-        # Discover templates by finding .html files and matching .txt
-        for html_path in sorted(self._dir.glob("*.html")):
-            slug = html_path.stem
-            txt_path = self._dir / f"{slug}.txt"
-            record = TemplateRecord(
-                slug=slug,
-                html=html_path.read_text(encoding="utf-8"),
-                text=txt_path.read_text(encoding="utf-8") if txt_path.exists() else None,
-                subject=SUBJECT_SUGGESTIONS.get(slug, ""),
-            )
-            self._cache[slug] = record
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        """Stat every template file: name -> (mtime_ns, size)."""
+        stamps: dict[str, tuple[int, int]] = {}
+        try:
+            with os.scandir(self._dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith((".html", ".txt")) and entry.is_file():
+                        st = entry.stat()
+                        stamps[entry.name] = (st.st_mtime_ns, st.st_size)
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        return stamps
+
+    def _refresh(self) -> None:
+        """Rebuild the cache from disk, reusing records whose files are unchanged."""
+        with self._refresh_lock:
+            previous = self._cache or {}
+            stamps = self._scan()
+            cache: dict[str, TemplateRecord] = {}
+            # Discover templates by finding .html files and matching .txt
+            for name in sorted(n for n in stamps if n.endswith(".html")):
+                slug = name[: -len(".html")]
+                stamp = (stamps[name], stamps.get(f"{slug}.txt"))
+                record = previous.get(slug)
+                if record is None or record.stamp != stamp:
+                    txt_path = self._dir / f"{slug}.txt"
+                    try:
+                        record = TemplateRecord.build(
+                            slug=slug,
+                            html=(self._dir / name).read_text(encoding="utf-8"),
+                            text=txt_path.read_text(encoding="utf-8") if stamp[1] else None,
+                            subject=SUBJECT_SUGGESTIONS.get(slug, ""),
+                            stamp=stamp,
+                        )
+                    except OSError:
+                        # Mid-rename or deleted since the scan; keep the old version if any
+                        if slug not in previous:
+                            continue
+                        record = previous[slug]
+                cache[slug] = record
+            self._cache = cache
+            self._next_check = time.monotonic() + self._check_interval
+
+    def _refresh_in_background(self) -> None:
+        try:
+            self._refresh()
+        except Exception:
+            logger.exception("Email template refresh failed")
+
+    def _templates(self) -> dict[str, TemplateRecord]:
+        cache = self._cache
+        if cache is None:
+            # Cold start: load synchronously once
+            self._refresh()
+            return self._cache or {}
+        if self._check_interval > 0 and time.monotonic() >= self._next_check and not self._refresh_lock.locked():
+            # Push the deadline out now so concurrent callers don't all spawn a thread
+            self._next_check = time.monotonic() + self._check_interval
+            threading.Thread(target=self._refresh_in_background, name="email-template-refresh", daemon=True).start()
+        return cache
 
     def reload(self) -> None:
-        """Force reload templates from disk."""
-        self._cache = None
-        self._ensure_cache()
+        """Force reload templates from disk (only changed files are recompiled)."""
+        self._refresh()
 
     # ── Public API ───────────────────────────────────────────────────────
 
     def list_templates(self) -> list[dict[str, Any]]:
-        self._ensure_cache()
-        assert self._cache is not None
         return [
             {
                 "slug": rec.slug,
@@ -105,13 +249,11 @@ class EmailTemplateService:
                 "has_text": rec.text is not None,
                 "subject": rec.subject,
             }
-            for rec in self._cache.values()
+            for rec in self._templates().values()
         ]
 
     def get_template(self, slug: str) -> TemplateRecord | None:
-        self._ensure_cache()
-        assert self._cache is not None
-        return self._cache.get(slug)
+        return self._templates().get(slug)
 
     def render(self, slug: str, data: dict[str, str]) -> RenderResult | None:
         record = self.get_template(slug)
@@ -122,34 +264,16 @@ class EmailTemplateService:
         if "CURRENT_YEAR" not in data:
             data = {**data, "CURRENT_YEAR": str(datetime.now().year)}
 
-        rendered_html = self._replace(record.html or "", data, escape_html=True)
-        rendered_text = self._replace(record.text or "", data, escape_html=False)
-        rendered_subject = self._replace(record.subject, data, escape_html=False)
-
-        # Find remaining unreplaced placeholders
-        all_remaining = set()
-        for content in (rendered_html, rendered_text, rendered_subject):
-            all_remaining.update(_PLACEHOLDER_RE.findall(content))
+        escaped = {
+            key: value if key in HTML_FRAGMENT_PLACEHOLDERS else html.escape(value)
+            for key, value in data.items()
+            if key in record.compiled_html.placeholders
+        }
 
         return RenderResult(
             slug=slug,
-            subject=rendered_subject,
-            html=rendered_html,
-            text=rendered_text,
-            missing_placeholders=sorted(all_remaining),
+            subject=record.compiled_subject.render(data),
+            html=record.compiled_html.render(escaped),
+            text=record.compiled_text.render(data),
+            missing_placeholders=sorted(record.placeholders - data.keys()),
         )
-
-    # ── Internal ─────────────────────────────────────────────────────────
-
-    @staticmethod
-    def _replace(template: str, data: dict[str, str], *, escape_html: bool) -> str:
-        def replacer(match: re.Match) -> str:
-            key = match.group(1)
-            if key not in data:
-                return match.group(0)  # Leave unknown placeholders as-is
-            value = data[key]
-            if escape_html and key not in HTML_FRAGMENT_PLACEHOLDERS:
-                value = html.escape(value)
-            return value
-
-        return _PLACEHOLDER_RE.sub(replacer, template)
@@ -0,0 +1,231 @@
+"""Reconcile MEDIA_DIR with the media_assets rows that reference it.
+
+The directory tree is walked with os.scandir one directory at a time, and
+files are checked in batches against media_assets.storage_key in both the
+hot and the archive database (idx_media_storage_key), so memory stays flat
+however many files there are. A file no row refers to is an orphan: left by
+deletes from before they removed files, or by an upload whose row was never
+written. Files younger than --min-age are skipped, since save_upload writes
+the file before its row is inserted.
+
+Orphans are deleted, or moved under --quarantine (same relative path) for
+review. Archived reports keep their media, so old share links keep working;
+--archived-media-days N also drops the media rows and files of reports
+archived more than N days ago.
+
+    python media_gc.py --dry-run
+    python media_gc.py --quarantine /var/lib/tripoint/media-quarantine
+    python media_gc.py --archived-media-days 730
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Iterator
+
+from db_pool import _require_aiosqlite, read_connection, write_transaction
+from services.media_storage import MEDIA_DIR
+
+logger = logging.getLogger("tripoint.media_gc")
+
+MEDIA_GC_MIN_AGE_SECS = int(os.getenv("MEDIA_GC_MIN_AGE_SECS", "3600"))
+# Default for --quarantine; unset means orphans are deleted
+MEDIA_GC_QUARANTINE_DIR = os.getenv("MEDIA_GC_QUARANTINE_DIR") or None
+MEDIA_GC_BATCH_SIZE = 500
+
+
+def _walk(root: Path) -> Iterator[tuple[str, int, float]]:
+    """(storage key, size, mtime) of every regular file under root."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                    elif entry.is_file(follow_symlinks=False):
+                        st = entry.stat(follow_symlinks=False)
+                        yield Path(entry.path).relative_to(root).as_posix(), st.st_size, st.st_mtime
+        except FileNotFoundError:
+            continue
+
+
+def _batches(files: Iterator[tuple[str, int, float]], size: int) -> Iterator[list[tuple[str, int, float]]]:
+    batch = []
+    for item in files:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _referenced(keys: list[str]) -> set[str]:
+    marks = ", ".join("?" * len(keys))
+    async with read_connection() as conn:
+        rows = await conn.execute_fetchall(
+            f"""
+            SELECT storage_key FROM main.media_assets WHERE storage_key IN ({marks})
+            UNION ALL
+            SELECT storage_key FROM archive.media_assets WHERE storage_key IN ({marks})
+            """,
+            keys * 2,
+        )
+    return {r[0] for r in rows}
+
+
+def _remove(keys: list[str], quarantine: Path | None) -> int:
+    """Delete (or move to quarantine) files under MEDIA_DIR; returns bytes removed."""
+    removed = 0
+    for key in keys:
+        path = MEDIA_DIR / key
+        try:
+            size = path.stat().st_size
+            if quarantine is None:
+                path.unlink()
+            else:
+                target = quarantine / key
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(path, target)
+        except FileNotFoundError:
+            continue
+        removed += size
+        if path.parent != MEDIA_DIR:
+            try:
+                # Drop the report's directory once it is empty
+                path.parent.rmdir()
+            except OSError:
+                pass
+    return removed
+
+
+def _sizes(keys: list[str]) -> int:
+    total = 0
+    for key in keys:
+        try:
+            total += (MEDIA_DIR / key).stat().st_size
+        except FileNotFoundError:
+            continue
+    return total
+
+
+async def _drop_archived_media(days: int, quarantine: Path | None, dry_run: bool) -> dict[str, int]:
+    """Media of reports whose booking was archived more than `days` ago."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    query = """
+        SELECT m.id, m.storage_key FROM main.archived_bookings a
+        JOIN archive.diagnostic_reports r ON r.booking_id = a.id
+        JOIN archive.media_assets m ON m.report_id = r.id
+        WHERE a.archived_at < ?
+    """
+    if dry_run:
+        async with read_connection() as conn:
+            rows = await conn.execute_fetchall(query, (cutoff,))
+        return {"rows": len(rows), "bytes": await asyncio.to_thread(_sizes, [r[1] for r in rows])}
+    async with write_transaction() as conn:
+        rows = await conn.execute_fetchall(query, (cutoff,))
+        ids = [r[0] for r in rows]
+        for start in range(0, len(ids), MEDIA_GC_BATCH_SIZE):
+            chunk = ids[start:start + MEDIA_GC_BATCH_SIZE]
+            await conn.execute(f"DELETE FROM archive.media_assets WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+    removed = await asyncio.to_thread(_remove, [r[1] for r in rows], quarantine)
+    return {"rows": len(rows), "bytes": removed}
+
+
+async def collect_media_garbage(
+    *,
+    min_age_secs: int | None = None,
+    quarantine: str | Path | None = None,
+    archived_media_days: int | None = None,
+    dry_run: bool = False,
+) -> dict[str, Any]:
+    """Delete (or quarantine) files in MEDIA_DIR that no media_assets row references.
+
+    Returns counts and the bytes reclaimed (or that would be, with dry_run).
+    """
+    _require_aiosqlite()
+    quarantine = quarantine or MEDIA_GC_QUARANTINE_DIR
+    quarantine = Path(quarantine).resolve() if quarantine else None
+    if quarantine is not None and quarantine.is_relative_to(MEDIA_DIR.resolve()):
+        raise ValueError("Quarantine directory must be outside MEDIA_DIR (it is served publicly)")
+    min_age = MEDIA_GC_MIN_AGE_SECS if min_age_secs is None else min_age_secs
+    newest = time.time() - min_age
+
+    summary: dict[str, Any] = {"scanned": 0, "scanned_bytes": 0, "orphans": 0, "reclaimed_bytes": 0, "too_new": 0}
+    if archived_media_days is not None:
+        dropped = await _drop_archived_media(archived_media_days, quarantine, dry_run)
+        summary["archived_media_rows"] = dropped["rows"]
+        summary["reclaimed_bytes"] += dropped["bytes"]
+    if not MEDIA_DIR.is_dir():
+        return summary
+
+    # The walk is blocking I/O: pull each batch on a worker thread
+    batches = _batches(_walk(MEDIA_DIR), MEDIA_GC_BATCH_SIZE)
+    while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+        summary["scanned"] += len(batch)
+        summary["scanned_bytes"] += sum(size for _, size, _ in batch)
+        live = await _referenced([key for key, _, _ in batch])
+        orphans = []
+        for key, size, mtime in batch:
+            if key in live:
+                continue
+            if mtime > newest:
+                summary["too_new"] += 1
+                continue
+            orphans.append(key)
+            if dry_run:
+                summary["reclaimed_bytes"] += size
+        summary["orphans"] += len(orphans)
+        if orphans and not dry_run:
+            summary["reclaimed_bytes"] += await asyncio.to_thread(_remove, orphans, quarantine)
+    logger.info(
+        "Media GC%s: %d files scanned, %d orphans, %.1f MB %s",
+        " (dry run)" if dry_run else "",
+        summary["scanned"],
+        summary["orphans"],
+        summary["reclaimed_bytes"] / 2**20,
+        "quarantined" if quarantine else "reclaimed",
+    )
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Remove media files no report references")
+    parser.add_argument("--min-age", type=int, default=None, help="Skip files modified in the last N seconds")
+    parser.add_argument("--quarantine", default=None,
+                        help="Move orphans here instead of deleting them (default: MEDIA_GC_QUARANTINE_DIR)")
+    parser.add_argument("--archived-media-days", type=int, default=None,
+                        help="Also drop media of reports archived more than N days ago")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be removed")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from db import init_db
+    from db_pool import close_pool
+
+    async def _run() -> dict[str, Any]:
+        await init_db()
+        try:
+            return await collect_media_garbage(
+                min_age_secs=args.min_age,
+                quarantine=args.quarantine,
+                archived_media_days=args.archived_media_days,
+                dry_run=args.dry_run,
+            )
+        finally:
+            await close_pool()
+
+    print(asyncio.run(_run()))
+
+
+if __name__ == "__main__":
+    main()
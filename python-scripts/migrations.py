@@ -0,0 +1,1039 @@
+"""
+Versioned schema migrations for the bookings database.
+
+The applied version lives in PRAGMA user_version. On startup only migrations
+numbered above it run, all inside one BEGIN IMMEDIATE transaction together
+with the user_version bump, so a crash mid-upgrade leaves the old schema in
+place. When the database is current, startup does no DDL at all.
+
+To change the schema, append a Migration with the next version number.
+Never edit one that has shipped: production databases have already run it.
+Steps are SQL statements (triggers included) or async callables taking the
+connection, for changes SQL alone can't express conditionally.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import math
+import re
+import sqlite3
+import sys
+import zlib
+from array import array
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Union
+
+logger = logging.getLogger("tripoint.db")
+
+Step = Union[str, Callable[[Any], Awaitable[None]]]
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    steps: tuple[Step, ...]
+
+
+def split_sql(script: str) -> tuple[str, ...]:
+    """Split a script into single statements (trigger bodies stay whole).
+
+    executescript() would COMMIT the surrounding transaction first, so
+    migrations run statements one at a time instead.
+    """
+    statements: list[str] = []
+    buf = ""
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            statements.append(buf.strip())
+            buf = ""
+    if buf.strip():
+        raise ValueError(f"Incomplete SQL statement in migration: {buf.strip()[:80]}")
+    return tuple(statements)
+
+
+async def column_names(conn: Any, table: str) -> set[str]:
+    async with conn.execute(f"PRAGMA table_info({table})") as cursor:
+        return {row[1] for row in await cursor.fetchall()}
+
+
+async def add_column_if_missing(conn: Any, table: str, column: str, decl: str) -> None:
+    if column not in await column_names(conn, table):
+        await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+# ─── Schema ──────────────────────────────────────────────────────────────────
+
+# Baseline (version 1). Every statement is IF NOT EXISTS so it also adopts
+# databases created before versioning.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bookings (
+    id                      TEXT PRIMARY KEY,
+    status                  TEXT NOT NULL DEFAULT 'PENDING_DEPOSIT',
+    payment_link_token      TEXT NOT NULL UNIQUE,
+    full_name               TEXT NOT NULL,
+    email                   TEXT NOT NULL,
+    phone                   TEXT NOT NULL,
+    postcode                TEXT NOT NULL,
+    address_line_1          TEXT,
+    town_city               TEXT,
+    vehicle_reg             TEXT,
+    vehicle_make            TEXT,
+    vehicle_model           TEXT,
+    approx_mileage          TEXT,
+    symptoms                TEXT,
+    additional_notes        TEXT,
+    safe_location           INTEGER NOT NULL DEFAULT 0,
+    service_ids             TEXT NOT NULL,
+    slot_start_iso          TEXT NOT NULL,
+    slot_end_iso            TEXT NOT NULL,
+    zone                    TEXT,
+    drive_time_mins         INTEGER,
+    travel_buffer           INTEGER,
+    total_amount            INTEGER,
+    deposit_amount          INTEGER,
+    balance_due             INTEGER,
+    currency                TEXT NOT NULL DEFAULT 'gbp',
+    stripe_checkout_session_id TEXT,
+    stripe_payment_intent_id   TEXT,
+    stripe_customer_id         TEXT,
+    stripe_balance_session_id  TEXT,
+    calendar_event_id       TEXT,
+    created_at              TEXT NOT NULL,
+    updated_at              TEXT NOT NULL,
+    deposit_paid_at         TEXT,
+    completed_at            TEXT
+);
+
+CREATE TABLE IF NOT EXISTS payment_events (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    booking_id      TEXT NOT NULL,
+    stripe_event_id TEXT UNIQUE,
+    event_type      TEXT NOT NULL,
+    amount          INTEGER,
+    created_at      TEXT NOT NULL,
+    FOREIGN KEY (booking_id) REFERENCES bookings(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_bookings_token ON bookings(payment_link_token);
+CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings(status);
+CREATE INDEX IF NOT EXISTS idx_bookings_slot ON bookings(slot_start_iso, slot_end_iso);
+CREATE INDEX IF NOT EXISTS idx_payment_events_stripe ON payment_events(stripe_event_id);
+
+CREATE TABLE IF NOT EXISTS diagnostic_reports (
+    id                  TEXT PRIMARY KEY,
+    booking_id          TEXT NOT NULL,
+    status              TEXT NOT NULL DEFAULT 'DRAFT',
+    share_token         TEXT UNIQUE,
+    customer_name       TEXT NOT NULL,
+    customer_email      TEXT NOT NULL,
+    customer_phone      TEXT,
+    customer_address    TEXT,
+    customer_postcode   TEXT,
+    report_email_sent   INTEGER NOT NULL DEFAULT 0,
+    created_at          TEXT NOT NULL,
+    updated_at          TEXT NOT NULL,
+    completed_at        TEXT,
+    FOREIGN KEY (booking_id) REFERENCES bookings(id)
+);
+
+CREATE TABLE IF NOT EXISTS report_vehicles (
+    id                  TEXT PRIMARY KEY,
+    report_id           TEXT NOT NULL,
+    sort_order          INTEGER NOT NULL DEFAULT 0,
+    reg                 TEXT,
+    vin                 TEXT,
+    make                TEXT,
+    model               TEXT,
+    variant             TEXT,
+    mileage             TEXT,
+    drivability_status  TEXT,
+    notes               TEXT,
+    created_at          TEXT NOT NULL,
+    updated_at          TEXT NOT NULL,
+    FOREIGN KEY (report_id) REFERENCES diagnostic_reports(id)
+);
+
+CREATE TABLE IF NOT EXISTS vehicle_faults (
+    id              TEXT PRIMARY KEY,
+    vehicle_id      TEXT NOT NULL,
+    sort_order      INTEGER NOT NULL DEFAULT 0,
+    title           TEXT NOT NULL,
+    severity        TEXT,
+    status          TEXT,
+    impact          TEXT,
+    dtcs            TEXT,
+    root_causes     TEXT,
+    conclusion      TEXT,
+    action_plan     TEXT,
+    parts_required  TEXT,
+    coding_required TEXT,
+    explanation     TEXT,
+    solution        TEXT,
+    created_at      TEXT NOT NULL,
+    updated_at      TEXT NOT NULL,
+    FOREIGN KEY (vehicle_id) REFERENCES report_vehicles(id)
+);
+
+CREATE TABLE IF NOT EXISTS fault_tests (
+    id          TEXT PRIMARY KEY,
+    vehicle_id  TEXT NOT NULL,
+    fault_id    TEXT,
+    sort_order  INTEGER NOT NULL DEFAULT 0,
+    test_name   TEXT NOT NULL,
+    tool_used   TEXT,
+    result      TEXT,
+    readings    TEXT,
+    notes       TEXT,
+    created_at  TEXT NOT NULL,
+    updated_at  TEXT NOT NULL,
+    FOREIGN KEY (vehicle_id) REFERENCES report_vehicles(id),
+    FOREIGN KEY (fault_id) REFERENCES vehicle_faults(id)
+);
+
+CREATE TABLE IF NOT EXISTS media_assets (
+    id          TEXT PRIMARY KEY,
+    report_id   TEXT NOT NULL,
+    vehicle_id  TEXT,
+    fault_id    TEXT,
+    test_id     TEXT,
+    media_type  TEXT NOT NULL,
+    filename    TEXT NOT NULL,
+    storage_key TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    size_bytes  INTEGER NOT NULL,
+    caption     TEXT,
+    created_at  TEXT NOT NULL,
+    FOREIGN KEY (report_id) REFERENCES diagnostic_reports(id),
+    FOREIGN KEY (vehicle_id) REFERENCES report_vehicles(id),
+    FOREIGN KEY (fault_id) REFERENCES vehicle_faults(id),
+    FOREIGN KEY (test_id) REFERENCES fault_tests(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_reports_booking ON diagnostic_reports(booking_id);
+CREATE INDEX IF NOT EXISTS idx_reports_status ON diagnostic_reports(status);
+CREATE INDEX IF NOT EXISTS idx_reports_share_token ON diagnostic_reports(share_token);
+CREATE INDEX IF NOT EXISTS idx_vehicles_report ON report_vehicles(report_id);
+CREATE INDEX IF NOT EXISTS idx_faults_vehicle ON vehicle_faults(vehicle_id);
+CREATE INDEX IF NOT EXISTS idx_tests_vehicle ON fault_tests(vehicle_id);
+CREATE INDEX IF NOT EXISTS idx_media_report ON media_assets(report_id);
+
+CREATE TABLE IF NOT EXISTS email_campaign_sends (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    campaign    TEXT NOT NULL,
+    booking_id  TEXT NOT NULL,
+    email       TEXT NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'PENDING',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    created_at  TEXT NOT NULL,
+    sent_at     TEXT,
+    UNIQUE (campaign, booking_id),
+    FOREIGN KEY (booking_id) REFERENCES bookings(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_campaign_sends_status ON email_campaign_sends(campaign, status);
+"""
+
+
+async def _add_fault_text_columns(conn: Any) -> None:
+    # Databases created before these columns were added to the baseline
+    await add_column_if_missing(conn, "vehicle_faults", "explanation", "TEXT")
+    await add_column_if_missing(conn, "vehicle_faults", "solution", "TEXT")
+
+
+# Found by audit_query_plans.py: lookups that scanned a whole table
+HOT_PATH_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_bookings_checkout_session ON bookings(stripe_checkout_session_id);
+CREATE INDEX IF NOT EXISTS idx_bookings_balance_session ON bookings(stripe_balance_session_id);
+CREATE INDEX IF NOT EXISTS idx_bookings_status_slot ON bookings(status, slot_start_iso);
+DROP INDEX IF EXISTS idx_bookings_status;
+CREATE INDEX IF NOT EXISTS idx_reports_created ON diagnostic_reports(created_at);
+CREATE INDEX IF NOT EXISTS idx_reports_status_created ON diagnostic_reports(status, created_at);
+DROP INDEX IF EXISTS idx_reports_status;
+CREATE INDEX IF NOT EXISTS idx_reports_customer_name ON diagnostic_reports(customer_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_reports_customer_email ON diagnostic_reports(customer_email COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_tests_fault ON fault_tests(fault_id);
+CREATE INDEX IF NOT EXISTS idx_media_vehicle ON media_assets(vehicle_id);
+CREATE INDEX IF NOT EXISTS idx_media_fault ON media_assets(fault_id);
+CREATE INDEX IF NOT EXISTS idx_media_test ON media_assets(test_id);
+"""
+
+
+async def _add_slot_epoch_columns(conn: Any) -> None:
+    await add_column_if_missing(conn, "bookings", "slot_start_ts", "INTEGER")
+    await add_column_if_missing(conn, "bookings", "slot_end_ts", "INTEGER")
+
+
+# Slot times as UTC epoch seconds. The ISO strings carry mixed offsets
+# (+00:00 / +01:00 across BST), so comparing them as text misorders slots.
+# insert_booking fills these; the trigger covers later edits of the ISO text.
+SLOT_EPOCH_COLUMNS = """
+UPDATE bookings SET
+    slot_start_ts = CAST(strftime('%s', slot_start_iso) AS INTEGER),
+    slot_end_ts = CAST(strftime('%s', slot_end_iso) AS INTEGER);
+CREATE INDEX IF NOT EXISTS idx_bookings_slot_ts ON bookings(slot_start_ts);
+CREATE INDEX IF NOT EXISTS idx_bookings_status_slot_ts ON bookings(status, slot_start_ts);
+DROP INDEX IF EXISTS idx_bookings_slot;
+DROP INDEX IF EXISTS idx_bookings_status_slot;
+CREATE TRIGGER IF NOT EXISTS bookings_slot_ts_update
+AFTER UPDATE OF slot_start_iso, slot_end_iso ON bookings
+BEGIN
+    UPDATE bookings SET
+        slot_start_ts = CAST(strftime('%s', NEW.slot_start_iso) AS INTEGER),
+        slot_end_ts = CAST(strftime('%s', NEW.slot_end_iso) AS INTEGER)
+    WHERE id = NEW.id;
+END;
+"""
+
+
+# Admin lists page by (sort key, id); the id tie-break must be in the index
+# for the keyset condition and ORDER BY to be served without a sort.
+KEYSET_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_bookings_slot_ts_id ON bookings(slot_start_ts, id);
+CREATE INDEX IF NOT EXISTS idx_bookings_status_slot_ts_id ON bookings(status, slot_start_ts, id);
+DROP INDEX IF EXISTS idx_bookings_slot_ts;
+DROP INDEX IF EXISTS idx_bookings_status_slot_ts;
+CREATE INDEX IF NOT EXISTS idx_reports_created_id ON diagnostic_reports(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_reports_status_created_id ON diagnostic_reports(status, created_at, id);
+DROP INDEX IF EXISTS idx_reports_created;
+DROP INDEX IF EXISTS idx_reports_status_created;
+"""
+
+
+# Full-text index over everything an admin might type into the reports
+# search box, one FTS row per source row:
+#   kind 0: report customer fields, ids and the booking's symptoms
+#   kind 1: vehicle reg / VIN / make / model / variant
+#   kind 2: fault title / DTCs (raw JSON) / conclusion
+#   kind 3: test name / tool / result
+# report_search_rows gives each (kind, source id) a stable FTS rowid, so the
+# triggers update/delete by rowid. (Source rowids can't be used: VACUUM may
+# renumber them, as these tables have TEXT primary keys.)
+_REPORT_BODY = """coalesce({t}.id, '') || ' ' || coalesce({t}.booking_id, '') || ' ' ||
+        coalesce({t}.customer_name, '') || ' ' || coalesce({t}.customer_email, '') || ' ' ||
+        coalesce({t}.customer_phone, '') || ' ' || coalesce({t}.customer_postcode, '') || ' ' ||
+        coalesce((SELECT symptoms FROM bookings WHERE id = {t}.booking_id), '')"""
+_VEHICLE_BODY = """coalesce({t}.reg, '') || ' ' || coalesce({t}.vin, '') || ' ' || coalesce({t}.make, '') || ' ' ||
+        coalesce({t}.model, '') || ' ' || coalesce({t}.variant, '')"""
+_FAULT_BODY = """coalesce({t}.title, '') || ' ' || coalesce({t}.dtcs, '') || ' ' || coalesce({t}.conclusion, '')"""
+_TEST_BODY = """coalesce({t}.test_name, '') || ' ' || coalesce({t}.tool_used, '') || ' ' || coalesce({t}.result, '')"""
+_VEHICLE_REPORT = "(SELECT report_id FROM report_vehicles WHERE id = {t}.vehicle_id)"
+
+# (source table, kind, report_id expression, body expression, columns that feed the body)
+_SEARCH_SOURCES = (
+    ("diagnostic_reports", 0, "{t}.id", _REPORT_BODY,
+     "customer_name, customer_email, customer_phone, customer_postcode"),
+    ("report_vehicles", 1, "{t}.report_id", _VEHICLE_BODY, "reg, vin, make, model, variant"),
+    ("vehicle_faults", 2, _VEHICLE_REPORT, _FAULT_BODY, "title, dtcs, conclusion"),
+    ("fault_tests", 3, _VEHICLE_REPORT, _TEST_BODY, "test_name, tool_used, result"),
+)
+
+
+def _report_search_sql() -> str:
+    parts = [
+        """
+CREATE TABLE IF NOT EXISTS report_search_rows (
+    id          INTEGER PRIMARY KEY,
+    kind        INTEGER NOT NULL,
+    source_id   TEXT NOT NULL,
+    UNIQUE (kind, source_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS report_search USING fts5(
+    body, report_id UNINDEXED, kind UNINDEXED, tokenize = 'unicode61'
+);
+-- The prefix search from migration 2 is replaced by report_search
+DROP INDEX IF EXISTS idx_reports_customer_name;
+DROP INDEX IF EXISTS idx_reports_customer_email;"""
+    ]
+    for table, kind, report_id, body, columns in _SEARCH_SOURCES:
+        row = f"(SELECT id FROM report_search_rows WHERE kind = {kind} AND source_id = {{t}}.id)"
+        new_values = f"{row.format(t='NEW')}, {body.format(t='NEW')}, {report_id.format(t='NEW')}, {kind}"
+        parts.append(f"""
+INSERT INTO report_search_rows (kind, source_id) SELECT {kind}, id FROM {table};
+INSERT INTO report_search (rowid, body, report_id, kind)
+SELECT m.id, {body.format(t=table)}, {report_id.format(t=table)}, {kind}
+FROM {table} JOIN report_search_rows m ON m.kind = {kind} AND m.source_id = {table}.id;
+CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table}
+BEGIN
+    INSERT OR IGNORE INTO report_search_rows (kind, source_id) VALUES ({kind}, NEW.id);
+    INSERT INTO report_search (rowid, body, report_id, kind) VALUES ({new_values});
+END;
+CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE OF {columns} ON {table}
+BEGIN
+    DELETE FROM report_search WHERE rowid = {row.format(t='OLD')};
+    INSERT INTO report_search (rowid, body, report_id, kind) VALUES ({new_values});
+END;
+CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table}
+BEGIN
+    DELETE FROM report_search WHERE rowid = {row.format(t='OLD')};
+    DELETE FROM report_search_rows WHERE kind = {kind} AND source_id = OLD.id;
+END;""")
+    return "\n".join(parts) + "\n"
+
+
+# Dashboard rollups, kept current by triggers on bookings so every status
+# transition (deposit paid, completed, marked paid, expired) updates them in
+# the same transaction. Keyed by the booking's local slot date, so a stats
+# read costs O(days requested) rather than O(bookings). Each change subtracts
+# the old row's contribution and adds the new one's.
+_STATS_DAY = "substr({t}.slot_start_iso, 1, 10)"
+_STATS_SERVICES = """json_each('["' || replace(coalesce({t}.service_ids, ''), ',', '","') || '"]')"""
+_STATS_COLUMNS = "status, zone, slot_start_iso, service_ids, total_amount, deposit_amount, balance_due, deposit_paid_at"
+
+
+def _stats_delta(t: str, sign: str) -> str:
+    """Statements adding (sign '') or removing (sign '-') one booking row's contribution."""
+    day = _STATS_DAY.format(t=t)
+    sql = f"""
+    INSERT INTO booking_stats_daily (day, zone, status, bookings, total_amount, deposits_paid, balance_due)
+    VALUES (
+        {day}, coalesce({t}.zone, ''), {t}.status, {sign}1,
+        {sign}coalesce({t}.total_amount, 0),
+        {sign}(CASE WHEN {t}.deposit_paid_at IS NOT NULL THEN coalesce({t}.deposit_amount, 0) ELSE 0 END),
+        {sign}coalesce({t}.balance_due, 0)
+    )
+    ON CONFLICT (day, zone, status) DO UPDATE SET
+        bookings = bookings + excluded.bookings,
+        total_amount = total_amount + excluded.total_amount,
+        deposits_paid = deposits_paid + excluded.deposits_paid,
+        balance_due = balance_due + excluded.balance_due;
+    INSERT INTO booking_stats_service_daily (day, service_id, status, bookings)
+    SELECT {day}, trim(value), {t}.status, {sign}1 FROM {_STATS_SERVICES.format(t=t)} WHERE trim(value) != ''
+    ON CONFLICT (day, service_id, status) DO UPDATE SET bookings = bookings + excluded.bookings;"""
+    if sign:
+        sql += f"""
+    DELETE FROM booking_stats_daily WHERE day = {day} AND zone = coalesce({t}.zone, '') AND status = {t}.status AND bookings = 0;
+    DELETE FROM booking_stats_service_daily WHERE day = {day} AND status = {t}.status AND bookings = 0;"""
+    return sql
+
+
+def _booking_stats_sql() -> str:
+    changed = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in _STATS_COLUMNS.split(", "))
+    return f"""
+CREATE TABLE IF NOT EXISTS booking_stats_daily (
+    day             TEXT NOT NULL,
+    zone            TEXT NOT NULL,
+    status          TEXT NOT NULL,
+    bookings        INTEGER NOT NULL DEFAULT 0,
+    total_amount    INTEGER NOT NULL DEFAULT 0,
+    deposits_paid   INTEGER NOT NULL DEFAULT 0,
+    balance_due     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, zone, status)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS booking_stats_service_daily (
+    day             TEXT NOT NULL,
+    service_id      TEXT NOT NULL,
+    status          TEXT NOT NULL,
+    bookings        INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, service_id, status)
+) WITHOUT ROWID;
+DELETE FROM booking_stats_daily;
+DELETE FROM booking_stats_service_daily;
+INSERT INTO booking_stats_daily (day, zone, status, bookings, total_amount, deposits_paid, balance_due)
+SELECT {_STATS_DAY.format(t="b")}, coalesce(b.zone, ''), b.status, COUNT(*),
+    SUM(coalesce(b.total_amount, 0)),
+    SUM(CASE WHEN b.deposit_paid_at IS NOT NULL THEN coalesce(b.deposit_amount, 0) ELSE 0 END),
+    SUM(coalesce(b.balance_due, 0))
+FROM bookings b GROUP BY 1, 2, 3;
+INSERT INTO booking_stats_service_daily (day, service_id, status, bookings)
+SELECT {_STATS_DAY.format(t="b")}, trim(s.value), b.status, COUNT(*)
+FROM bookings b, {_STATS_SERVICES.format(t="b")} s WHERE trim(s.value) != '' GROUP BY 1, 2, 3;
+CREATE TRIGGER IF NOT EXISTS bookings_stats_insert AFTER INSERT ON bookings
+BEGIN{_stats_delta("NEW", "")}
+END;
+CREATE TRIGGER IF NOT EXISTS bookings_stats_update AFTER UPDATE OF {_STATS_COLUMNS} ON bookings
+WHEN {changed}
+BEGIN{_stats_delta("OLD", "-")}{_stats_delta("NEW", "")}
+END;
+CREATE TRIGGER IF NOT EXISTS bookings_stats_delete AFTER DELETE ON bookings
+BEGIN{_stats_delta("OLD", "-")}
+END;
+"""
+
+
+# archive.py moves old bookings out of the hot database and records each id
+# here first, so the stats delete trigger can tell "archived" (history still
+# counts) from "deleted" (subtract it).
+ARCHIVED_BOOKINGS = f"""
+CREATE TABLE IF NOT EXISTS archived_bookings (
+    id              TEXT PRIMARY KEY,
+    archived_at     TEXT NOT NULL
+) WITHOUT ROWID;
+DROP TRIGGER IF EXISTS bookings_stats_delete;
+CREATE TRIGGER bookings_stats_delete AFTER DELETE ON bookings
+WHEN NOT EXISTS (SELECT 1 FROM archived_bookings WHERE id = OLD.id)
+BEGIN{_stats_delta("OLD", "-")}
+END;
+"""
+
+
+# Idempotency-Key -> stored response for the customer-facing POSTs (see
+# services/idempotency.py). response IS NULL while the first request runs.
+IDEMPOTENCY_KEYS = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope           TEXT NOT NULL,
+    key             TEXT NOT NULL,
+    request_hash    TEXT NOT NULL,
+    status_code     INTEGER,
+    response        TEXT,
+    created_at      INTEGER NOT NULL,
+    expires_at      INTEGER NOT NULL,
+    PRIMARY KEY (scope, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at);
+"""
+
+
+async def _add_report_revision_column(conn: Any) -> None:
+    await add_column_if_missing(conn, "diagnostic_reports", "revision", "INTEGER NOT NULL DEFAULT 0")
+
+
+# Columns of diagnostic_reports that appear in the public share view
+_SNAPSHOT_REPORT_COLUMNS = (
+    "status, share_token, customer_name, customer_email, customer_phone, "
+    "customer_address, customer_postcode, completed_at"
+)
+# (table, SQL giving the owning report id from a NEW./OLD. row prefix)
+_SNAPSHOT_CHILD_TABLES = (
+    ("report_vehicles", "{t}.report_id"),
+    ("media_assets", "{t}.report_id"),
+    ("vehicle_faults", "(SELECT report_id FROM report_vehicles WHERE id = {t}.vehicle_id)"),
+    ("fault_tests", "(SELECT report_id FROM report_vehicles WHERE id = {t}.vehicle_id)"),
+)
+
+
+def _report_snapshot_sql() -> str:
+    """Snapshot table plus triggers bumping diagnostic_reports.revision on any
+    edit the public view can see. A snapshot is only served while its
+    revision matches the report's."""
+    changed = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in _SNAPSHOT_REPORT_COLUMNS.split(", "))
+    sql = f"""
+CREATE TABLE IF NOT EXISTS report_snapshots (
+    report_id       TEXT PRIMARY KEY,
+    revision        INTEGER NOT NULL,
+    etag            TEXT NOT NULL,
+    body            BLOB NOT NULL,
+    created_at      TEXT NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS diagnostic_reports_revision
+AFTER UPDATE OF {_SNAPSHOT_REPORT_COLUMNS} ON diagnostic_reports
+WHEN {changed}
+BEGIN
+    UPDATE diagnostic_reports SET revision = revision + 1 WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS diagnostic_reports_snapshot_delete AFTER DELETE ON diagnostic_reports
+BEGIN
+    DELETE FROM report_snapshots WHERE report_id = OLD.id;
+END;
+"""
+    for table, owner in _SNAPSHOT_CHILD_TABLES:
+        for event, rows in (("insert", ("NEW",)), ("update", ("OLD", "NEW")), ("delete", ("OLD",))):
+            ids = ", ".join(owner.format(t=t) for t in rows)
+            sql += f"""CREATE TRIGGER IF NOT EXISTS {table}_revision_{event} AFTER {event.upper()} ON {table}
+BEGIN
+    UPDATE diagnostic_reports SET revision = revision + 1 WHERE id IN ({ids});
+END;
+"""
+    return sql
+
+
+# media_gc.py checks files on disk against their rows in batches
+MEDIA_STORAGE_KEY_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_media_storage_key ON media_assets(storage_key);
+"""
+
+
+# New children append at MAX(sort_order) + 1 of their siblings, and every
+# child list is read ORDER BY sort_order, created_at: both become index seeks.
+# The old single-column indexes are prefixes of these.
+CHILD_SORT_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_vehicles_report_sort ON report_vehicles(report_id, sort_order, created_at);
+CREATE INDEX IF NOT EXISTS idx_faults_vehicle_sort ON vehicle_faults(vehicle_id, sort_order, created_at);
+CREATE INDEX IF NOT EXISTS idx_tests_vehicle_sort ON fault_tests(vehicle_id, sort_order, created_at);
+DROP INDEX IF EXISTS idx_vehicles_report;
+DROP INDEX IF EXISTS idx_faults_vehicle;
+DROP INDEX IF EXISTS idx_tests_vehicle;
+"""
+
+
+# Registrations and VINs are typed freely ("ab12 cde", "AB12-CDE"); history
+# lookups compare a key with spacing and punctuation removed, upper-cased.
+# vehicle_key() must stay in step with the SQL.
+_VEHICLE_KEY_STRIP = (" ", "-", ".", "\t")
+
+
+def vehicle_key(value: str | None) -> str | None:
+    if not value:
+        return None
+    for ch in _VEHICLE_KEY_STRIP:
+        value = value.replace(ch, "")
+    return value.upper() or None
+
+
+def _vehicle_key_sql(column: str) -> str:
+    expr = column
+    for ch in _VEHICLE_KEY_STRIP:
+        expr = f"REPLACE({expr}, {'char(9)' if ch == chr(9) else repr(ch)}, '')"
+    return f"NULLIF(UPPER({expr}), '')"
+
+
+async def _add_vehicle_key_columns(conn: Any) -> None:
+    await add_column_if_missing(conn, "report_vehicles", "reg_key", "TEXT")
+    await add_column_if_missing(conn, "report_vehicles", "vin_key", "TEXT")
+    await add_column_if_missing(conn, "bookings", "vehicle_reg_key", "TEXT")
+
+
+# Derived columns: SQL that fills them in a table, keyed (table, column).
+# ensure_archive_schema runs it when it adds the column to an older archive.
+DERIVED_COLUMN_BACKFILL = {
+    ("report_vehicles", "reg_key"): f"UPDATE {{t}} SET reg_key = {_vehicle_key_sql('reg')}",
+    ("report_vehicles", "vin_key"): f"UPDATE {{t}} SET vin_key = {_vehicle_key_sql('vin')}",
+    ("bookings", "vehicle_reg_key"): f"UPDATE {{t}} SET vehicle_reg_key = {_vehicle_key_sql('vehicle_reg')}",
+}
+
+
+def _vehicle_keys_sql() -> str:
+    backfill = "".join(
+        sql.format(t=table) + ";\n" for (table, _), sql in DERIVED_COLUMN_BACKFILL.items()
+    )
+    return backfill + f"""
+CREATE INDEX IF NOT EXISTS idx_vehicles_reg_key ON report_vehicles(reg_key);
+CREATE INDEX IF NOT EXISTS idx_vehicles_vin_key ON report_vehicles(vin_key);
+CREATE INDEX IF NOT EXISTS idx_bookings_vehicle_reg_key ON bookings(vehicle_reg_key);
+CREATE TRIGGER IF NOT EXISTS report_vehicles_keys_insert AFTER INSERT ON report_vehicles
+BEGIN
+    UPDATE report_vehicles SET reg_key = {_vehicle_key_sql('NEW.reg')}, vin_key = {_vehicle_key_sql('NEW.vin')}
+    WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS report_vehicles_keys_update AFTER UPDATE OF reg, vin ON report_vehicles
+BEGIN
+    UPDATE report_vehicles SET reg_key = {_vehicle_key_sql('NEW.reg')}, vin_key = {_vehicle_key_sql('NEW.vin')}
+    WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS bookings_reg_key_insert AFTER INSERT ON bookings
+BEGIN
+    UPDATE bookings SET vehicle_reg_key = {_vehicle_key_sql('NEW.vehicle_reg')} WHERE id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS bookings_reg_key_update AFTER UPDATE OF vehicle_reg ON bookings
+BEGIN
+    UPDATE bookings SET vehicle_reg_key = {_vehicle_key_sql('NEW.vehicle_reg')} WHERE id = NEW.id;
+END;
+"""
+
+
+# One row per (fault, DTC code) so fault analytics are SQL aggregates over
+# indexes rather than a parse of every vehicle_faults.dtcs blob. Codes are the
+# standard five-character form (P0302, U0100; any suffix such as "-00" or a
+# description is dropped) found anywhere in the JSON, as strings or object
+# keys. Triggers keep it current on every fault write and copy the vehicle's
+# make / model onto it when those change.
+_DTC_CODE = "upper(trim(c.value))"
+
+
+def _fault_dtc_rows(f: str, source: str = "", schema: str = "") -> str:
+    """SELECT of the fault_dtcs rows for fault row `f` (NEW, or an alias in `source`)."""
+    # Each JSON node offers its text value and its object key as candidates
+    return f"""
+    SELECT {f}.id, {f}.vehicle_id, substr({_DTC_CODE}, 1, 5), v.make, v.model, {f}.created_at
+    FROM {source}{schema}report_vehicles v,
+        json_tree(CASE WHEN json_valid({f}.dtcs) THEN {f}.dtcs END) j,
+        json_each(json_array(CASE WHEN j.type = 'text' THEN j.value END, j.key)) c
+    WHERE v.id = {f}.vehicle_id
+      AND c.type = 'text'
+      AND {_DTC_CODE} GLOB '[PBCU][0-9A-F][0-9A-F][0-9A-F][0-9A-F]*'
+      AND substr({_DTC_CODE}, 6, 1) NOT GLOB '[0-9A-Z]'"""
+
+
+_FAULT_DTCS_INSERT = "INSERT OR IGNORE INTO {schema}fault_dtcs (fault_id, vehicle_id, code, make, model, created_at)"
+
+# Derived tables the archive database fills from its own rows when
+# ensure_archive_schema first creates them there ({schema} = "archive.")
+DERIVED_TABLE_BACKFILL = {
+    "fault_dtcs": _FAULT_DTCS_INSERT + _fault_dtc_rows("f", "{schema}vehicle_faults f, ", "{schema}"),
+}
+
+
+def _fault_dtcs_sql() -> str:
+    return f"""
+CREATE TABLE IF NOT EXISTS fault_dtcs (
+    fault_id        TEXT NOT NULL,
+    vehicle_id      TEXT NOT NULL,
+    code            TEXT NOT NULL,
+    make            TEXT COLLATE NOCASE,
+    model           TEXT COLLATE NOCASE,
+    created_at      TEXT NOT NULL,
+    PRIMARY KEY (fault_id, code)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_fault_dtcs_code ON fault_dtcs(code, created_at, vehicle_id);
+CREATE INDEX IF NOT EXISTS idx_fault_dtcs_created ON fault_dtcs(created_at, code, vehicle_id);
+CREATE INDEX IF NOT EXISTS idx_fault_dtcs_model ON fault_dtcs(model, created_at);
+CREATE INDEX IF NOT EXISTS idx_fault_dtcs_vehicle ON fault_dtcs(vehicle_id, code);
+DELETE FROM fault_dtcs;
+{DERIVED_TABLE_BACKFILL["fault_dtcs"].format(schema="")};
+CREATE TRIGGER IF NOT EXISTS vehicle_faults_dtcs_insert AFTER INSERT ON vehicle_faults
+BEGIN
+    {_FAULT_DTCS_INSERT.format(schema="")}{_fault_dtc_rows("NEW")};
+END;
+CREATE TRIGGER IF NOT EXISTS vehicle_faults_dtcs_update AFTER UPDATE OF dtcs, vehicle_id, created_at ON vehicle_faults
+WHEN OLD.dtcs IS NOT NEW.dtcs OR OLD.vehicle_id IS NOT NEW.vehicle_id OR OLD.created_at IS NOT NEW.created_at
+BEGIN
+    DELETE FROM fault_dtcs WHERE fault_id = OLD.id;
+    {_FAULT_DTCS_INSERT.format(schema="")}{_fault_dtc_rows("NEW")};
+END;
+CREATE TRIGGER IF NOT EXISTS vehicle_faults_dtcs_delete AFTER DELETE ON vehicle_faults
+BEGIN
+    DELETE FROM fault_dtcs WHERE fault_id = OLD.id;
+END;
+CREATE TRIGGER IF NOT EXISTS report_vehicles_dtcs_update AFTER UPDATE OF make, model ON report_vehicles
+WHEN OLD.make IS NOT NEW.make OR OLD.model IS NOT NEW.model
+BEGIN
+    UPDATE fault_dtcs SET make = NEW.make, model = NEW.model WHERE vehicle_id = NEW.id;
+END;
+"""
+
+
+# Long numeric arrays from fault_tests.readings (live-data captures), stored
+# as compressed typed arrays by services/timeseries.py; the readings keep a
+# summary stub in their place
+TEST_SERIES = """
+CREATE TABLE IF NOT EXISTS test_series (
+    test_id     TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    points      INTEGER NOT NULL,
+    y_encoding  TEXT NOT NULL,
+    y           BLOB NOT NULL,
+    x_encoding  TEXT,
+    x           BLOB,
+    x_name      TEXT,
+    y_min       REAL,
+    y_max       REAL,
+    y_mean      REAL,
+    created_at  TEXT NOT NULL,
+    PRIMARY KEY (test_id, name)
+);
+CREATE TRIGGER IF NOT EXISTS fault_tests_series_delete AFTER DELETE ON fault_tests
+BEGIN
+    DELETE FROM test_series WHERE test_id = OLD.id;
+END;
+"""
+
+
+# Migration 14 splits readings with its own frozen copy of the rules
+# services/timeseries.py had when it shipped (pure Python, no NumPy), so
+# what it writes never changes with that module; decode() reads the format.
+_M14_MIN_POINTS = 64
+_M14_TIME_KEYS = ("t", "time", "timestamp", "ts", "seconds", "elapsed")
+
+
+def _m14_typed(values: Any) -> array | None:
+    if not isinstance(values, list) or len(values) < _M14_MIN_POINTS:
+        return None
+    has_null = has_float = False
+    for v in values:
+        if v is None:
+            has_null = True
+        elif isinstance(v, float):
+            has_float = True
+        elif not isinstance(v, int) or isinstance(v, bool):
+            return None
+    if has_null and len(values) == values.count(None):
+        return None
+    if not has_null and not has_float:
+        try:
+            return array("q", values)
+        except OverflowError:
+            pass
+    return array("d", [math.nan if v is None else v for v in values])
+
+
+def _m14_pack(values: array, shuffle: bool) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    raw = values.tobytes()
+    if shuffle:
+        raw = b"".join(raw[i::values.itemsize] for i in range(values.itemsize))
+    return zlib.compress(raw, 6)
+
+
+def _m14_decimals(values: array) -> int | None:
+    try:
+        for decimals in range(7):
+            scale = 10 ** decimals
+            if all(round(v * scale) / scale == v for v in values[:256]):
+                break
+        else:
+            return None
+        if all(round(v * scale) / scale == v for v in values):
+            return decimals
+    except (OverflowError, ValueError):
+        pass
+    return None
+
+
+def _m14_encode(values: array) -> tuple[str, bytes]:
+    encoding = values.typecode
+    if encoding == "d" and (decimals := _m14_decimals(values)) is not None:
+        scale = 10 ** decimals
+        try:
+            values = array("q", [round(v * scale) for v in values])
+            encoding = f"q.{decimals}"
+        except OverflowError:
+            pass
+    if encoding[0] == "q":
+        if all(a <= b for a, b in zip(values, values[1:])):
+            try:
+                values = array("q", [values[0], *(b - a for a, b in zip(values, values[1:]))])
+                encoding += "+delta"
+            except OverflowError:
+                pass
+        return encoding + "+shuffle", _m14_pack(values, shuffle=True)
+    plain, shuffled = _m14_pack(values, shuffle=False), _m14_pack(values, shuffle=True)
+    return (encoding, plain) if len(plain) <= len(shuffled) else (encoding + "+shuffle", shuffled)
+
+
+def _m14_series(name: str, y: array, x: array | None, x_name: str | None, found: list[tuple]) -> dict[str, Any]:
+    """Queue a test_series row; returns the stub that replaces the values in readings."""
+    values = [v for v in y if v == v]
+    lo, hi = (min(values), max(values)) if values else (None, None)
+    mean = round(math.fsum(values) / len(values), 6) if values else None
+    y_encoding, y_blob = _m14_encode(y)
+    x_encoding, x_blob = _m14_encode(x) if x is not None else (None, None)
+    found.append((name, len(y), y_encoding, y_blob, x_encoding, x_blob, x_name, lo, hi, mean))
+    stub = {"$series": name, "points": len(y), "min": lo, "max": hi, "mean": mean}
+    if x_name:
+        stub["x"] = x_name
+    return stub
+
+
+def _m14_samples(value: Any) -> dict[str, array] | None:
+    if not isinstance(value, list) or len(value) < _M14_MIN_POINTS or not isinstance(value[0], dict):
+        return None
+    keys = list(value[0])
+    if not keys or any(not isinstance(r, dict) or r.keys() != value[0].keys() for r in value):
+        return None
+    columns = {}
+    for key in keys:
+        if (column := _m14_typed([r[key] for r in value])) is None:
+            return None
+        columns[key] = column
+    return columns
+
+
+def _m14_columns(columns: dict[str, array], path: str, found: list[tuple]) -> dict[str, Any]:
+    x_name = next((k for k in _M14_TIME_KEYS if isinstance(columns.get(k), array)), None)
+    x = columns[x_name] if x_name else None
+    stubs = {}
+    for key, values in columns.items():
+        shared = x is not None and key != x_name and len(x) == len(values)
+        stubs[key] = _m14_series(
+            f"{path}.{key}" if path else str(key), values, x if shared else None, x_name if shared else None, found
+        )
+    return stubs
+
+
+def _m14_split(node: Any, path: str, found: list[tuple]) -> Any:
+    if not isinstance(node, dict) or "$series" in node:
+        return node
+    out: dict[str, Any] = {}
+    arrays = {}
+    for key, value in node.items():
+        name = f"{path}.{key}" if path else str(key)
+        if (values := _m14_typed(value)) is not None:
+            arrays[key] = values
+        elif (columns := _m14_samples(value)) is not None:
+            out[key] = _m14_columns(columns, name, found)
+        else:
+            out[key] = _m14_split(value, name, found)
+    if arrays:
+        out.update(_m14_columns(arrays, path, found))
+        out = {key: out[key] for key in node}
+    return out
+
+
+def _m14_split_readings(readings: Any) -> tuple[Any, list[tuple]]:
+    found: list[tuple] = []
+    if (values := _m14_typed(readings)) is not None:
+        return _m14_series("values", values, None, None, found), found
+    if (columns := _m14_samples(readings)) is not None:
+        return _m14_columns(columns, "", found), found
+    return _m14_split(readings, "", found), found
+
+
+async def _split_test_readings(conn: Any) -> None:
+    """Move the series already inside fault_tests.readings into test_series."""
+    # Shortest JSON that can hold a series: _M14_MIN_POINTS one-digit numbers
+    async with conn.execute(
+        "SELECT id FROM fault_tests WHERE length(readings) >= ?", (_M14_MIN_POINTS * 2,)
+    ) as cursor:
+        ids = [row[0] for row in await cursor.fetchall()]
+    moved = 0
+    for test_id in ids:
+        async with conn.execute("SELECT readings, created_at FROM fault_tests WHERE id = ?", (test_id,)) as cursor:
+            readings, created_at = await cursor.fetchone()
+        try:
+            doc, rows = _m14_split_readings(json.loads(readings))
+        except ValueError:
+            continue
+        if rows:
+            await conn.execute("UPDATE fault_tests SET readings = ? WHERE id = ?", (json.dumps(doc), test_id))
+            await conn.executemany(
+                """
+                INSERT OR REPLACE INTO test_series (
+                    test_id, name, points, y_encoding, y, x_encoding, x, x_name, y_min, y_max, y_mean, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(test_id, *row, created_at) for row in rows],
+            )
+            moved += len(rows)
+    if moved:
+        logger.info("Moved %d series out of fault_tests.readings", moved)
+
+
+async def _add_campaign_claim_column(conn: Any) -> None:
+    # When a send was moved to SENDING; a run that died mid-send leaves it
+    # there, and the next run fails it over once it is older than a timeout
+    await add_column_if_missing(conn, "email_campaign_sends", "claimed_at", "TEXT")
+
+
+MIGRATIONS: tuple[Migration, ...] = (
+    Migration(1, "baseline schema", (*split_sql(SCHEMA), _add_fault_text_columns)),
+    Migration(2, "indexes for hot-path lookups", split_sql(HOT_PATH_INDEXES)),
+    Migration(3, "integer epoch slot columns", (_add_slot_epoch_columns, *split_sql(SLOT_EPOCH_COLUMNS))),
+    Migration(4, "keyset pagination indexes", split_sql(KEYSET_INDEXES)),
+    Migration(5, "report_search full-text index", split_sql(_report_search_sql())),
+    Migration(6, "booking stats rollups", split_sql(_booking_stats_sql())),
+    Migration(7, "archived booking ledger", split_sql(ARCHIVED_BOOKINGS)),
+    Migration(8, "idempotency keys", split_sql(IDEMPOTENCY_KEYS)),
+    Migration(9, "report revisions and share snapshots", (_add_report_revision_column, *split_sql(_report_snapshot_sql()))),
+    Migration(10, "media storage key index", split_sql(MEDIA_STORAGE_KEY_INDEX)),
+    Migration(11, "child sort order indexes", split_sql(CHILD_SORT_INDEXES)),
+    Migration(12, "normalised vehicle reg / VIN keys", (_add_vehicle_key_columns, *split_sql(_vehicle_keys_sql()))),
+    Migration(13, "fault DTC index", split_sql(_fault_dtcs_sql())),
+    Migration(14, "test reading series", (*split_sql(TEST_SERIES), _split_test_readings)),
+    Migration(15, "campaign send claim time", (_add_campaign_claim_column,)),
+)
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+# ─── Runner ──────────────────────────────────────────────────────────────────
+
+
+async def schema_version(conn: Any) -> int:
+    async with conn.execute("PRAGMA user_version") as cursor:
+        row = await cursor.fetchone()
+        return int(row[0])
+
+
+async def run_migrations(conn: Any, migrations: tuple[Migration, ...] = MIGRATIONS) -> int:
+    """Apply pending migrations on a connection with no open transaction.
+
+    Returns the schema version afterwards.
+    """
+    latest = migrations[-1].version
+    current = await schema_version(conn)
+    if current >= latest:
+        if current > latest:
+            logger.warning("Database schema v%d is newer than this code (v%d)", current, latest)
+        return current
+
+    await conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another process may have migrated while we waited for the lock
+        current = await schema_version(conn)
+        for migration in migrations:
+            if migration.version <= current:
+                continue
+            logger.info("Applying schema migration %d: %s", migration.version, migration.description)
+            for step in migration.steps:
+                if isinstance(step, str):
+                    await conn.execute(step)
+                else:
+                    await step(conn)
+            current = migration.version
+        # user_version is part of the database header, so it commits with the DDL
+        await conn.execute(f"PRAGMA user_version = {current}")
+        await conn.execute("COMMIT")
+    except BaseException:
+        await conn.execute("ROLLBACK")
+        raise
+    return current
+
+
+# ─── Archive database ────────────────────────────────────────────────────────
+
+# Tables archive.py moves to the archive database, parents first
+ARCHIVED_TABLES = (
+    "bookings",
+    "payment_events",
+    "diagnostic_reports",
+    "report_vehicles",
+    "vehicle_faults",
+    "fault_dtcs",
+    "fault_tests",
+    "test_series",
+    "media_assets",
+)
+
+_CREATE_TABLE_RE = re.compile(r'^CREATE TABLE\s+(?:IF NOT EXISTS\s+)?"?(\w+)"?', re.IGNORECASE)
+_CREATE_INDEX_RE = re.compile(r'^CREATE (UNIQUE )?INDEX\s+(?:IF NOT EXISTS\s+)?"?(\w+)"?\s+ON', re.IGNORECASE)
+
+
+async def ensure_archive_schema(conn: Any, schema: str = "archive") -> bool:
+    """Mirror the archived tables and their indexes into an attached database.
+
+    Table and index DDL is copied from main's sqlite_master, and columns main
+    gained since the archive was created are added (and filled, for
+    DERIVED_COLUMN_BACKFILL columns; DERIVED_TABLE_BACKFILL tables are filled
+    when first created), so the archive follows the migrations above. No
+    triggers are copied. The archive's own user_version records main's
+    version it was last mirrored at; when they match nothing is done, so a
+    restart with a current schema issues no DDL and takes no write lock.
+    Returns False if `schema` is not attached.
+    """
+    async with conn.execute("PRAGMA database_list") as cursor:
+        if schema not in {row[1] for row in await cursor.fetchall()}:
+            return False
+    version = await schema_version(conn)
+    async with conn.execute(f"PRAGMA {schema}.user_version") as cursor:
+        if (await cursor.fetchone())[0] == version:
+            return True
+    await conn.execute("BEGIN IMMEDIATE")
+    try:
+        index_sql: list[str] = []
+        for table in ARCHIVED_TABLES:
+            async with conn.execute(
+                "SELECT type, sql FROM main.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL",
+                (table,),
+            ) as cursor:
+                objects = await cursor.fetchall()
+            async with conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table,)) as cursor:
+                existed = await cursor.fetchone() is not None
+            for kind, sql in objects:
+                if kind == "table":
+                    await conn.execute(_CREATE_TABLE_RE.sub(f"CREATE TABLE IF NOT EXISTS {schema}.{table}", sql, 1))
+                    if not existed and table in DERIVED_TABLE_BACKFILL:
+                        await conn.execute(DERIVED_TABLE_BACKFILL[table].format(schema=f"{schema}."))
+                elif kind == "index":
+                    index_sql.append(_CREATE_INDEX_RE.sub(rf"CREATE \1INDEX IF NOT EXISTS {schema}.\2 ON", sql, 1))
+            async with conn.execute(f"PRAGMA {schema}.table_info({table})") as cursor:
+                have = {row[1] for row in await cursor.fetchall()}
+            async with conn.execute(f"PRAGMA main.table_info({table})") as cursor:
+                for row in await cursor.fetchall():
+                    if row[1] not in have:
+                        await conn.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {row[1]} {row[2]}")
+                        backfill = DERIVED_COLUMN_BACKFILL.get((table, row[1]))
+                        if backfill:
+                            await conn.execute(backfill.format(t=f"{schema}.{table}"))
+        for sql in index_sql:
+            await conn.execute(sql)
+        await conn.execute(f"PRAGMA {schema}.user_version = {version}")
+        await conn.execute("COMMIT")
+    except BaseException:
+        await conn.execute("ROLLBACK")
+        raise
+    return True
@@ -0,0 +1,265 @@
+"""
+Typed row records for the bookings database.
+
+db.py / report_db.py select an explicit column list (Record.select()) and
+build one slotted dataclass per row (Record.from_row) instead of
+dict(aiosqlite.Row): no per-row key dict, positional construction, and
+orjson serialises them natively. Records still read like the dicts they
+replaced - rec["id"], rec.get("zone"), dict(rec), {**rec} - so callers
+that only read rows need no changes. Copy to a dict (to_dict()) before
+adding keys.
+
+dumps() turns records, or dicts/lists holding them, into JSON bytes; the API
+uses it for the large admin responses (python bench_records.py compares the
+two paths).
+"""
+from __future__ import annotations
+
+import json
+from collections.abc import Mapping
+from dataclasses import dataclass, fields
+from typing import Any, ClassVar, Iterator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+
+class Record(Mapping):
+    """Read-only mapping view over a slotted dataclass row."""
+
+    __slots__ = ()
+    COLUMNS: ClassVar[tuple[str, ...]] = ()
+    # TEXT columns holding JSON, decoded when the row is loaded
+    JSON_FIELDS: ClassVar[tuple[str, ...]] = ()
+    _keys: ClassVar[frozenset[str]] = frozenset()
+
+    @classmethod
+    def select(cls, alias: str | None = None) -> str:
+        """The column list for SELECT, in field order."""
+        if alias:
+            return ", ".join(f"{alias}.{c}" for c in cls.COLUMNS)
+        return ", ".join(cls.COLUMNS)
+
+    @classmethod
+    def from_row(cls, row: Any) -> Any:
+        rec = cls(*row)
+        for name in cls.JSON_FIELDS:
+            value = getattr(rec, name)
+            if isinstance(value, str):
+                try:
+                    setattr(rec, name, json.loads(value))
+                except json.JSONDecodeError:
+                    setattr(rec, name, None)
+        return rec
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._keys:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.COLUMNS)
+
+    def __len__(self) -> int:
+        return len(self.COLUMNS)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {c: getattr(self, c) for c in self.COLUMNS}
+
+
+def record(cls: type) -> type:
+    """@dataclass(slots=True) plus the column metadata Record needs."""
+    cls = dataclass(slots=True)(cls)
+    cls.COLUMNS = tuple(f.name for f in fields(cls))
+    cls._keys = frozenset(cls.COLUMNS)
+    return cls
+
+
+# Field order is the SELECT order; keep it in step with the table.
+
+
+@record
+class Booking(Record):
+    id: str
+    status: str
+    payment_link_token: str
+    full_name: str
+    email: str
+    phone: str
+    postcode: str
+    address_line_1: str | None
+    town_city: str | None
+    vehicle_reg: str | None
+    vehicle_make: str | None
+    vehicle_model: str | None
+    approx_mileage: str | None
+    symptoms: str | None
+    additional_notes: str | None
+    safe_location: int
+    service_ids: str
+    slot_start_iso: str
+    slot_end_iso: str
+    zone: str | None
+    drive_time_mins: int | None
+    travel_buffer: int | None
+    total_amount: int | None
+    deposit_amount: int | None
+    balance_due: int | None
+    currency: str
+    stripe_checkout_session_id: str | None
+    stripe_payment_intent_id: str | None
+    stripe_customer_id: str | None
+    stripe_balance_session_id: str | None
+    calendar_event_id: str | None
+    created_at: str
+    updated_at: str
+    deposit_paid_at: str | None
+    completed_at: str | None
+    slot_start_ts: int | None
+    slot_end_ts: int | None
+    vehicle_reg_key: str | None
+
+
+@record
+class Report(Record):
+    id: str
+    booking_id: str
+    status: str
+    share_token: str | None
+    customer_name: str
+    customer_email: str
+    customer_phone: str | None
+    customer_address: str | None
+    customer_postcode: str | None
+    report_email_sent: int
+    created_at: str
+    updated_at: str
+    completed_at: str | None
+    revision: int
+
+
+@record
+class ReportListItem(Report):
+    """A report row joined with its booking's vehicle, for admin lists."""
+
+    vehicle_reg: str | None
+    vehicle_make: str | None
+    vehicle_model: str | None
+
+    @classmethod
+    def select(cls, alias: str | None = "r", booking_alias: str = "b") -> str:
+        own = ", ".join(f"{alias}.{c}" for c in Report.COLUMNS)
+        return f"{own}, {booking_alias}.vehicle_reg, {booking_alias}.vehicle_make, {booking_alias}.vehicle_model"
+
+
+@record
+class Vehicle(Record):
+    id: str
+    report_id: str
+    sort_order: int
+    reg: str | None
+    vin: str | None
+    make: str | None
+    model: str | None
+    variant: str | None
+    mileage: str | None
+    drivability_status: str | None
+    notes: str | None
+    created_at: str
+    updated_at: str
+    reg_key: str | None
+    vin_key: str | None
+
+
+@record
+class Fault(Record):
+    JSON_FIELDS = ("dtcs", "root_causes", "action_plan", "parts_required", "coding_required")
+
+    id: str
+    vehicle_id: str
+    sort_order: int
+    title: str
+    severity: str | None
+    status: str | None
+    impact: str | None
+    dtcs: Any
+    root_causes: Any
+    conclusion: str | None
+    action_plan: Any
+    parts_required: Any
+    coding_required: Any
+    explanation: str | None
+    solution: str | None
+    created_at: str
+    updated_at: str
+
+
+@record
+class Test(Record):
+    JSON_FIELDS = ("readings",)
+
+    id: str
+    vehicle_id: str
+    fault_id: str | None
+    sort_order: int
+    test_name: str
+    tool_used: str | None
+    result: str | None
+    readings: Any
+    notes: str | None
+    created_at: str
+    updated_at: str
+
+
+@record
+class Media(Record):
+    id: str
+    report_id: str
+    vehicle_id: str | None
+    fault_id: str | None
+    test_id: str | None
+    media_type: str
+    filename: str
+    storage_key: str
+    content_type: str
+    size_bytes: int
+    caption: str | None
+    created_at: str
+
+
+@record
+class TimelineEvent(Record):
+    """One entry of a vehicle's history: a booking, a report, or a fault found."""
+
+    JSON_FIELDS = ("dtcs",)
+
+    kind: str
+    at: str | None
+    id: str
+    booking_id: str | None
+    report_id: str | None
+    status: str | None
+    severity: str | None
+    title: str | None
+    mileage: str | None
+    dtcs: Any
+    archived: int
+
+
+# ─── JSON ───────────────────────────────────────────────────────────────────
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """JSON bytes for records and plain JSON values (orjson when installed)."""
+    if orjson is not None:
+        # orjson serialises dataclasses itself; default only sees the rest
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
@@ -1,32 +1,20 @@
 """
 Report-related database helpers for diagnostic reports.
-Uses aiosqlite, same pattern as db.py.
+Uses the shared aiosqlite connections in db_pool, same pattern as db.py.
 """
 from __future__ import annotations
 
+import asyncio
 import json
-import os
+import re
 import secrets
-from datetime import datetime, timezone
-from pathlib import Path
+from datetime import date, datetime, timedelta, timezone
 from typing import Any
 
-try:
-    import aiosqlite
-except ImportError:
-    aiosqlite = None  # type: ignore
-
-from dotenv import load_dotenv
-
-load_dotenv()
-
-_script_dir = Path(__file__).resolve().parent
-DB_PATH = os.getenv("BOOKINGS_DB_PATH") or str(_script_dir / "bookings.db")
-
-
-def _require_aiosqlite() -> None:
-    if aiosqlite is None:
-        raise RuntimeError("aiosqlite is required. Install with: pip install aiosqlite")
+from db_pool import DB_PATH, _require_aiosqlite, read_connection, write_transaction
+from migrations import vehicle_key
+from records import Fault, Media, Report, ReportListItem, Test, TimelineEvent, Vehicle
+from services.timeseries import Series, series_names, split_readings
 
 
 def _now_iso() -> str:
@@ -50,21 +38,19 @@ def generate_entity_id(prefix: str = "ent") -> str:
     return f"{prefix}_{secrets.token_hex(8)}"
 
 
-def _row_to_dict(row: Any) -> dict[str, Any]:
-    """Convert aiosqlite Row to dict."""
-    return dict(row) if row else {}
+_SEARCH_TOKEN_RE = re.compile(r"\w+")
+SEARCH_KINDS = {0: "report", 1: "vehicle", 2: "fault", 3: "test"}
 
 
-def _parse_json_fields(row: dict[str, Any], fields: list[str]) -> dict[str, Any]:
-    """Parse JSON text fields to Python objects."""
-    out = dict(row)
-    for f in fields:
-        if f in out and out[f] is not None and isinstance(out[f], str):
-            try:
-                out[f] = json.loads(out[f])
-            except json.JSONDecodeError:
-                out[f] = None
-    return out
+def search_match_expr(q: str) -> str | None:
+    """FTS5 MATCH expression: every word of q as a prefix, all required.
+
+    Words are quoted, so FTS operators typed by the user are just text.
+    """
+    tokens = _SEARCH_TOKEN_RE.findall(q)
+    if not tokens:
+        return None
+    return " ".join(f'"{t}"*' for t in tokens)
 
 
 # ─── Reports ────────────────────────────────────────────────────────────────
@@ -83,7 +69,7 @@ async def insert_report(
     _require_aiosqlite()
     now = _now_iso()
     share_token = generate_share_token()
-    async with aiosqlite.connect(DB_PATH) as conn:
+    async with write_transaction() as conn:
         await conn.execute(
             """
             INSERT INTO diagnostic_reports (
@@ -106,71 +92,187 @@ async def insert_report(
                 now,
             ),
         )
-        await conn.commit()
 
 
-async def get_report_by_id(report_id: str) -> dict[str, Any] | None:
+async def get_report_by_id(report_id: str) -> Report | None:
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    async with read_connection() as conn:
         async with conn.execute(
-            "SELECT * FROM diagnostic_reports WHERE id = ?", (report_id,)
+            f"SELECT {Report.select()} FROM diagnostic_reports WHERE id = ?", (report_id,)
         ) as cursor:
             row = await cursor.fetchone()
-            return _row_to_dict(row) if row else None
+            return Report.from_row(row) if row else None
 
 
-async def get_report_by_share_token(share_token: str) -> dict[str, Any] | None:
+async def get_report_by_share_token(share_token: str) -> Report | None:
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    async with read_connection() as conn:
         async with conn.execute(
-            "SELECT * FROM diagnostic_reports WHERE share_token = ? AND status = 'COMPLETED'",
+            f"SELECT {Report.select()} FROM diagnostic_reports WHERE share_token = ? AND status = 'COMPLETED'",
             (share_token,),
         ) as cursor:
             row = await cursor.fetchone()
-            return _row_to_dict(row) if row else None
+            return Report.from_row(row) if row else None
 
 
-async def list_reports(
-    *,
-    status: str | None = None,
-    q: str | None = None,
-    date_from: str | None = None,
-    date_to: str | None = None,
-) -> list[dict[str, Any]]:
-    _require_aiosqlite()
-    conditions = []
+def _report_filters(
+    status: str | None,
+    q: str | None,
+    date_from: str | None,
+    date_to: str | None,
+) -> tuple[list[str], list[Any]]:
+    conditions: list[str] = []
     params: list[Any] = []
     if status:
         conditions.append("r.status = ?")
         params.append(status)
-    if q:
+    match = search_match_expr(q or "")
+    if match:
         conditions.append(
-            "(r.id LIKE ? OR r.customer_name LIKE ? OR r.customer_email LIKE ? OR r.booking_id LIKE ?)"
+            "r.id IN (SELECT report_id FROM report_search WHERE report_search MATCH ?)"
         )
-        qp = f"%{q}%"
-        params.extend([qp, qp, qp, qp])
+        params.append(match)
     if date_from:
         conditions.append("r.created_at >= ?")
         params.append(date_from)
     if date_to:
         conditions.append("r.created_at <= ?")
         params.append(date_to)
+    return conditions, params
+
+
+async def list_reports(
+    *,
+    status: str | None = None,
+    q: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    limit: int | None = None,
+    after: tuple[str, str] | None = None,
+    archived: bool = False,
+) -> list[ReportListItem]:
+    """
+    Newest first. `after` is the (created_at, id) of the previous page's last row.
+    archived=True lists the archive database (q is not indexed there).
+    """
+    _require_aiosqlite()
+    conditions, params = _report_filters(status, None if archived else q, date_from, date_to)
+    schema = "archive" if archived else "main"
+    if after is not None:
+        conditions.append("(r.created_at, r.id) < (?, ?)")
+        params.extend(after)
 
     where = " AND ".join(conditions) if conditions else "1=1"
     sql = f"""
-        SELECT r.*, b.vehicle_reg, b.vehicle_make, b.vehicle_model
-        FROM diagnostic_reports r
-        LEFT JOIN bookings b ON r.booking_id = b.id
+        SELECT {ReportListItem.select()}
+        FROM {schema}.diagnostic_reports r
+        LEFT JOIN {schema}.bookings b ON r.booking_id = b.id
         WHERE {where}
-        ORDER BY r.created_at DESC
+        ORDER BY r.created_at DESC, r.id DESC
     """
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    async with read_connection() as conn:
         async with conn.execute(sql, params) as cursor:
             rows = await cursor.fetchall()
-            return [_row_to_dict(r) for r in rows]
+            return [ReportListItem.from_row(r) for r in rows]
+
+
+async def count_reports(
+    *,
+    status: str | None = None,
+    q: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    archived: bool = False,
+) -> int:
+    _require_aiosqlite()
+    conditions, params = _report_filters(status, None if archived else q, date_from, date_to)
+    where = " AND ".join(conditions) if conditions else "1=1"
+    schema = "archive" if archived else "main"
+    async with read_connection() as conn:
+        async with conn.execute(
+            f"SELECT COUNT(*) FROM {schema}.diagnostic_reports r WHERE {where}", params
+        ) as cursor:
+            row = await cursor.fetchone()
+            return row[0]
+
+
+async def search_reports(
+    q: str,
+    *,
+    status: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    limit: int = 50,
+) -> list[dict[str, Any]]:
+    """
+    Reports matching q in any indexed field (customer, vehicle, fault, test),
+    best match first. Each row carries search_kind and a search_snippet of its
+    best-matching text with hits wrapped in [ ].
+    """
+    _require_aiosqlite()
+    match = search_match_expr(q)
+    if not match:
+        return []
+    conditions, params = _report_filters(status, None, date_from, date_to)
+    where = " AND ".join(conditions) if conditions else "1=1"
+    # Rank a bounded number of hits, keep each report's best one, then build
+    # snippets for just those rows (snippet() over every hit is the slow part).
+    hit_cap = max(500, limit * 20)
+    async with read_connection() as conn:
+        async with conn.execute(
+            f"""
+            SELECT h.report_id, h.kind, h.rowid
+            FROM (
+                SELECT rowid, report_id, kind, rank FROM report_search
+                WHERE report_search MATCH ? ORDER BY rank LIMIT ?
+            ) h
+            JOIN diagnostic_reports r ON r.id = h.report_id
+            WHERE {where}
+            ORDER BY h.rank
+            """,
+            [match, hit_cap, *params],
+        ) as cursor:
+            best: dict[str, tuple[int, int]] = {}
+            async for report_id, kind, rowid in cursor:
+                if report_id not in best:
+                    best[report_id] = (kind, rowid)
+                    if len(best) >= limit:
+                        break
+        if not best:
+            return []
+
+        marks = ", ".join("?" * len(best))
+        async with conn.execute(
+            f"""
+            SELECT rowid, snippet(report_search, 0, '[', ']', '…', 12) FROM report_search
+            WHERE report_search MATCH ? AND rowid IN ({marks})
+            """,
+            [match, *(rowid for _, rowid in best.values())],
+        ) as cursor:
+            snippets = {rowid: text async for rowid, text in cursor}
+        async with conn.execute(
+            f"""
+            SELECT {ReportListItem.select()}
+            FROM diagnostic_reports r
+            LEFT JOIN bookings b ON r.booking_id = b.id
+            WHERE r.id IN ({marks})
+            """,
+            list(best),
+        ) as cursor:
+            reports = {row[0]: ReportListItem.from_row(row).to_dict() async for row in cursor}
+
+    out = []
+    for report_id, (kind, rowid) in best.items():
+        row = reports.get(report_id)
+        if row is None:
+            continue
+        row["search_kind"] = SEARCH_KINDS.get(kind, "report")
+        row["search_snippet"] = snippets.get(rowid, "")
+        out.append(row)
+    return out
 
 
 async def update_report(
@@ -216,12 +318,11 @@ async def update_report(
         params.append(completed_at)
 
     params.append(report_id)
-    async with aiosqlite.connect(DB_PATH) as conn:
+    async with write_transaction() as conn:
         await conn.execute(
             f"UPDATE diagnostic_reports SET {', '.join(updates)} WHERE id = ?",
             params,
         )
-        await conn.commit()
 
 
 async def archive_report(report_id: str) -> None:
@@ -237,23 +338,47 @@ async def ensure_share_token(report_id: str) -> str:
     if r.get("share_token"):
         return r["share_token"]
     token = generate_share_token()
-    async with aiosqlite.connect(DB_PATH) as conn:
+    async with write_transaction() as conn:
         await conn.execute(
             "UPDATE diagnostic_reports SET share_token = ?, updated_at = ? WHERE id = ?",
             (token, _now_iso(), report_id),
         )
-        await conn.commit()
     return token
 
 
 # ─── Vehicles ───────────────────────────────────────────────────────────────
+#
+# Each write has a _name(conn, ...) form that runs inside the caller's
+# transaction; the public functions wrap one call in write_transaction and
+# apply_report_batch runs many in one. A sort_order of None appends: the next
+# position comes from MAX(sort_order) in SQL, an index seek on
+# (parent, sort_order), instead of listing the siblings first.
+
+
+def _next_sort(table: str, parent: str) -> str:
+    return f"COALESCE(?, (SELECT COALESCE(MAX(sort_order), 0) + 1 FROM {table} WHERE {parent} = ?))"
+
 
+def _update_sql(table: str, allowed: set[str], json_fields: set[str], kwargs: dict[str, Any]) -> tuple[str, list[Any]] | None:
+    updates = ["updated_at = ?"]
+    params: list[Any] = [_now_iso()]
+    for k, v in kwargs.items():
+        if k in allowed:
+            if k in json_fields and v is not None:
+                v = json.dumps(v)
+            updates.append(f"{k} = ?")
+            params.append(v)
+    if len(updates) <= 1:
+        return None
+    return f"UPDATE {table} SET {', '.join(updates)} WHERE id = ?", params
 
-async def insert_vehicle(
+
+async def _insert_vehicle(
+    conn: Any,
     *,
     id: str,
     report_id: str,
-    sort_order: int = 0,
+    sort_order: int | None = None,
     reg: str | None = None,
     vin: str | None = None,
     make: str | None = None,
@@ -263,113 +388,133 @@ async def insert_vehicle(
     drivability_status: str | None = None,
     notes: str | None = None,
 ) -> None:
-    _require_aiosqlite()
     now = _now_iso()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute(
-            """
-            INSERT INTO report_vehicles (
-                id, report_id, sort_order, reg, vin, make, model, variant,
-                mileage, drivability_status, notes, created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                id,
-                report_id,
-                sort_order,
-                reg or "",
-                vin or "",
-                make or "",
-                model or "",
-                variant or "",
-                mileage or "",
-                drivability_status or "",
-                notes or "",
-                now,
-                now,
-            ),
-        )
-        await conn.commit()
+    await conn.execute(
+        f"""
+        INSERT INTO report_vehicles (
+            id, report_id, sort_order, reg, vin, make, model, variant,
+            mileage, drivability_status, notes, created_at, updated_at
+        ) VALUES (?, ?, {_next_sort("report_vehicles", "report_id")}, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            id,
+            report_id,
+            sort_order,
+            report_id,
+            reg or "",
+            vin or "",
+            make or "",
+            model or "",
+            variant or "",
+            mileage or "",
+            drivability_status or "",
+            notes or "",
+            now,
+            now,
+        ),
+    )
+
+
+async def insert_vehicle(**kwargs: Any) -> None:
+    """Insert a vehicle (fields as _insert_vehicle)."""
+    _require_aiosqlite()
+    async with write_transaction() as conn:
+        await _insert_vehicle(conn, **kwargs)
 
 
-async def get_vehicle_by_id(vehicle_id: str) -> dict[str, Any] | None:
+async def get_vehicle_by_id(vehicle_id: str) -> Vehicle | None:
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    async with read_connection() as conn:
         async with conn.execute(
-            "SELECT * FROM report_vehicles WHERE id = ?", (vehicle_id,)
+            f"SELECT {Vehicle.select()} FROM report_vehicles WHERE id = ?", (vehicle_id,)
         ) as cursor:
             row = await cursor.fetchone()
-            return _row_to_dict(row) if row else None
+            return Vehicle.from_row(row) if row else None
 
 
-async def list_vehicles_by_report(report_id: str) -> list[dict[str, Any]]:
+async def list_vehicles_by_report(report_id: str) -> list[Vehicle]:
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    async with read_connection() as conn:
         async with conn.execute(
-            "SELECT * FROM report_vehicles WHERE report_id = ? ORDER BY sort_order, created_at",
+            f"SELECT {Vehicle.select()} FROM report_vehicles WHERE report_id = ? ORDER BY sort_order, created_at",
             (report_id,),
         ) as cursor:
             rows = await cursor.fetchall()
-            return [_row_to_dict(r) for r in rows]
+            return [Vehicle.from_row(r) for r in rows]
+
+
+_VEHICLE_FIELDS = {
+    "sort_order", "reg", "vin", "make", "model", "variant",
+    "mileage", "drivability_status", "notes",
+}
+
+
+async def _update_vehicle(conn: Any, vehicle_id: str, **kwargs: Any) -> None:
+    sql = _update_sql("report_vehicles", _VEHICLE_FIELDS, set(), kwargs)
+    if sql:
+        await conn.execute(sql[0], [*sql[1], vehicle_id])
 
 
 async def update_vehicle(
     vehicle_id: str,
     **kwargs: Any,
 ) -> None:
-    allowed = {
-        "sort_order", "reg", "vin", "make", "model", "variant",
-        "mileage", "drivability_status", "notes",
-    }
-    updates = ["updated_at = ?"]
-    params: list[Any] = [_now_iso()]
-    for k, v in kwargs.items():
-        if k in allowed:
-            updates.append(f"{k} = ?")
-            params.append(v)
-    if len(updates) <= 1:
-        return
-    params.append(vehicle_id)
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute(
-            f"UPDATE report_vehicles SET {', '.join(updates)} WHERE id = ?",
-            params,
-        )
-        await conn.commit()
+    async with write_transaction() as conn:
+        await _update_vehicle(conn, vehicle_id, **kwargs)
+
+
+# Media rows hanging off a vehicle directly or through its faults/tests
+_VEHICLE_MEDIA = """
+    vehicle_id = ?1
+    OR fault_id IN (SELECT id FROM vehicle_faults WHERE vehicle_id = ?1)
+    OR test_id IN (SELECT id FROM fault_tests WHERE vehicle_id = ?1)
+"""
 
 
-async def delete_vehicle(vehicle_id: str) -> None:
-    """Delete vehicle and cascade faults, tests, media."""
+async def _delete_vehicle(conn: Any, vehicle_id: str) -> list[str]:
+    rows = await conn.execute_fetchall(f"SELECT storage_key FROM media_assets WHERE {_VEHICLE_MEDIA}", (vehicle_id,))
+    await conn.execute(f"DELETE FROM media_assets WHERE {_VEHICLE_MEDIA}", (vehicle_id,))
+    await conn.execute(
+        """
+        DELETE FROM fault_tests
+        WHERE vehicle_id = ?1 OR fault_id IN (SELECT id FROM vehicle_faults WHERE vehicle_id = ?1)
+        """,
+        (vehicle_id,),
+    )
+    await conn.execute("DELETE FROM vehicle_faults WHERE vehicle_id = ?", (vehicle_id,))
+    await conn.execute("DELETE FROM report_vehicles WHERE id = ?", (vehicle_id,))
+    return [r[0] for r in rows]
+
+
+async def delete_vehicle(vehicle_id: str) -> list[str]:
+    """Delete vehicle and cascade faults, tests, media, one statement per table.
+
+    Returns the storage keys of the deleted media; the caller removes the
+    files once this has committed (services.media_storage.delete_files).
+    """
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        fault_ids = [
-            r[0]
-            async for r in conn.execute(
-                "SELECT id FROM vehicle_faults WHERE vehicle_id = ?", (vehicle_id,)
-            )
-        ]
-        for fid in fault_ids:
-            await conn.execute("DELETE FROM fault_tests WHERE fault_id = ?", (fid,))
-        await conn.execute("DELETE FROM vehicle_faults WHERE vehicle_id = ?", (vehicle_id,))
-        await conn.execute("DELETE FROM fault_tests WHERE vehicle_id = ?", (vehicle_id,))
-        await conn.execute(
-            "DELETE FROM media_assets WHERE vehicle_id = ?", (vehicle_id,)
-        )
-        await conn.execute("DELETE FROM report_vehicles WHERE id = ?", (vehicle_id,))
-        await conn.commit()
+    async with write_transaction() as conn:
+        return await _delete_vehicle(conn, vehicle_id)
 
 
 # ─── Faults ─────────────────────────────────────────────────────────────────
 
 
-async def insert_fault(
+_FAULT_JSON_FIELDS = {"dtcs", "root_causes", "action_plan", "parts_required", "coding_required"}
+_FAULT_FIELDS = {
+    "sort_order", "title", "severity", "status", "impact",
+    "dtcs", "root_causes", "conclusion", "action_plan",
+    "parts_required", "coding_required", "explanation", "solution",
+}
+
+
+async def _insert_fault(
+    conn: Any,
     *,
     id: str,
     vehicle_id: str,
-    sort_order: int = 0,
+    sort_order: int | None = None,
     title: str = "",
     severity: str | None = None,
     status: str | None = None,
@@ -383,211 +528,275 @@ async def insert_fault(
     explanation: str | None = None,
     solution: str | None = None,
 ) -> None:
-    _require_aiosqlite()
     now = _now_iso()
     dtcs_json = json.dumps(dtcs) if dtcs is not None else None
     root_causes_json = json.dumps(root_causes) if root_causes is not None else None
     action_plan_json = json.dumps(action_plan) if action_plan is not None else None
     parts_json = json.dumps(parts_required) if parts_required is not None else None
     coding_json = json.dumps(coding_required) if coding_required is not None else None
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute(
-            """
-            INSERT INTO vehicle_faults (
-                id, vehicle_id, sort_order, title, severity, status,
-                impact, dtcs, root_causes, conclusion, action_plan,
-                parts_required, coding_required, explanation, solution,
-                created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                id,
-                vehicle_id,
-                sort_order,
-                title,
-                severity or "",
-                status or "",
-                impact or "",
-                dtcs_json,
-                root_causes_json,
-                conclusion or "",
-                action_plan_json,
-                parts_json,
-                coding_json,
-                explanation or "",
-                solution or "",
-                now,
-                now,
-            ),
-        )
-        await conn.commit()
+    await conn.execute(
+        f"""
+        INSERT INTO vehicle_faults (
+            id, vehicle_id, sort_order, title, severity, status,
+            impact, dtcs, root_causes, conclusion, action_plan,
+            parts_required, coding_required, explanation, solution,
+            created_at, updated_at
+        ) VALUES (?, ?, {_next_sort("vehicle_faults", "vehicle_id")}, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            id,
+            vehicle_id,
+            sort_order,
+            vehicle_id,
+            title,
+            severity or "",
+            status or "",
+            impact or "",
+            dtcs_json,
+            root_causes_json,
+            conclusion or "",
+            action_plan_json,
+            parts_json,
+            coding_json,
+            explanation or "",
+            solution or "",
+            now,
+            now,
+        ),
+    )
+
+
+async def insert_fault(**kwargs: Any) -> None:
+    """Insert a fault (fields as _insert_fault)."""
+    _require_aiosqlite()
+    async with write_transaction() as conn:
+        await _insert_fault(conn, **kwargs)
 
 
-async def get_fault_by_id(fault_id: str) -> dict[str, Any] | None:
+async def get_fault_by_id(fault_id: str) -> Fault | None:
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    async with read_connection() as conn:
         async with conn.execute(
-            "SELECT * FROM vehicle_faults WHERE id = ?", (fault_id,)
+            f"SELECT {Fault.select()} FROM vehicle_faults WHERE id = ?", (fault_id,)
         ) as cursor:
             row = await cursor.fetchone()
-            if not row:
-                return None
-            d = _row_to_dict(row)
-            return _parse_json_fields(d, ["dtcs", "root_causes", "action_plan", "parts_required", "coding_required"])
+            return Fault.from_row(row) if row else None
 
 
-async def list_faults_by_vehicle(vehicle_id: str) -> list[dict[str, Any]]:
+async def list_faults_by_vehicle(vehicle_id: str) -> list[Fault]:
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    async with read_connection() as conn:
         async with conn.execute(
-            "SELECT * FROM vehicle_faults WHERE vehicle_id = ? ORDER BY sort_order, created_at",
+            f"SELECT {Fault.select()} FROM vehicle_faults WHERE vehicle_id = ? ORDER BY sort_order, created_at",
             (vehicle_id,),
         ) as cursor:
             rows = await cursor.fetchall()
-            return [
-                _parse_json_fields(_row_to_dict(r), ["dtcs", "root_causes", "action_plan", "parts_required", "coding_required"])
-                for r in rows
-            ]
+            return [Fault.from_row(r) for r in rows]
+
+
+async def _update_fault(conn: Any, fault_id: str, **kwargs: Any) -> None:
+    sql = _update_sql("vehicle_faults", _FAULT_FIELDS, _FAULT_JSON_FIELDS, kwargs)
+    if sql:
+        await conn.execute(sql[0], [*sql[1], fault_id])
 
 
 async def update_fault(fault_id: str, **kwargs: Any) -> None:
-    json_fields = {"dtcs", "root_causes", "action_plan", "parts_required", "coding_required"}
-    allowed = {
-        "sort_order", "title", "severity", "status", "impact",
-        "dtcs", "root_causes", "conclusion", "action_plan",
-        "parts_required", "coding_required", "explanation", "solution",
-    }
-    updates = ["updated_at = ?"]
-    params: list[Any] = [_now_iso()]
-    for k, v in kwargs.items():
-        if k in allowed:
-            if k in json_fields and v is not None:
-                v = json.dumps(v)
-            updates.append(f"{k} = ?")
-            params.append(v)
-    if len(updates) <= 1:
-        return
-    params.append(fault_id)
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute(
-            f"UPDATE vehicle_faults SET {', '.join(updates)} WHERE id = ?",
-            params,
-        )
-        await conn.commit()
+    async with write_transaction() as conn:
+        await _update_fault(conn, fault_id, **kwargs)
+
+
+async def _delete_fault(conn: Any, fault_id: str) -> list[str]:
+    rows = await conn.execute_fetchall("SELECT storage_key FROM media_assets WHERE fault_id = ?", (fault_id,))
+    await conn.execute("UPDATE fault_tests SET fault_id = NULL WHERE fault_id = ?", (fault_id,))
+    await conn.execute("DELETE FROM media_assets WHERE fault_id = ?", (fault_id,))
+    await conn.execute("DELETE FROM vehicle_faults WHERE id = ?", (fault_id,))
+    return [r[0] for r in rows]
 
 
-async def delete_fault(fault_id: str) -> None:
+async def delete_fault(fault_id: str) -> list[str]:
+    """Delete a fault and its media (tests are kept, unlinked).
+
+    Returns the deleted media's storage keys, as delete_vehicle does.
+    """
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute("UPDATE fault_tests SET fault_id = NULL WHERE fault_id = ?", (fault_id,))
-        await conn.execute("DELETE FROM media_assets WHERE fault_id = ?", (fault_id,))
-        await conn.execute("DELETE FROM vehicle_faults WHERE id = ?", (fault_id,))
-        await conn.commit()
+    async with write_transaction() as conn:
+        return await _delete_fault(conn, fault_id)
 
 
 # ─── Tests ──────────────────────────────────────────────────────────────────
 
 
-async def insert_test(
+_TEST_FIELDS = {"fault_id", "sort_order", "test_name", "tool_used", "result", "readings", "notes"}
+_SERIES_COLUMNS = ("name", "points", "y_encoding", "y", "x_encoding", "x", "x_name", "y_min", "y_max", "y_mean")
+
+
+def _split_readings(readings: Any) -> tuple[str | None, list[dict[str, Any]]]:
+    """(readings JSON with long numeric series as stubs, the series as test_series rows)."""
+    if readings is None:
+        return None, []
+    doc, series = split_readings(readings)
+    return json.dumps(doc), [s.row() for s in series]
+
+
+async def _encode_readings(fields: dict[str, Any]) -> dict[str, Any]:
+    """
+    Test fields with "readings" split and encoded in a worker thread, as the
+    stubbed readings JSON plus "series_rows", for _insert_test / _update_test.
+    A long capture takes a second of CPU to encode; done inside the write
+    transaction it would hold up every other write and request.
+    """
+    if "readings" not in fields:
+        return fields
+    readings_json, rows = await asyncio.to_thread(_split_readings, fields["readings"])
+    return {**fields, "readings": readings_json, "series_rows": rows}
+
+
+async def _insert_series_rows(conn: Any, test_id: str, rows: list[dict[str, Any]]) -> None:
+    """Store Series.row() dicts, encoded beforehand (off the event loop for long ones)."""
+    now = _now_iso()
+    await conn.executemany(
+        f"""
+        INSERT OR REPLACE INTO test_series (test_id, {", ".join(_SERIES_COLUMNS)}, created_at)
+        VALUES (?, {", ".join("?" * len(_SERIES_COLUMNS))}, ?)
+        """,
+        [(test_id, *(row[c] for c in _SERIES_COLUMNS), now) for row in rows],
+    )
+
+
+async def _insert_test(
+    conn: Any,
     *,
     id: str,
     vehicle_id: str,
     fault_id: str | None = None,
-    sort_order: int = 0,
+    sort_order: int | None = None,
     test_name: str = "",
     tool_used: str | None = None,
     result: str | None = None,
-    readings: list | dict | None = None,
+    readings: str | None = None,
     notes: str | None = None,
+    series_rows: list[dict[str, Any]] | None = None,
 ) -> None:
-    _require_aiosqlite()
+    """readings is JSON text and series_rows its encoded series, as _encode_readings returns them."""
     now = _now_iso()
-    readings_json = json.dumps(readings) if readings is not None else None
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute(
-            """
-            INSERT INTO fault_tests (
-                id, vehicle_id, fault_id, sort_order, test_name,
-                tool_used, result, readings, notes, created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                id,
-                vehicle_id,
-                fault_id,
-                sort_order,
-                test_name,
-                tool_used or "",
-                result or "",
-                readings_json,
-                notes or "",
-                now,
-                now,
-            ),
-        )
-        await conn.commit()
+    await conn.execute(
+        f"""
+        INSERT INTO fault_tests (
+            id, vehicle_id, fault_id, sort_order, test_name,
+            tool_used, result, readings, notes, created_at, updated_at
+        ) VALUES (?, ?, ?, {_next_sort("fault_tests", "vehicle_id")}, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            id,
+            vehicle_id,
+            fault_id,
+            sort_order,
+            vehicle_id,
+            test_name,
+            tool_used or "",
+            result or "",
+            readings,
+            notes or "",
+            now,
+            now,
+        ),
+    )
+    if series_rows:
+        await _insert_series_rows(conn, id, series_rows)
+
+
+async def insert_test(**kwargs: Any) -> None:
+    """Insert a test (fields as _insert_test, with readings as a list or dict)."""
+    _require_aiosqlite()
+    fields = await _encode_readings(kwargs)
+    async with write_transaction() as conn:
+        await _insert_test(conn, **fields)
 
 
-async def get_test_by_id(test_id: str) -> dict[str, Any] | None:
+async def get_test_by_id(test_id: str) -> Test | None:
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    async with read_connection() as conn:
         async with conn.execute(
-            "SELECT * FROM fault_tests WHERE id = ?", (test_id,)
+            f"SELECT {Test.select()} FROM fault_tests WHERE id = ?", (test_id,)
         ) as cursor:
             row = await cursor.fetchone()
-            if not row:
-                return None
-            d = _row_to_dict(row)
-            return _parse_json_fields(d, ["readings"])
+            return Test.from_row(row) if row else None
 
 
-async def list_tests_by_vehicle(vehicle_id: str) -> list[dict[str, Any]]:
+async def list_tests_by_vehicle(vehicle_id: str) -> list[Test]:
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    async with read_connection() as conn:
         async with conn.execute(
-            "SELECT * FROM fault_tests WHERE vehicle_id = ? ORDER BY sort_order, created_at",
+            f"SELECT {Test.select()} FROM fault_tests WHERE vehicle_id = ? ORDER BY sort_order, created_at",
             (vehicle_id,),
         ) as cursor:
             rows = await cursor.fetchall()
-            return [
-                _parse_json_fields(_row_to_dict(r), ["readings"])
-                for r in rows
-            ]
+            return [Test.from_row(r) for r in rows]
+
+
+async def _update_test(conn: Any, test_id: str, *, series_rows: list[dict[str, Any]] | None = None, **kwargs: Any) -> None:
+    """Fields as _insert_test; series_rows comes with readings."""
+    sql = _update_sql("fault_tests", _TEST_FIELDS, set(), kwargs)
+    if sql:
+        cursor = await conn.execute(sql[0], [*sql[1], test_id])
+        if "readings" in kwargs and cursor.rowcount:
+            # Stubs sent back unchanged keep their stored series
+            readings = kwargs["readings"]
+            keep = series_names(json.loads(readings)) if readings else set()
+            await conn.execute(
+                "DELETE FROM test_series WHERE test_id = ? AND name NOT IN (SELECT value FROM json_each(?))",
+                (test_id, json.dumps(sorted(keep))),
+            )
+            if series_rows:
+                await _insert_series_rows(conn, test_id, series_rows)
 
 
 async def update_test(test_id: str, **kwargs: Any) -> None:
-    allowed = {"fault_id", "sort_order", "test_name", "tool_used", "result", "readings", "notes"}
-    updates = ["updated_at = ?"]
-    params: list[Any] = [_now_iso()]
-    for k, v in kwargs.items():
-        if k in allowed:
-            if k == "readings" and v is not None:
-                v = json.dumps(v)
-            updates.append(f"{k} = ?")
-            params.append(v)
-    if len(updates) <= 1:
-        return
-    params.append(test_id)
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute(
-            f"UPDATE fault_tests SET {', '.join(updates)} WHERE id = ?",
-            params,
+    fields = await _encode_readings(kwargs)
+    async with write_transaction() as conn:
+        await _update_test(conn, test_id, **fields)
+
+
+async def get_test_series(test_id: str, name: str, *, share_token: str | None = None) -> Series | None:
+    """
+    One stored series of a test, live or archived. With share_token only a
+    series of that token's COMPLETED report is returned.
+    """
+    _require_aiosqlite()
+    params: list[Any] = [test_id, name]
+    owner = ""
+    if share_token is not None:
+        owner = """
+            JOIN {schema}.fault_tests t ON t.id = s.test_id
+            JOIN {schema}.report_vehicles v ON v.id = t.vehicle_id
+            JOIN {schema}.diagnostic_reports r ON r.id = v.report_id
+                AND r.share_token = ? AND r.status = 'COMPLETED'"""
+        params = [share_token, *params]
+    sql = """
+        SELECT s.name, s.y_encoding, s.y, s.x_encoding, s.x, s.x_name FROM {schema}.test_series s{owner}
+        WHERE s.test_id = ? AND s.name = ?"""
+    async with read_connection() as conn:
+        rows = await conn.execute_fetchall(
+            sql.format(schema="main", owner=owner.format(schema="main"))
+            + " UNION ALL "
+            + sql.format(schema="archive", owner=owner.format(schema="archive"))
+            + " LIMIT 1",
+            params * 2,
         )
-        await conn.commit()
+    return Series.from_row(*rows[0]) if rows else None
+
+
+async def _delete_test(conn: Any, test_id: str) -> None:
+    await conn.execute("UPDATE media_assets SET test_id = NULL WHERE test_id = ?", (test_id,))
+    await conn.execute("DELETE FROM fault_tests WHERE id = ?", (test_id,))
 
 
 async def delete_test(test_id: str) -> None:
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute("UPDATE media_assets SET test_id = NULL WHERE test_id = ?", (test_id,))
-        await conn.execute("DELETE FROM fault_tests WHERE id = ?", (test_id,))
-        await conn.commit()
+    async with write_transaction() as conn:
+        await _delete_test(conn, test_id)
 
 
 # ─── Media ──────────────────────────────────────────────────────────────────
@@ -609,7 +818,7 @@ async def insert_media(
 ) -> None:
     _require_aiosqlite()
     now = _now_iso()
-    async with aiosqlite.connect(DB_PATH) as conn:
+    async with write_transaction() as conn:
         await conn.execute(
             """
             INSERT INTO media_assets (
@@ -633,33 +842,31 @@ async def insert_media(
                 now,
             ),
         )
-        await conn.commit()
 
 
-async def get_media_by_id(media_id: str) -> dict[str, Any] | None:
+async def get_media_by_id(media_id: str) -> Media | None:
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    async with read_connection() as conn:
         async with conn.execute(
-            "SELECT * FROM media_assets WHERE id = ?", (media_id,)
+            f"SELECT {Media.select()} FROM media_assets WHERE id = ?", (media_id,)
         ) as cursor:
             row = await cursor.fetchone()
-            return _row_to_dict(row) if row else None
+            return Media.from_row(row) if row else None
 
 
-async def list_media_by_report(report_id: str) -> list[dict[str, Any]]:
+async def list_media_by_report(report_id: str) -> list[Media]:
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
+    async with read_connection() as conn:
         async with conn.execute(
-            "SELECT * FROM media_assets WHERE report_id = ? ORDER BY created_at",
+            f"SELECT {Media.select()} FROM media_assets WHERE report_id = ? ORDER BY created_at",
             (report_id,),
         ) as cursor:
             rows = await cursor.fetchall()
-            return [_row_to_dict(r) for r in rows]
+            return [Media.from_row(r) for r in rows]
 
 
-async def update_media(
+async def _update_media(
+    conn: Any,
     media_id: str,
     *,
     vehicle_id: str | None = None,
@@ -684,17 +891,422 @@ async def update_media(
     if not updates:
         return
     params.append(media_id)
+    await conn.execute(
+        f"UPDATE media_assets SET {', '.join(updates)} WHERE id = ?",
+        params,
+    )
+
+
+async def update_media(media_id: str, **kwargs: Any) -> None:
+    """Retag or recaption media (fields as _update_media; None leaves a field alone)."""
+    _require_aiosqlite()
+    async with write_transaction() as conn:
+        await _update_media(conn, media_id, **kwargs)
+
+
+async def _delete_media(conn: Any, media_id: str) -> list[str]:
+    rows = await conn.execute_fetchall("SELECT storage_key FROM media_assets WHERE id = ?", (media_id,))
+    await conn.execute("DELETE FROM media_assets WHERE id = ?", (media_id,))
+    return [r[0] for r in rows]
+
+
+async def delete_media(media_id: str) -> list[str]:
+    """Delete a media row; returns its storage key for the caller to remove."""
+    _require_aiosqlite()
+    async with write_transaction() as conn:
+        return await _delete_media(conn, media_id)
+
+
+# ─── Batch edits ────────────────────────────────────────────────────────────
+
+
+class BatchError(ValueError):
+    """An operation in apply_report_batch failed; none of the batch was applied."""
+
+    def __init__(self, index: int, message: str):
+        super().__init__(f"Operation {index}: {message}")
+        self.index = index
+
+
+# The report an entity belongs to, by entity id
+_OWNER_SQL = {
+    "vehicle": "SELECT report_id FROM report_vehicles WHERE id = ?",
+    "fault": "SELECT v.report_id FROM vehicle_faults f JOIN report_vehicles v ON v.id = f.vehicle_id WHERE f.id = ?",
+    "test": "SELECT v.report_id FROM fault_tests t JOIN report_vehicles v ON v.id = t.vehicle_id WHERE t.id = ?",
+    "media": "SELECT report_id FROM media_assets WHERE id = ?",
+}
+# Entity -> (table, parent column) for reorder
+_SIBLINGS = {
+    "vehicle": ("report_vehicles", "report_id"),
+    "fault": ("vehicle_faults", "vehicle_id"),
+    "test": ("fault_tests", "vehicle_id"),
+}
+_INSERT = {"vehicle": _insert_vehicle, "fault": _insert_fault, "test": _insert_test}
+_UPDATE = {"vehicle": _update_vehicle, "fault": _update_fault, "test": _update_test, "media": _update_media}
+_DELETE = {"vehicle": _delete_vehicle, "fault": _delete_fault, "test": _delete_test, "media": _delete_media}
+
+
+async def apply_report_batch(report_id: str, operations: list[dict[str, Any]]) -> list[str]:
+    """
+    Apply create / patch / delete / reorder operations to a report's vehicles,
+    faults, tests and media in one transaction, in order.
+
+    Each operation is {"op", "entity", "id", "parent_id", "data", "ids"}:
+    create inserts row `id` (faults and tests under vehicle parent_id) with
+    fields `data`, appended after its siblings; patch updates `id` with
+    `data`; delete cascades as the single-row deletes do; reorder sets the
+    sort_order of `ids`, all children of parent_id (the report for
+    vehicles), to their position. Every id referenced must belong to
+    report_id, including rows created earlier in the batch.
+
+    Raises BatchError, with nothing applied, on the first operation that
+    fails. Returns the storage keys of deleted media, for the caller to
+    remove after commit.
+    """
+    _require_aiosqlite()
+    operations = [
+        {**o, "data": await _encode_readings(o["data"])} if o["entity"] == "test" and o.get("data") else o
+        for o in operations
+    ]
+    storage_keys: list[str] = []
+    async with write_transaction() as conn:
+
+        async def owned(index: int, entity: str, entity_id: str | None) -> None:
+            rows = await conn.execute_fetchall(_OWNER_SQL[entity], (entity_id,))
+            if not rows or rows[0][0] != report_id:
+                raise BatchError(index, f"{entity} {entity_id} not found in this report")
+
+        for index, operation in enumerate(operations):
+            op, entity, entity_id = operation["op"], operation["entity"], operation.get("id")
+            data = operation.get("data") or {}
+            for field in ("vehicle_id", "fault_id", "test_id"):
+                if data.get(field) is not None:
+                    await owned(index, field[:-3], data[field])
+            if op == "create":
+                if entity == "vehicle":
+                    await _insert_vehicle(conn, id=entity_id, report_id=report_id, **data)
+                else:
+                    await owned(index, "vehicle", operation.get("parent_id"))
+                    await _INSERT[entity](conn, id=entity_id, vehicle_id=operation["parent_id"], **data)
+            elif op == "patch":
+                await owned(index, entity, entity_id)
+                await _UPDATE[entity](conn, entity_id, **data)
+            elif op == "delete":
+                await owned(index, entity, entity_id)
+                storage_keys += await _DELETE[entity](conn, entity_id) or []
+            elif op == "reorder":
+                table, parent_column = _SIBLINGS[entity]
+                parent_id = operation.get("parent_id")
+                if entity == "vehicle":
+                    parent_id = report_id
+                else:
+                    await owned(index, "vehicle", parent_id)
+                ids = operation.get("ids") or []
+                now = _now_iso()
+                cursor = await conn.executemany(
+                    f"UPDATE {table} SET sort_order = ?, updated_at = ? WHERE id = ? AND {parent_column} = ?",
+                    [(position, now, child_id, parent_id) for position, child_id in enumerate(ids, 1)],
+                )
+                if cursor.rowcount != len(ids):
+                    raise BatchError(index, f"reorder ids must all be {entity}s of {parent_id}")
+            else:
+                raise BatchError(index, f"unknown op {op!r}")
+    return storage_keys
+
+
+# ─── Scan imports ───────────────────────────────────────────────────────────
+
+
+async def import_scan(
+    vehicle_id: str,
+    faults: list[dict[str, Any]],
+    tests: list[tuple[dict[str, Any], list[dict[str, Any]]]],
+) -> tuple[list[str], list[str]]:
+    """
+    Insert what services.scan_import parsed from a diagnostic export under a
+    vehicle, in one transaction: faults as _insert_fault fields, tests as
+    (_insert_test fields, encoded test_series rows). Returns the new fault
+    and test ids.
+    """
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
+    fault_ids = [generate_entity_id("flt") for _ in faults]
+    test_ids = [generate_entity_id("tst") for _ in tests]
+    async with write_transaction() as conn:
+        for fault_id, fields in zip(fault_ids, faults):
+            await _insert_fault(conn, id=fault_id, vehicle_id=vehicle_id, **fields)
+        for test_id, (fields, rows) in zip(test_ids, tests):
+            fields = {**fields, "readings": json.dumps(fields["readings"])}
+            await _insert_test(conn, id=test_id, vehicle_id=vehicle_id, series_rows=rows, **fields)
+    return fault_ids, test_ids
+
+
+# ─── Report tree ────────────────────────────────────────────────────────────
+
+
+async def load_report_tree(
+    report_id: str | None = None,
+    *,
+    share_token: str | None = None,
+    schema: str = "main",
+) -> dict[str, Any] | None:
+    """
+    A report with its vehicles (each with "faults" and "tests") and "media",
+    in five statements on one connection however many vehicles it has: faults
+    and tests are joined through report_vehicles rather than fetched per
+    vehicle, and each statement is a single execute_fetchall hop to the
+    connection thread. With share_token only a COMPLETED report is returned.
+
+    schema="archive" reads the attached archive database (archive.py).
+    """
+    _require_aiosqlite()
+    if share_token is not None:
+        where, key = "share_token = ? AND status = 'COMPLETED'", share_token
+    else:
+        where, key = "id = ?", report_id
+    async with read_connection() as conn:
+        rows = await conn.execute_fetchall(
+            f"SELECT {Report.select()} FROM {schema}.diagnostic_reports WHERE {where}", (key,)
+        )
+        if not rows:
+            return None
+        report = Report.from_row(rows[0]).to_dict()
+        rid = (report["id"],)
+        vehicle_rows = await conn.execute_fetchall(
+            f"SELECT {Vehicle.select()} FROM {schema}.report_vehicles WHERE report_id = ? ORDER BY sort_order, created_at",
+            rid,
+        )
+        # Ordered within each vehicle; grouping below keeps that order
+        fault_rows = await conn.execute_fetchall(
+            f"""
+            SELECT {Fault.select("f")} FROM {schema}.vehicle_faults f
+            JOIN {schema}.report_vehicles v ON v.id = f.vehicle_id
+            WHERE v.report_id = ? ORDER BY f.sort_order, f.created_at
+            """,
+            rid,
+        )
+        test_rows = await conn.execute_fetchall(
+            f"""
+            SELECT {Test.select("t")} FROM {schema}.fault_tests t
+            JOIN {schema}.report_vehicles v ON v.id = t.vehicle_id
+            WHERE v.report_id = ? ORDER BY t.sort_order, t.created_at
+            """,
+            rid,
+        )
+        media_rows = await conn.execute_fetchall(
+            f"SELECT {Media.select()} FROM {schema}.media_assets WHERE report_id = ? ORDER BY created_at",
+            rid,
+        )
+    vehicles = {r[0]: {**Vehicle.from_row(r).to_dict(), "faults": [], "tests": []} for r in vehicle_rows}
+    for r in fault_rows:
+        fault = Fault.from_row(r)
+        vehicles[fault.vehicle_id]["faults"].append(fault)
+    for r in test_rows:
+        test = Test.from_row(r)
+        vehicles[test.vehicle_id]["tests"].append(test)
+    report["vehicles"] = list(vehicles.values())
+    report["media"] = [Media.from_row(r).to_dict() for r in media_rows]
+    return report
+
+
+# ─── Share snapshots ────────────────────────────────────────────────────────
+
+
+async def get_report_snapshot(share_token: str) -> tuple[str, bytes] | None:
+    """(etag, body) of a completed report's stored public view, or None when
+    there is none or the report has been edited since (revision moved on)."""
+    _require_aiosqlite()
+    async with read_connection() as conn:
+        rows = await conn.execute_fetchall(
+            """
+            SELECT s.etag, s.body FROM diagnostic_reports r
+            JOIN report_snapshots s ON s.report_id = r.id AND s.revision = r.revision
+            WHERE r.share_token = ? AND r.status = 'COMPLETED'
+            """,
+            (share_token,),
+        )
+    return (rows[0][0], bytes(rows[0][1])) if rows else None
+
+
+async def save_report_snapshot(report_id: str, revision: int, etag: str, body: bytes) -> None:
+    """Store the public view rendered at `revision`; never replaces a newer one."""
+    _require_aiosqlite()
+    async with write_transaction() as conn:
         await conn.execute(
-            f"UPDATE media_assets SET {', '.join(updates)} WHERE id = ?",
-            params,
+            """
+            INSERT INTO report_snapshots (report_id, revision, etag, body, created_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (report_id) DO UPDATE SET
+                revision = excluded.revision, etag = excluded.etag, body = excluded.body, created_at = excluded.created_at
+            WHERE excluded.revision >= report_snapshots.revision
+            """,
+            (report_id, revision, etag, body, _now_iso()),
         )
-        await conn.commit()
 
 
-async def delete_media(media_id: str) -> None:
+# ─── Vehicle history ────────────────────────────────────────────────────────
+
+
+def _timeline_sql(schema: str, archived: int) -> str:
+    # ?1 = reg key, ?2 = VIN key; the OR is a multi-index lookup on
+    # idx_vehicles_reg_key / idx_vehicles_vin_key
+    return f"""
+        SELECT 'booking', b.slot_start_iso, b.id, b.id, NULL, b.status, NULL, b.service_ids, b.approx_mileage, NULL,
+            {archived}
+        FROM {schema}.bookings b WHERE b.vehicle_reg_key = ?1
+        UNION ALL
+        SELECT 'report', COALESCE(r.completed_at, r.created_at), r.id, r.booking_id, r.id, r.status, NULL,
+            NULLIF(TRIM(v.make || ' ' || v.model), ''), v.mileage, NULL, {archived}
+        FROM {schema}.report_vehicles v
+        JOIN {schema}.diagnostic_reports r ON r.id = v.report_id
+        WHERE v.reg_key = ?1 OR v.vin_key = ?2
+        UNION ALL
+        SELECT 'fault', COALESCE(r.completed_at, r.created_at), f.id, r.booking_id, r.id, f.status, f.severity,
+            f.title, v.mileage, f.dtcs, {archived}
+        FROM {schema}.report_vehicles v
+        JOIN {schema}.vehicle_faults f ON f.vehicle_id = v.id
+        JOIN {schema}.diagnostic_reports r ON r.id = v.report_id
+        WHERE v.reg_key = ?1 OR v.vin_key = ?2
+    """
+
+
+async def vehicle_timeline(reg: str | None = None, vin: str | None = None) -> list[TimelineEvent]:
+    """
+    Every booking, report and fault recorded for a vehicle, newest first,
+    matched on the normalised registration and/or VIN (vehicle_key) across
+    the live and archive databases, in one statement.
+    """
     _require_aiosqlite()
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute("DELETE FROM media_assets WHERE id = ?", (media_id,))
-        await conn.commit()
+    reg_key, vin_key = vehicle_key(reg), vehicle_key(vin)
+    if not reg_key and not vin_key:
+        return []
+    sql = f"""
+        {_timeline_sql("main", 0)}
+        UNION ALL
+        {_timeline_sql("archive", 1)}
+        ORDER BY 2 DESC, 1
+    """
+    async with read_connection() as conn:
+        rows = await conn.execute_fetchall(sql, (reg_key, vin_key))
+    return [TimelineEvent.from_row(r) for r in rows]
+
+
+# ─── DTC analytics ──────────────────────────────────────────────────────────
+
+# Standard five-character code, as stored in fault_dtcs (migration 13)
+DTC_CODE_RE = re.compile(r"[PBCU][0-9A-F]{4}")
+
+
+def _dtc_filters(
+    alias: str,
+    date_from: str | None,
+    date_to: str | None,
+    make: str | None,
+    model: str | None,
+) -> tuple[str, list[Any]]:
+    """AND-ed conditions on fault_dtcs `alias`; dates are YYYY-MM-DD, inclusive."""
+    conditions: list[str] = []
+    params: list[Any] = []
+    if date_from:
+        conditions.append(f"{alias}.created_at >= ?")
+        params.append(date_from[:10])
+    if date_to:
+        conditions.append(f"{alias}.created_at < ?")
+        params.append((date.fromisoformat(date_to[:10]) + timedelta(days=1)).isoformat())
+    # make / model compare NOCASE (column collation)
+    if make:
+        conditions.append(f"{alias}.make = ?")
+        params.append(make.strip())
+    if model:
+        conditions.append(f"{alias}.model = ?")
+        params.append(model.strip())
+    return "".join(f" AND {c}" for c in conditions), params
+
+
+async def dtc_counts(
+    *,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    make: str | None = None,
+    model: str | None = None,
+    code: str | None = None,
+    limit: int = 20,
+) -> list[dict[str, Any]]:
+    """
+    Most frequent DTC codes on faults created date_from..date_to, optionally
+    for one make / model or one code, over live and archived reports:
+    [{code, faults, vehicles, last_seen}], most faults first.
+    """
+    _require_aiosqlite()
+    where, params = _dtc_filters("d", date_from, date_to, make, model)
+    if code:
+        where += " AND d.code = ?"
+        params.append(code)
+    # Grouped per database, then summed: archive.py moves a report vehicle
+    # wholesale, so the distinct vehicle counts of the two add up
+    group_sql = f"""
+        SELECT d.code, COUNT(*) AS faults, COUNT(DISTINCT d.vehicle_id) AS vehicles, MAX(d.created_at) AS last_seen
+        FROM {{schema}}.fault_dtcs d WHERE 1 = 1{where} GROUP BY d.code"""
+    async with read_connection() as conn:
+        rows = await conn.execute_fetchall(
+            f"""
+            SELECT code, SUM(faults), SUM(vehicles), MAX(last_seen) FROM (
+                {group_sql.format(schema="main")}
+                UNION ALL
+                {group_sql.format(schema="archive")}
+            )
+            GROUP BY code ORDER BY 2 DESC, 1 LIMIT ?
+            """,
+            [*params, *params, limit],
+        )
+    return [{"code": c, "faults": f, "vehicles": v, "last_seen": seen} for c, f, v, seen in rows]
+
+
+async def co_occurring_dtcs(
+    code: str,
+    *,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    make: str | None = None,
+    model: str | None = None,
+    limit: int = 20,
+) -> dict[str, Any]:
+    """
+    Codes recorded on the same report vehicle as `code` (any of its faults):
+    how many vehicles had `code`, and per other code how many of those also
+    had it, most common first.
+    """
+    _require_aiosqlite()
+    where, params = _dtc_filters("a", date_from, date_to, make, model)
+    hits_sql = f"SELECT a.vehicle_id FROM {{schema}}.fault_dtcs a WHERE a.code = ?{where}"
+    pairs_sql = f"""
+        SELECT b.code, b.vehicle_id FROM {{schema}}.fault_dtcs a
+        JOIN {{schema}}.fault_dtcs b ON b.vehicle_id = a.vehicle_id AND b.code != a.code
+        WHERE a.code = ?{where}"""
+    params = [code, *params]
+    async with read_connection() as conn:
+        rows = await conn.execute_fetchall(
+            f"""
+            SELECT COUNT(DISTINCT vehicle_id) FROM (
+                {hits_sql.format(schema="main")}
+                UNION ALL
+                {hits_sql.format(schema="archive")}
+            )
+            """,
+            [*params, *params],
+        )
+        vehicles = rows[0][0]
+        rows = await conn.execute_fetchall(
+            f"""
+            SELECT code, COUNT(DISTINCT vehicle_id) FROM (
+                {pairs_sql.format(schema="main")}
+                UNION ALL
+                {pairs_sql.format(schema="archive")}
+            )
+            GROUP BY code ORDER BY 2 DESC, 1 LIMIT ?
+            """,
+            [*params, *params, limit],
+        )
+    return {
+        "code": code,
+        "vehicles": vehicles,
+        "codes": [{"code": c, "vehicles": n, "share": round(n / vehicles, 3) if vehicles else 0} for c, n in rows],
+    }
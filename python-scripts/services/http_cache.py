@@ -0,0 +1,85 @@
+"""
+HTTP validators and Cache-Control for the read-mostly public endpoints.
+
+Responses carry a strong ETag (a hash of the exact body bytes, or one stored
+alongside a snapshot) and answer a matching If-None-Match with an empty 304,
+so a page refresh costs a header exchange instead of a body. Cache-Control
+tells browsers and nginx (proxy_cache on /api/, see deploy.sh) what they may
+keep:
+
+  PUBLIC_STATIC     catalog-style data that only changes on deploy; shared
+                    caches may serve it for STATIC_CACHE_MAX_AGE seconds
+  PRIVATE_NO_CACHE  per-customer data; the browser keeps it but revalidates
+                    on every use, nginx never stores it
+
+Static bodies are serialised once (Precomputed) and served as-is.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from typing import Any
+
+from fastapi import Header, Response
+
+from records import dumps
+
+STATIC_CACHE_MAX_AGE = int(os.getenv("STATIC_CACHE_MAX_AGE", "300"))
+PUBLIC_STATIC = f"public, max-age={STATIC_CACHE_MAX_AGE}, stale-while-revalidate=86400"
+PRIVATE_NO_CACHE = "private, no-cache"
+
+
+def content_etag(body: bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match uses weak comparison: W/"x" matches "x"."""
+    if not if_none_match:
+        return False
+    candidates = {c.strip().removeprefix("W/") for c in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+class Precomputed:
+    """A JSON body and its ETag, serialised once."""
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, content: Any):
+        self.body = dumps(content)
+        self.etag = content_etag(self.body)
+
+
+class HTTPCache:
+    """Endpoint dependency: the request's If-None-Match plus a conditional responder.
+
+        async def endpoint(cache: HTTPCache = Depends()):
+            return cache.respond(content, cache_control=PRIVATE_NO_CACHE)
+    """
+
+    def __init__(self, if_none_match: str | None = Header(None, alias="If-None-Match")):
+        self.if_none_match = if_none_match
+
+    def respond(
+        self,
+        content: Any,
+        *,
+        etag: str | None = None,
+        cache_control: str = PRIVATE_NO_CACHE,
+        media_type: str = "application/json",
+    ) -> Response:
+        """200 with the body, or 304 when the client already holds it.
+
+        content is bytes already serialised, a Precomputed, or anything
+        records.dumps accepts. Without `etag` one is hashed from the body.
+        """
+        if isinstance(content, Precomputed):
+            body, etag = content.body, etag or content.etag
+        else:
+            body = content if isinstance(content, bytes) else dumps(content)
+        etag = etag or content_etag(body)
+        headers = {"ETag": etag, "Cache-Control": cache_control}
+        if etag_matches(self.if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type=media_type, headers=headers)
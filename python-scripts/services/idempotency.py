@@ -0,0 +1,86 @@
+"""
+Idempotency-Key support for the customer-facing POST endpoints.
+
+The first request with a given key claims it (idempotency_keys table) and runs;
+its response, or its 4xx error, is stored and replayed for every retry with the
+same key until the key expires. A retry that arrives while the first request is
+still running waits for it briefly. A 5xx or an unexpected error releases the
+claim, so the client can retry. Reusing a key for a different request body is
+rejected with 422.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from db import claim_idempotency_key, get_idempotency_key, release_idempotency_key, save_idempotent_response
+
+logger = logging.getLogger("tripoint.idempotency")
+
+IDEMPOTENCY_TTL_SECS = int(os.getenv("IDEMPOTENCY_TTL_SECS", "3600"))
+# How long a retry waits for the original request before answering 409
+IDEMPOTENCY_WAIT_SECS = 15.0
+MAX_KEY_LENGTH = 255
+REPLAY_HEADER = "Idempotent-Replayed"
+
+
+def request_fingerprint(payload: Any) -> str:
+    canonical = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _replay(row: dict[str, Any]) -> JSONResponse:
+    return JSONResponse(json.loads(row["response"]), status_code=row["status_code"], headers={REPLAY_HEADER: "true"})
+
+
+async def idempotent(
+    scope: str,
+    key: str | None,
+    payload: Any,
+    handler: Callable[[], Awaitable[Any]],
+) -> Any:
+    """Run handler once per (scope, key); without a key just run it."""
+    if not key:
+        return await handler()
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key is limited to {MAX_KEY_LENGTH} characters")
+
+    fingerprint = request_fingerprint(payload)
+    row = await claim_idempotency_key(scope, key, fingerprint, IDEMPOTENCY_TTL_SECS)
+    if row is not None:
+        if row["request_hash"] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        waited = 0.0
+        while row is not None and row["response"] is None and waited < IDEMPOTENCY_WAIT_SECS:
+            await asyncio.sleep(0.25)
+            waited += 0.25
+            row = await get_idempotency_key(scope, key)
+        if row is None:
+            # The original failed and released the key; let the client retry
+            raise HTTPException(status_code=409, detail="The original request failed; please retry")
+        if row["response"] is None:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        logger.info("Replaying %s response for key %s", scope, key)
+        return _replay(row)
+
+    try:
+        result = await handler()
+    except HTTPException as exc:
+        if exc.status_code >= 500:
+            await release_idempotency_key(scope, key)
+        else:
+            await save_idempotent_response(scope, key, exc.status_code, json.dumps({"detail": exc.detail}))
+        raise
+    except BaseException:
+        await release_idempotency_key(scope, key)
+        raise
+    await save_idempotent_response(scope, key, 200, json.dumps(jsonable_encoder(result)))
+    return result
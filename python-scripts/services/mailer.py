@@ -0,0 +1,125 @@
+"""
+Zoho SMTP message building and a reusable SMTP session for batch sends.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import smtplib
+import ssl
+from dataclasses import dataclass
+from email.message import EmailMessage
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("tripoint.mailer")
+
+REPLY_TO = "contact@tripointdiagnostics.co.uk"
+
+
+@dataclass(frozen=True)
+class SMTPSettings:
+    host: str
+    port: int
+    user: str | None
+    password: str | None
+    from_email: str | None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.user and self.password)
+
+
+def smtp_settings() -> SMTPSettings:
+    user = os.getenv("ZOHO_SMTP_USER")
+    return SMTPSettings(
+        host=os.getenv("ZOHO_SMTP_HOST", "smtp.zoho.eu"),
+        port=int(os.getenv("ZOHO_SMTP_PORT", 465)),
+        user=user,
+        password=os.getenv("ZOHO_SMTP_PASS"),
+        from_email=os.getenv("ZOHO_FROM_EMAIL", user),
+    )
+
+
+def build_message(
+    *,
+    from_email: str | None,
+    subject: str,
+    html_body: str,
+    to_emails: list[str],
+    text_body: str | None = None,
+    reply_to: str | None = None,
+    attachments: list[tuple[str, bytes, str]] | None = None,
+) -> EmailMessage:
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = from_email
+    msg["To"] = ", ".join(to_emails)
+    if reply_to:
+        msg["Reply-To"] = reply_to
+
+    # Plain text first, HTML as the preferred alternative
+    msg.set_content(text_body or "This email requires an HTML-compatible viewer.")
+    msg.add_alternative(html_body, subtype="html")
+
+    for filename, content, mimetype in attachments or []:
+        maintype, _, subtype = mimetype.partition("/")
+        msg.add_attachment(content, maintype=maintype, subtype=subtype or maintype, filename=filename)
+    return msg
+
+
+class SMTPSession:
+    """One logged-in SMTP_SSL connection reused across many sends.
+
+    Reconnects if the server has dropped the connection (Zoho closes idle
+    sessions after a few minutes, which matters for rate-limited batches).
+    That is checked with NOOP before a message goes out, never by resending
+    one: a drop after DATA may come once the server has accepted it, so a
+    failed send raises and is left to the caller to retry.
+    """
+
+    def __init__(self, settings: SMTPSettings | None = None):
+        self.settings = settings or smtp_settings()
+        self._server: smtplib.SMTP_SSL | None = None
+
+    def __enter__(self) -> SMTPSession:
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def _connect(self) -> smtplib.SMTP_SSL:
+        s = self.settings
+        if not s.configured:
+            raise RuntimeError("Zoho SMTP not configured (ZOHO_SMTP_USER / ZOHO_SMTP_PASS)")
+        logger.info("Connecting to SMTP %s:%s as %s...", s.host, s.port, s.user)
+        server = smtplib.SMTP_SSL(s.host, s.port, context=ssl.create_default_context())
+        server.login(s.user, s.password)
+        return server
+
+    def _alive(self) -> bool:
+        try:
+            return self._server is not None and self._server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, msg: EmailMessage) -> None:
+        if not self._alive():
+            self.close()
+            self._server = self._connect()
+        try:
+            self._server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self._server = None
+            raise
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            pass
+        self._server = None
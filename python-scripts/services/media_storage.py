@@ -137,6 +137,24 @@ def delete_file(storage_key: str) -> bool:
     return True
 
 
+def delete_files(storage_keys: list[str]) -> int:
+    """Remove files whose rows are already deleted and committed.
+
+    Returns the bytes freed; files already gone are skipped (media_gc.py
+    reconciles anything a crash leaves behind).
+    """
+    freed = 0
+    for key in storage_keys:
+        path = MEDIA_DIR / key
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            continue
+        freed += size
+    return freed
+
+
 def get_serve_url(storage_key: str) -> str:
     """Return URL path for serving the file (e.g. /media/report_id/uuid.ext)."""
     prefix = MEDIA_URL_PREFIX.rstrip("/")
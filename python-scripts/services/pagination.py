@@ -0,0 +1,70 @@
+"""
+Keyset pagination helpers for admin list endpoints.
+
+Cursors are the sort key of the last row served, JSON-encoded and base64url'd
+so clients treat them as opaque. Totals are optional and cached briefly,
+since COUNT(*) over the full history is the one part of a list request whose
+cost still grows with the table.
+"""
+from __future__ import annotations
+
+import base64
+import binascii
+import json
+import os
+import time
+from typing import Any
+
+COUNT_CACHE_SECS = float(os.getenv("ADMIN_COUNT_CACHE_SECS", "30"))
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(*values: Any) -> str:
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str, arity: int) -> tuple[Any, ...]:
+    """Inverse of encode_cursor. Raises ValueError for anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+    if not isinstance(values, list) or len(values) != arity:
+        raise ValueError("Invalid cursor")
+    return tuple(values)
+
+
+def clamp_page_size(limit: int) -> int:
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+class TTLCache:
+    """Small dict cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl: float = COUNT_CACHE_SECS, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: dict[Any, tuple[float, Any]] = {}
+
+    def get(self, key: Any) -> Any | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def set(self, key: Any, value: Any) -> None:
+        if len(self._data) >= self.max_entries:
+            now = time.monotonic()
+            self._data = {k: e for k, e in self._data.items() if e[0] >= now}
+            if len(self._data) >= self.max_entries:
+                self._data.pop(next(iter(self._data)))
+        self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self) -> None:
+        self._data.clear()
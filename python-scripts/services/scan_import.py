@@ -0,0 +1,628 @@
+"""
+Fault-memory and actual-values exports from diagnostic tools, parsed as a
+stream.
+
+Xentry, ODIS and most OBD loggers export a session as CSV (comma, semicolon
+or tab separated, often with decimal commas and a "Key;Value" preamble) or
+as XML. parse_scan_export reads the upload a line (CSV) or an element (XML,
+through expat) at a time and keeps only what it maps:
+
+  fault memory   rows with a code column (Code / DTC / Fehlercode ...): one
+                 vehicle_faults row per control unit, its codes in dtcs as
+                 {"code", "description", "status", ...}
+  actual values  rows with a time column (TIME_KEYS, Zeit, "Time [s]") and
+                 numeric channels: one fault_tests row whose channels become
+                 test_series (services.timeseries) straight from typed
+                 arrays, so a long log costs 8 bytes a sample, not a Python
+                 object per cell
+  value list     Name / Value (/ Unit) rows: one fault_tests row with the
+                 values as its readings
+
+A CSV file may hold several sections, each starting with its own header
+after a blank line. Rows that cannot be mapped (a field count that differs
+from the header, a code that is not DTC-shaped) are skipped and reported
+with their line number (the first MAX_REPORTED_ERRORS of them).
+"""
+from __future__ import annotations
+
+import codecs
+import csv
+import io
+import math
+import os
+import re
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, BinaryIO, Iterator
+from xml.parsers import expat
+
+from services.timeseries import SERIES_MIN_POINTS, TIME_KEYS, Series, encode
+
+SCAN_IMPORT_MAX_BYTES = int(os.getenv("SCAN_IMPORT_MAX_BYTES", str(200 * 1024 * 1024)))
+MAX_REPORTED_ERRORS = 100
+# Longer lines are reported and skipped rather than read into memory
+MAX_LINE_CHARS = 64 * 1024
+MAX_META_ENTRIES = 50
+LOG_BLOCK_ROWS = 2048
+
+# Header / field names, compared after _key (lowercase, units and punctuation dropped)
+CODE_KEYS = {"code", "dtc", "dtccode", "faultcode", "errorcode", "eventcode", "troublecode", "fehlercode", "fehlernummer"}
+DESCRIPTION_KEYS = {"description", "text", "faulttext", "dtctext", "meaning", "fehlertext", "beschreibung"}
+STATUS_KEYS = {"status", "state", "faultstatus", "dtcstatus", "zustand"}
+ECU_KEYS = {"ecu", "controlunit", "module", "system", "steuergerät", "steuergeraet"}
+NAME_KEYS = {"name", "parameter", "designation", "actualvalue", "bezeichnung", "istwert"}
+VALUE_KEYS = {"value", "wert", "reading"}
+UNIT_KEYS = {"unit", "einheit"}
+_TIME_KEYS = {*TIME_KEYS, "zeit", "timesec", "times", "zeitstempel"}
+
+_UNIT_RE = re.compile(r"\s*[\[(]([^\])]*)[\])]\s*$")
+_NUMBER_RE = re.compile(r"\s*([-+]?(?:\d+(?:[.,]\d*)?|[.,]\d+)(?:[eE][-+]?\d+)?)\s*(.*?)\s*$")
+_CLOCK_RE = re.compile(r"\s*(?:(\d+):)?(\d+):(\d+(?:[.,]\d*)?)\s*$")
+# SAE J2012 codes, with an optional failure-type byte (P0300, P0300-1F,
+# P03001F), and the bare hex or decimal numbers manufacturer tools print
+# (VAG 16684, BMW 0x2F4A01); matched after strip().upper()
+_DTC_RE = re.compile(r"[PCBU][0-9A-F]{4}(?:[-\s]?[0-9A-F]{2})?|(?:0X)?[0-9A-F]{4,6}")
+
+
+class ScanImportError(ValueError):
+    """The upload is not an export parse_scan_export can read at all."""
+
+
+def _key(name: str) -> str:
+    return re.sub(r"[\W_]+", "", _UNIT_RE.sub("", name).lower())
+
+
+def _unit(name: str) -> str | None:
+    match = _UNIT_RE.search(name)
+    return match.group(1).strip() or None if match else None
+
+
+def _first(fields: dict[str, Any], keys: set[str]) -> Any:
+    return next((v for k, v in fields.items() if _key(k) in keys), None)
+
+
+def _number(text: str) -> tuple[float, str] | None:
+    """(value, trailing unit) of "12,5 bar"-style cells; None when not numeric."""
+    match = _NUMBER_RE.match(text)
+    if not match:
+        return None
+    return float(match.group(1).replace(",", ".")), match.group(2)
+
+
+def _seconds(text: str) -> float | None:
+    """A time cell as seconds: a number, [h:]mm:ss[.f] or an ISO timestamp (epoch)."""
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    if match := _CLOCK_RE.match(text):
+        hours, minutes, seconds = match.groups()
+        return int(hours or 0) * 3600 + int(minutes) * 60 + float(seconds.replace(",", "."))
+    try:
+        return datetime.fromisoformat(text.strip()).timestamp()
+    except ValueError:
+        pass
+    if (parsed := _number(text)) is not None and not parsed[1]:
+        return parsed[0]
+    return None
+
+
+# ─── Sections ───────────────────────────────────────────────────────────────
+
+
+class _FaultMemory:
+    """Codes per control unit, in the order first seen; repeats are counted."""
+
+    def __init__(self) -> None:
+        self.units: dict[str, dict[str, dict[str, Any]]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(codes) for codes in self.units.values())
+
+    def add(self, fields: dict[str, Any], ecu: str | None) -> str | None:
+        code = str(_first(fields, CODE_KEYS) or "").strip().upper()
+        if not code:
+            return "no fault code"
+        if not _DTC_RE.fullmatch(code):
+            return f"{code!r} is not a fault code"
+        entry: dict[str, Any] = {"code": code}
+        for name, value in fields.items():
+            key = _key(name)
+            if key in CODE_KEYS or value in (None, ""):
+                continue
+            if key in ECU_KEYS:
+                ecu = ecu or str(value).strip()
+            elif key in DESCRIPTION_KEYS:
+                entry.setdefault("description", str(value).strip())
+            elif key in STATUS_KEYS:
+                entry.setdefault("status", str(value).strip())
+            else:
+                entry.setdefault(name.strip(), value.strip() if isinstance(value, str) else value)
+        codes = self.units.setdefault(ecu or "", {})
+        if code in codes:
+            codes[code]["occurrences"] = codes[code].get("occurrences", 1) + 1
+        else:
+            codes[code] = entry
+        return None
+
+    def records(self) -> list[dict[str, Any]]:
+        """_insert_fault fields, one fault per control unit."""
+        return [
+            {"title": f"{ecu}: fault memory" if ecu else "Fault memory", "dtcs": list(codes.values())}
+            for ecu, codes in self.units.items()
+        ]
+
+
+class _Log:
+    """An actual-values section: a time axis and numeric channels as typed arrays.
+
+    Rows are buffered LOG_BLOCK_ROWS at a time and converted a column at a
+    time (array.extend over map(float, ...)), which keeps the per-cell work
+    in C; a column of a block that does not parse whole falls back to
+    per-cell parsing.
+    """
+
+    def __init__(self, names: list[str], line: int, scan: ScanImport):
+        self.line = line
+        self.scan = scan
+        self.names: list[str] = []
+        self.index: dict[str, int] = {}
+        self.units: dict[str, str] = {}
+        self.columns: list[array] = []
+        self.numeric: list[int] = []
+        self.x = array("d")
+        self.x_name: str | None = None
+        self.x_index: int | None = None
+        self.block: list[list[str]] = []
+        self.block_lines: list[int] = []
+        for position, name in enumerate(names):
+            if self.x_index is None and _key(name) in _TIME_KEYS:
+                self.x_index, self.x_name = position, name.strip()
+            self._column(name)
+
+    def __len__(self) -> int:
+        return len(self.x) + len(self.block)
+
+    def _column(self, name: str) -> int:
+        name = name.strip() or f"column {len(self.names) + 1}"
+        base, n = name, 2
+        while name in self.index:
+            name, n = f"{base} ({n})", n + 1
+        self.index[name] = len(self.names)
+        self.names.append(name)
+        self.columns.append(array("d", [math.nan]) * len(self.x))
+        self.numeric.append(0)
+        if unit := _unit(name):
+            self.units[name] = unit
+        return self.index[name]
+
+    def add(self, cells: list[str], line: int) -> str | None:
+        """Buffer one row of cells (positional, as the header); an error message if rejected."""
+        if len(cells) > len(self.names):
+            return f"{len(cells)} fields, header has {len(self.names)}"
+        self.block.append(cells)
+        self.block_lines.append(line)
+        if len(self.block) >= LOG_BLOCK_ROWS:
+            self.flush()
+        return None
+
+    def add_record(self, fields: dict[str, Any], line: int) -> str | None:
+        """Buffer a keyed sample (XML); new keys become columns, null before this row."""
+        cells = [""] * len(self.names)
+        for name, value in fields.items():
+            i = self.index.get(name.strip())
+            if i is None:
+                i = self._column(name)
+                cells.append("")
+            cells[i] = value
+        return self.add(cells, line)
+
+    def flush(self) -> None:
+        rows, lines = self.block, self.block_lines
+        self.block, self.block_lines = [], []
+        if not rows:
+            return
+        width = len(self.names)
+        if any(len(row) < width for row in rows):
+            rows = [row + [""] * (width - len(row)) if len(row) < width else row for row in rows]
+        if self.x_index is not None:
+            times = [row[self.x_index] for row in rows]
+            try:
+                self.x.extend(array("d", map(float, times)))
+            except ValueError:
+                kept = []
+                for row, line, cell in zip(rows, lines, times):
+                    if (t := _seconds(cell)) is None:
+                        self.scan.error(line, f"bad {self.x_name} value {cell!r}")
+                        continue
+                    self.x.append(t)
+                    kept.append(row)
+                rows = kept
+        else:
+            self.x.extend(range(len(self.x), len(self.x) + len(rows)))
+        for i, cells in enumerate(zip(*rows)):
+            if i == self.x_index:
+                continue
+            column = self.columns[i]
+            try:
+                column.extend(array("d", map(float, cells)))
+                self.numeric[i] += len(cells)
+            except ValueError:
+                column.extend([self._parse(i, cell) for cell in cells])
+
+    def _parse(self, i: int, cell: str) -> float:
+        """Slow path: decimal commas, trailing units, blanks and text (null)."""
+        try:
+            value = float(cell)
+        except ValueError:
+            parsed = _number(cell) if cell else None
+            if parsed is None:
+                return math.nan
+            value, unit = parsed
+            if unit and len(unit) <= 16:
+                self.units.setdefault(self.names[i], unit)
+        self.numeric[i] += 1
+        return value
+
+    def channels(self) -> list[tuple[str, array]]:
+        """Numeric columns other than the time axis; all-text columns are dropped."""
+        self.flush()
+        return [
+            (name, values)
+            for i, (name, values) in enumerate(zip(self.names, self.columns))
+            if i != self.x_index and self.numeric[i]
+        ]
+
+    def skipped(self) -> list[str]:
+        return [name for i, name in enumerate(self.names) if i != self.x_index and not self.numeric[i]]
+
+    def readings(self, source: str, meta: dict[str, str]) -> tuple[dict[str, Any], list[dict[str, Any]]]:
+        """A test's readings and its encoded test_series rows. Short logs stay inline."""
+        channels: dict[str, Any] = {}
+        rows: list[dict[str, Any]] = []
+        x = self.x if self.x_index is not None else None
+        if len(self) < SERIES_MIN_POINTS:
+            if x is not None:
+                channels[self.x_name] = list(x)
+            for name, values in self.channels():
+                channels[name] = [None if v != v else v for v in values]
+        else:
+            # The time axis is shared: encode it once, not per channel
+            x_encoding, x_blob = encode(x) if x is not None else (None, None)
+            for name, values in self.channels():
+                series = Series(name, values)
+                channels[name] = series.stub()
+                row = series.row()
+                if x is not None:
+                    channels[name]["x"] = self.x_name
+                    row.update(x_encoding=x_encoding, x=x_blob, x_name=self.x_name)
+                rows.append(row)
+        readings: dict[str, Any] = {"source": source, "samples": len(self), "channels": channels}
+        if units := {k: v for k, v in self.units.items() if k in channels or k == self.x_name}:
+            readings["units"] = units
+        if skipped := self.skipped():
+            readings["skipped_columns"] = skipped
+        if meta:
+            readings["meta"] = meta
+        return readings, rows
+
+
+class _Values:
+    """A Name / Value (/ Unit) list of actual values."""
+
+    def __init__(self, line: int):
+        self.line = line
+        self.values: dict[str, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def add(self, fields: dict[str, Any]) -> str | None:
+        name = str(_first(fields, NAME_KEYS) or "").strip()
+        if not name:
+            return "no value name"
+        raw = str(_first(fields, VALUE_KEYS) or "").strip()
+        unit = str(_first(fields, UNIT_KEYS) or "").strip()
+        parsed = _number(raw) if raw else None
+        value: Any = raw
+        if parsed is not None and (not parsed[1] or not unit):
+            value, unit = parsed[0], unit or parsed[1]
+        self.values[name] = {"value": value, "unit": unit} if unit else value
+        return None
+
+
+def _kind(keys: list[str]) -> str | None:
+    """The section a header (or XML record) with these _key-ed names starts."""
+    found = set(keys)
+    if found & CODE_KEYS:
+        return "faults"
+    if found & _TIME_KEYS and len(keys) > 1:
+        return "log"
+    if found & NAME_KEYS and found & VALUE_KEYS:
+        return "values"
+    return None
+
+
+# ─── Parsing ────────────────────────────────────────────────────────────────
+
+
+@dataclass
+class ScanImport:
+    """What parse_scan_export found in one upload."""
+
+    source: str
+    format: str = "csv"
+    lines: int = 0
+    meta: dict[str, str] = field(default_factory=dict)
+    faults: _FaultMemory = field(default_factory=_FaultMemory)
+    logs: list[_Log] = field(default_factory=list)
+    value_lists: list[_Values] = field(default_factory=list)
+    errors: list[dict[str, Any]] = field(default_factory=list)
+    error_count: int = 0
+
+    def error(self, line: int, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def add_meta(self, key: str, value: str) -> None:
+        key, value = key.strip(), value.strip()
+        if key and value and len(self.meta) < MAX_META_ENTRIES:
+            self.meta.setdefault(key, value)
+
+    @property
+    def ecu(self) -> str | None:
+        """A control unit named in the preamble ("Control unit;ME97")."""
+        return _first(self.meta, ECU_KEYS)
+
+    def fault_records(self) -> list[dict[str, Any]]:
+        return self.faults.records()
+
+    def test_records(
+        self,
+        test_name: str | None = None,
+        tool_used: str | None = None,
+        fault_id: str | None = None,
+    ) -> list[tuple[dict[str, Any], list[dict[str, Any]]]]:
+        """(_insert_test fields, encoded test_series rows) per log and value list.
+
+        Encoding a long log is CPU work: run this off the event loop, as
+        parse_scan_export itself.
+        """
+        sections: list[Any] = [s for s in [*self.logs, *self.value_lists] if len(s)]
+        sections.sort(key=lambda s: s.line)
+        records = []
+        for number, section in enumerate(sections, 1):
+            kind = "Actual values" if isinstance(section, _Log) else "Value list"
+            name = test_name or f"{kind}: {self.source}"
+            if len(sections) > 1:
+                name = f"{name} ({number})"
+            if isinstance(section, _Log):
+                readings, rows = section.readings(self.source, self.meta)
+            else:
+                readings, rows = {"source": self.source, "values": section.values}, []
+            fields = {"test_name": name, "tool_used": tool_used, "fault_id": fault_id, "readings": readings}
+            records.append((fields, rows))
+        return records
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "format": self.format,
+            "lines": self.lines,
+            "dtcs": len(self.faults),
+            "samples": sum(len(log) for log in self.logs),
+            "values": sum(len(v) for v in self.value_lists),
+            "meta": self.meta,
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
+
+
+def _lines(text: io.TextIOBase, scan: ScanImport) -> Iterator[tuple[int, str]]:
+    """(line number, line without its newline), skipping over-long lines."""
+    number = 0
+    while line := text.readline(MAX_LINE_CHARS):
+        number += 1
+        if len(line) == MAX_LINE_CHARS and not line.endswith("\n"):
+            scan.error(number, f"line longer than {MAX_LINE_CHARS} characters")
+            while (rest := text.readline(MAX_LINE_CHARS)) and not rest.endswith("\n"):
+                pass
+            continue
+        yield number, line.rstrip("\r\n")
+    scan.lines = number
+
+
+def _delimiter(line: str) -> str:
+    counts = {d: line.count(d) for d in (";", "\t", ",")}
+    best = max(counts, key=counts.get)  # type: ignore[arg-type]
+    return best if counts[best] else ";"
+
+
+def _cells(line: str, delimiter: str) -> list[str]:
+    if '"' not in line:
+        return line.split(delimiter)
+    return next(csv.reader((line,), delimiter=delimiter), [])
+
+
+def _parse_csv(text: io.TextIOBase, scan: ScanImport) -> None:
+    section: Any = None
+    names: list[str] = []
+    delimiter = ";"
+    blank = False
+    for number, line in _lines(text, scan):
+        if not line.strip(delimiter + " "):
+            blank = True
+            continue
+        if section is None or blank:
+            row_delimiter = _delimiter(line)
+            cells = _cells(line, row_delimiter)
+            kind = _kind([_key(c) for c in cells]) if len(cells) > 1 else None
+            if kind is not None:
+                delimiter, names, blank = row_delimiter, [c.strip() for c in cells], False
+                if kind == "faults":
+                    section = scan.faults
+                elif kind == "log":
+                    section = _Log(names, number, scan)
+                    scan.logs.append(section)
+                else:
+                    section = _Values(number)
+                    scan.value_lists.append(section)
+                continue
+            if section is None:
+                # Preamble: "VIN;WDD2050..." and the like
+                if len(cells) >= 2:
+                    scan.add_meta(cells[0], cells[1])
+                continue
+            blank = False
+        if isinstance(section, _Log):
+            if delimiter != "," and "," in line:
+                # Decimal commas; text cells are not kept in a log anyway
+                line = line.replace(",", ".")
+            error = section.add(_cells(line, delimiter), number)
+        elif len(cells := _cells(line, delimiter)) != len(names):
+            error = f"{len(cells)} fields, header has {len(names)}"
+        elif section is scan.faults:
+            error = section.add(dict(zip(names, cells)), scan.ecu)
+        else:
+            error = section.add(dict(zip(names, cells)))
+        if error:
+            scan.error(number, error)
+    if section is None:
+        raise ScanImportError("No fault code, actual-values or value-list header found")
+
+
+class _Element:
+    __slots__ = ("tag", "fields", "children", "text")
+
+    def __init__(self, tag: str, fields: dict[str, Any]):
+        self.tag = tag
+        self.fields = fields
+        self.children = False
+        self.text: list[str] = []
+
+
+def _parse_xml(stream: BinaryIO, scan: ScanImport) -> None:
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    stack: list[_Element] = []
+    logs: dict[str, _Log] = {}
+    values: dict[str, _Values] = {}
+
+    def element_ecu() -> str | None:
+        for ancestor in reversed(stack):
+            if (ecu := _first(ancestor.fields, ECU_KEYS)) is not None:
+                return str(ecu)
+            if _key(ancestor.tag) in ECU_KEYS and (name := _first(ancestor.fields, NAME_KEYS | {"id"})):
+                return str(name)
+        return scan.ecu
+
+    def record(fields: dict[str, Any]) -> bool:
+        keys = [_key(k) for k in fields]
+        kind = _kind(keys)
+        if kind == "log" and not any(
+            key not in _TIME_KEYS and _number(str(value)) for key, value in zip(keys, fields.values())
+        ):
+            # A timestamp beside text (a session header), not a sample
+            kind = None
+        if kind is None:
+            return False
+        line = parser.CurrentLineNumber
+        # Records under the same parent element form one log / value list
+        parent = "/".join(e.tag for e in stack)
+        if kind == "faults":
+            error = scan.faults.add(fields, element_ecu())
+        elif kind == "log":
+            if parent not in logs:
+                logs[parent] = _Log([], line, scan)
+                scan.logs.append(logs[parent])
+                # The first record's time field is the axis
+                time_name = next(k for k in fields if _key(k) in _TIME_KEYS)
+                logs[parent].x_index = logs[parent]._column(time_name)
+                logs[parent].x_name = logs[parent].names[-1]
+            error = logs[parent].add_record(fields, line)
+        else:
+            if parent not in values:
+                values[parent] = _Values(line)
+                scan.value_lists.append(values[parent])
+            error = values[parent].add(fields)
+        if error:
+            scan.error(line, error)
+        return True
+
+    def start(tag: str, attrs: dict[str, str]) -> None:
+        if stack:
+            stack[-1].children = True
+        stack.append(_Element(tag.rpartition(":")[2], dict(attrs)))
+
+    def end(tag: str) -> None:
+        element = stack.pop()
+        text = "".join(element.text).strip()
+        if element.children:
+            record(element.fields)
+            return
+        # A leaf is a record when its attributes say so (<Fault code="P0300">
+        # Misfire</Fault>, <Sample t="0.1" rpm="800"/>), else a field of its
+        # parent (<Code>P0300</Code>, <Value name="rpm" unit="1/min">800</Value>)
+        if element.fields and record({**({"text": text} if text else {}), **element.fields}):
+            return
+        if stack:
+            name = element.fields.get("name") or element.tag
+            if unit := element.fields.get("unit"):
+                name = f"{name} [{unit}]"
+            stack[-1].fields[name] = text or element.fields.get("value", "")
+
+    def characters(data: str) -> None:
+        if stack:
+            stack[-1].text.append(data)
+
+    def no_entities(*_: Any) -> None:
+        raise ScanImportError("XML entity declarations are not accepted")
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = characters
+    parser.EntityDeclHandler = no_entities
+    try:
+        parser.ParseFile(stream)
+    except expat.ExpatError as exc:
+        # Keep what parsed before a truncated or malformed tail
+        scan.error(exc.lineno, f"XML: {expat.ErrorString(exc.code)}")
+    scan.lines = parser.CurrentLineNumber
+    if not (len(scan.faults) or logs or values):
+        raise ScanImportError("No fault codes or actual values found in the XML")
+
+
+def _encoding(head: bytes) -> str:
+    """UTF-8 (with or without BOM) when the start of the file decodes as it, else cp1252."""
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "cp1252"
+
+
+def parse_scan_export(stream: BinaryIO, source: str = "") -> ScanImport:
+    """Parse a seekable binary stream (an UploadFile's file) without reading it whole.
+
+    Raises ScanImportError when nothing in it can be mapped; otherwise rows
+    that could not be are in .errors.
+    """
+    head = stream.read(64 * 1024)
+    stream.seek(0)
+    if not head.strip():
+        raise ScanImportError("The file is empty")
+    scan = ScanImport(source=source or "scan export")
+    if head.lstrip(codecs.BOM_UTF8 + b" \t\r\n").startswith(b"<"):
+        scan.format = "xml"
+        _parse_xml(stream, scan)
+    else:
+        text = io.TextIOWrapper(stream, encoding=_encoding(head), errors="replace", newline="")
+        try:
+            _parse_csv(text, scan)
+        finally:
+            # Leave the upload's file open for its owner to close
+            text.detach()
+    for log in scan.logs:
+        log.flush()
+    return scan
@@ -0,0 +1,423 @@
+"""
+Numeric time series pulled out of fault_tests.readings.
+
+Live-data captures (NOx ppm, DPF differential pressure, rail pressure logged
+over minutes) arrive as long JSON arrays inside a test's readings, and every
+report view used to parse all of them. split_readings moves each numeric
+array of at least SERIES_MIN_POINTS values into a Series, stored in the
+test_series table as a compressed typed array: 'q' when every value is an
+integer, else 'd' with NaN for nulls. Logged values usually carry a fixed
+number of decimals, so doubles that round-trip through 10**k are stored as
+scaled integers, and monotonic series (time axes) as deltas; integers are
+byte-shuffled before zlib, which puts their zero high bytes in long runs.
+The readings keep a stub with its summary in its place:
+
+    {"$series": "nox_ppm", "points": 36000, "min": 4.0, "max": 212.5, "mean": 31.7}
+
+so loading a report costs the same however long the captures are. Charts
+fetch the series itself, downsampled with LTTB (largest triangle three
+buckets), which keeps the peaks and dips a plot would show.
+
+Shapes recognised, at any depth of nested objects:
+
+    {"nox_ppm": [41.2, 40.8, ...]}          one series per key
+    {"t": [...], "nox_ppm": [...]}          "t" (TIME_KEYS) is also the x axis
+                                            of the equal-length arrays beside it
+    [{"t": 0.0, "nox_ppm": 41.2}, ...]      samples: one series per field, x = t
+
+A stub sent back unchanged (the editor saving a test it loaded) keeps its
+stored series. NumPy is used for encoding, the summaries and LTTB when
+installed.
+"""
+from __future__ import annotations
+
+import math
+import sys
+import zlib
+from array import array
+from dataclasses import dataclass
+from itertools import accumulate
+from typing import Any
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore
+
+SERIES_MIN_POINTS = 64
+SERIES_KEY = "$series"
+# Keys whose array is the x axis of its siblings (seconds, or epoch ms)
+TIME_KEYS = ("t", "time", "timestamp", "ts", "seconds", "elapsed")
+# Default and ceiling for downsampled points
+DEFAULT_CHART_POINTS = 800
+MAX_CHART_POINTS = 5000
+
+
+# ─── Encoding ───────────────────────────────────────────────────────────────
+
+
+def _pack(values: array, shuffle: bool) -> bytes:
+    """Little-endian, optionally byte-shuffled (byte i of every value together), zlib."""
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    raw = values.tobytes()
+    size = values.itemsize
+    if shuffle:
+        raw = b"".join(raw[i::size] for i in range(size))
+    return zlib.compress(raw, 6)
+
+
+def _unpack(blob: bytes, typecode: str, shuffle: bool) -> array:
+    data = zlib.decompress(blob)
+    values = array(typecode)
+    if shuffle:
+        size = values.itemsize
+        count = len(data) // size
+        raw = bytearray(len(data))
+        for i in range(size):
+            raw[i::size] = data[i * count:(i + 1) * count]
+        data = bytes(raw)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _decimals(values: array) -> int | None:
+    """Fewest decimals (up to 6) every value round-trips through, if any."""
+    try:
+        for decimals in range(7):
+            scale = 10 ** decimals
+            if all(round(v * scale) / scale == v for v in values[:256]):
+                break
+        else:
+            return None
+        if all(round(v * scale) / scale == v for v in values):
+            return decimals
+    except (OverflowError, ValueError):
+        # inf / NaN
+        pass
+    return None
+
+
+def encode(values: array) -> tuple[str, bytes]:
+    """(encoding, blob). The encoding is the typecode, then ".<decimals>" for
+    scaled doubles and any of "+delta" / "+shuffle"; e.g. "q.2+shuffle"."""
+    if np is not None and len(values) and (encoded := _encode_numpy(values)) is not None:
+        return encoded
+    encoding = values.typecode
+    if encoding == "d" and (decimals := _decimals(values)) is not None:
+        scale = 10 ** decimals
+        try:
+            values = array("q", [round(v * scale) for v in values])
+            encoding = f"q.{decimals}"
+        except OverflowError:
+            pass
+    if encoding[0] == "q":
+        if all(a <= b for a, b in zip(values, values[1:])):
+            try:
+                values = array("q", [values[0], *(b - a for a, b in zip(values, values[1:]))])
+                encoding += "+delta"
+            except OverflowError:
+                pass
+        return encoding + "+shuffle", _pack(values, shuffle=True)
+    # Raw doubles: shuffling helps some signals and hurts others
+    plain, shuffled = _pack(values, shuffle=False), _pack(values, shuffle=True)
+    return (encoding, plain) if len(plain) <= len(shuffled) else (encoding + "+shuffle", shuffled)
+
+
+def _encode_numpy(values: array) -> tuple[str, bytes] | None:
+    """encode() in NumPy; None for values near the int64 limits, left to the exact path."""
+    limit = 2.0**62
+    v = np.frombuffer(values, dtype=np.float64 if values.typecode == "d" else np.int64)
+    encoding = values.typecode
+    if encoding == "d":
+        if not np.isfinite(v).all():
+            q = None
+        else:
+            for decimals in range(7):
+                scale = 10**decimals
+                if (np.round(v[:256] * scale) / scale == v[:256]).all():
+                    break
+            else:
+                decimals = None
+            q = None
+            if decimals is not None and (np.round(v * scale) / scale == v).all():
+                if np.abs(v).max() * scale >= limit:
+                    return None
+                q, encoding = np.round(v * scale).astype(np.int64), f"q.{decimals}"
+        if q is None:
+            plain = zlib.compress(v.astype("<f8").tobytes(), 6)
+            shuffled = zlib.compress(v.astype("<f8").view(np.uint8).reshape(-1, 8).T.tobytes(), 6)
+            return ("d", plain) if len(plain) <= len(shuffled) else ("d+shuffle", shuffled)
+        v = q
+    if v.min() <= -limit or v.max() >= limit:
+        return None
+    if (v[1:] >= v[:-1]).all():
+        v = np.concatenate((v[:1], np.diff(v)))
+        encoding += "+delta"
+    return encoding + "+shuffle", zlib.compress(v.astype("<i8").view(np.uint8).reshape(-1, 8).T.tobytes(), 6)
+
+
+def decode(encoding: str, blob: bytes) -> array:
+    base, *flags = encoding.split("+")
+    typecode, _, decimals = base.partition(".")
+    values = _unpack(blob, typecode, shuffle="shuffle" in flags)
+    if "delta" in flags:
+        values = array("q", accumulate(values))
+    if decimals:
+        scale = 10 ** int(decimals)
+        values = array("d", [v / scale for v in values])
+    return values
+
+
+def _typed(values: list[Any]) -> array | None:
+    """values as a typed array, or None unless they are all numbers / nulls."""
+    has_null = has_float = False
+    for v in values:
+        if v is None:
+            has_null = True
+        elif isinstance(v, float):
+            has_float = True
+        elif not isinstance(v, int) or isinstance(v, bool):
+            return None
+    if has_null and len(values) == values.count(None):
+        return None
+    if not has_null and not has_float:
+        try:
+            return array("q", values)
+        except OverflowError:
+            pass
+    return array("d", [math.nan if v is None else v for v in values])
+
+
+# ─── Series ─────────────────────────────────────────────────────────────────
+
+
+@dataclass
+class Series:
+    name: str
+    y: array
+    x: array | None = None
+    x_name: str | None = None
+
+    def __len__(self) -> int:
+        return len(self.y)
+
+    def summary(self) -> dict[str, Any]:
+        if np is not None:
+            values = np.frombuffer(self.y, dtype=np.float64 if self.y.typecode == "d" else np.int64)
+            if values.dtype == np.float64:
+                values = values[~np.isnan(values)]
+            if not len(values):
+                return {"min": None, "max": None, "mean": None}
+            lo, hi, mean = values.min().item(), values.max().item(), float(values.mean())
+        else:
+            values = [v for v in self.y if v == v]
+            if not values:
+                return {"min": None, "max": None, "mean": None}
+            lo, hi, mean = min(values), max(values), math.fsum(values) / len(values)
+        return {"min": lo, "max": hi, "mean": round(mean, 6)}
+
+    def stub(self) -> dict[str, Any]:
+        """What stays in readings in place of the values."""
+        stub = {SERIES_KEY: self.name, "points": len(self.y), **self.summary()}
+        if self.x_name:
+            stub["x"] = self.x_name
+        return stub
+
+    def row(self) -> dict[str, Any]:
+        """Column values for test_series."""
+        summary = self.summary()
+        y_encoding, y = encode(self.y)
+        x_encoding, x = encode(self.x) if self.x is not None else (None, None)
+        return {
+            "name": self.name,
+            "points": len(self.y),
+            "y_encoding": y_encoding,
+            "y": y,
+            "x_encoding": x_encoding,
+            "x": x,
+            "x_name": self.x_name,
+            "y_min": summary["min"],
+            "y_max": summary["max"],
+            "y_mean": summary["mean"],
+        }
+
+    @classmethod
+    def from_row(
+        cls, name: str, y_encoding: str, y: bytes, x_encoding: str | None, x: bytes | None, x_name: str | None
+    ) -> Series:
+        return cls(name, decode(y_encoding, y), decode(x_encoding, x) if x is not None else None, x_name)
+
+    def points(self, limit: int | None = DEFAULT_CHART_POINTS) -> tuple[list[Any], list[Any]]:
+        """(x, y) lists, LTTB-downsampled to `limit` points (None: all of them).
+
+        x is the sample index when the series has no x axis. Null samples are
+        dropped when downsampling and returned as None otherwise.
+        """
+        if limit is None or limit >= len(self.y):
+            x = self.x if self.x is not None else range(len(self.y))
+            return list(x), [None if v != v else v for v in self.y]
+        if np is not None:
+            y = np.frombuffer(self.y, dtype=np.float64 if self.y.typecode == "d" else np.int64)
+            x = np.frombuffer(self.x, dtype=np.float64 if self.x.typecode == "d" else np.int64) \
+                if self.x is not None else np.arange(len(y))
+            if y.dtype == np.float64 and np.isnan(y).any():
+                keep = ~np.isnan(y)
+                x, y = x[keep], y[keep]
+            indices = lttb(x, y, limit)
+            return x[indices].tolist(), y[indices].tolist()
+        xs: Any = self.x if self.x is not None else range(len(self.y))
+        ys: Any = self.y
+        if self.y.typecode == "d" and any(v != v for v in ys):
+            keep = [i for i, v in enumerate(ys) if v == v]
+            xs, ys = [xs[i] for i in keep], [ys[i] for i in keep]
+        indices = lttb(xs, ys, limit)
+        return [xs[i] for i in indices], [ys[i] for i in indices]
+
+
+def lttb(x: Any, y: Any, threshold: int) -> list[int]:
+    """Indices of the points Largest-Triangle-Three-Buckets keeps.
+
+    The first and last points always stay; each of the threshold - 2 buckets
+    in between contributes the point forming the largest triangle with the
+    point kept before it and the average of the next bucket.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    if np is not None:
+        return _lttb_numpy(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), threshold)
+    # Plain Python over array / list / range
+    every = (n - 2) / (threshold - 2)
+    kept = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        span = next_end - end
+        avg_x = sum(x[j] for j in range(end, next_end)) / span
+        avg_y = sum(y[j] for j in range(end, next_end)) / span
+        ax, ay = x[a], y[a]
+        dx, dy = avg_x - ax, avg_y - ay
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs(dx * (y[j] - ay) - (x[j] - ax) * dy)
+            if area > best_area:
+                best, best_area = j, area
+        kept.append(best)
+        a = best
+    kept.append(n - 1)
+    return kept
+
+
+def _lttb_numpy(x: Any, y: Any, threshold: int) -> list[int]:
+    n = len(y)
+    every = (n - 2) / (threshold - 2)
+    # Bucket i is [edges[i], edges[i + 1]), as in the pure-Python loop
+    edges = np.minimum((np.arange(threshold) * every).astype(np.int64) + 1, n)
+    kept = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start, end, next_end = edges[i], edges[i + 1], edges[i + 2]
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        ax, ay = x[a], y[a]
+        area = np.abs((avg_x - ax) * (y[start:end] - ay) - (x[start:end] - ax) * (avg_y - ay))
+        a = int(start + area.argmax())
+        kept.append(a)
+    kept.append(n - 1)
+    return kept
+
+
+# ─── Splitting readings ─────────────────────────────────────────────────────
+
+
+def _numeric(value: Any) -> array | None:
+    if isinstance(value, list) and len(value) >= SERIES_MIN_POINTS:
+        return _typed(value)
+    return None
+
+
+def _samples(value: Any) -> dict[str, array] | None:
+    """Columns of a list of flat numeric records sharing the same keys."""
+    if not isinstance(value, list) or len(value) < SERIES_MIN_POINTS or not isinstance(value[0], dict):
+        return None
+    keys = list(value[0])
+    if not keys or any(not isinstance(r, dict) or r.keys() != value[0].keys() for r in value):
+        return None
+    columns = {}
+    for key in keys:
+        column = _typed([r[key] for r in value])
+        if column is None:
+            return None
+        columns[key] = column
+    return columns
+
+
+def _time_key(columns: dict[str, Any]) -> str | None:
+    return next((k for k in TIME_KEYS if isinstance(columns.get(k), array)), None)
+
+
+def _add_columns(columns: dict[str, array], path: str, found: list[Series]) -> dict[str, Any]:
+    """Series (and stubs) for equal-length columns, x taken from a TIME_KEYS column."""
+    x_name = _time_key(columns)
+    x = columns[x_name] if x_name else None
+    stubs = {}
+    for key, values in columns.items():
+        series = Series(f"{path}.{key}" if path else str(key), values)
+        if x is not None and key != x_name and len(x) == len(values):
+            series.x, series.x_name = x, x_name
+        found.append(series)
+        stubs[key] = series.stub()
+    return stubs
+
+
+def _split(node: Any, path: str, found: list[Series]) -> Any:
+    if not isinstance(node, dict) or SERIES_KEY in node:
+        return node
+    out: dict[str, Any] = {}
+    arrays = {}
+    for key, value in node.items():
+        name = f"{path}.{key}" if path else str(key)
+        if (values := _numeric(value)) is not None:
+            arrays[key] = values
+        elif (columns := _samples(value)) is not None:
+            out[key] = _add_columns(columns, name, found)
+        else:
+            out[key] = _split(value, name, found)
+    if arrays:
+        out.update(_add_columns(arrays, path, found))
+        # Keep the document's key order
+        out = {key: out[key] for key in node}
+    return out
+
+
+def split_readings(readings: Any) -> tuple[Any, list[Series]]:
+    """(readings with series replaced by stubs, the series) for a test's readings."""
+    found: list[Series] = []
+    if (values := _numeric(readings)) is not None:
+        series = Series("values", values)
+        return series.stub(), [series]
+    if (columns := _samples(readings)) is not None:
+        return _add_columns(columns, "", found), found
+    return _split(readings, "", found), found
+
+
+def series_names(readings: Any) -> set[str]:
+    """Names of the series stubs anywhere in readings."""
+    names: set[str] = set()
+    stack = [readings]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if isinstance(node.get(SERIES_KEY), str):
+                names.add(node[SERIES_KEY])
+            else:
+                stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return names
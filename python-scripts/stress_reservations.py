@@ -0,0 +1,127 @@
+"""
+Concurrency check for slot reservation (db.insert_booking).
+
+Fires a burst of simultaneous reserves at a scratch database, many of them
+for the same or overlapping slots, then verifies that:
+
+  - every reserve either inserted or failed with SlotConflictError
+  - no two held bookings overlap once travel buffers are applied
+  - each contested slot was won exactly once
+  - the burst finished inside --timeout (no deadlock / lock starvation)
+
+Usage:
+    python stress_reservations.py
+    python stress_reservations.py --reserves 2000 --slots 20 --buffer 180
+
+Exit status is 1 when any check fails.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import aiosqlite
+
+
+async def _burst(args):
+    import db
+
+    base = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) + timedelta(days=2)
+    # Slots every 30 minutes: neighbours overlap once buffers are added
+    starts = [base + timedelta(minutes=30 * (i % args.slots)) for i in range(args.reserves)]
+    outcomes: Counter = Counter()
+    winners: Counter = Counter()
+
+    async def reserve(i, start):
+        end = start + timedelta(minutes=args.duration)
+        try:
+            await db.insert_booking(
+                id=f"TP-STRESS-{i:06d}", payment_link_token=f"stress{i:06d}", full_name="Stress Test",
+                email="stress@example.com", phone="07700900000", postcode="MK1 1AA", address_line_1="1 Test St",
+                town_city="Milton Keynes", vehicle_reg="AB12CDE", vehicle_make="Ford", vehicle_model="Focus",
+                approx_mileage="60000", symptoms="", additional_notes=None, safe_location=True,
+                service_ids="diagnostic", slot_start_iso=start.isoformat(), slot_end_iso=end.isoformat(),
+                zone="A", drive_time_mins=20, travel_buffer=args.buffer, total_amount=12000,
+                deposit_amount=3000, balance_due=9000,
+            )
+            outcomes["reserved"] += 1
+            winners[start] += 1
+        except db.SlotConflictError:
+            outcomes["conflict"] += 1
+
+    began = time.perf_counter()
+    await asyncio.wait_for(asyncio.gather(*(reserve(i, s) for i, s in enumerate(starts))), args.timeout)
+    return time.perf_counter() - began, outcomes, winners
+
+
+async def _overlaps():
+    from db_pool import read_connection
+
+    async with read_connection() as conn:
+        async with conn.execute(
+            """
+            SELECT a.id, b.id FROM bookings a JOIN bookings b ON a.id < b.id
+            WHERE a.status IN ('PENDING_DEPOSIT', 'DEPOSIT_PAID') AND b.status IN ('PENDING_DEPOSIT', 'DEPOSIT_PAID')
+              AND a.slot_start_ts - a.travel_buffer * 60 < b.slot_end_ts + b.travel_buffer * 60
+              AND b.slot_start_ts - b.travel_buffer * 60 < a.slot_end_ts + a.travel_buffer * 60
+            """
+        ) as cursor:
+            return await cursor.fetchall()
+
+
+async def main_async(args, path):
+    from db_pool import close_pool
+    from migrations import run_migrations
+
+    async with aiosqlite.connect(path, isolation_level=None) as conn:
+        await run_migrations(conn)
+    try:
+        try:
+            elapsed, outcomes, winners = await _burst(args)
+        except asyncio.TimeoutError:
+            print(f"FAIL  burst did not finish within {args.timeout}s")
+            return 1
+        overlaps = await _overlaps()
+    finally:
+        await close_pool()
+
+    failures = 0
+    print(f"{args.reserves} reserves over {args.slots} slots, buffer {args.buffer} min: {elapsed:.2f}s "
+          f"({args.reserves / elapsed:.0f}/s), {outcomes['reserved']} reserved, {outcomes['conflict']} conflicts")
+    if outcomes["reserved"] + outcomes["conflict"] != args.reserves:
+        print("FAIL  some reserves neither inserted nor conflicted")
+        failures += 1
+    if overlaps:
+        print(f"FAIL  {len(overlaps)} overlapping held bookings, e.g. {overlaps[0]}")
+        failures += 1
+    doubles = [start for start, n in winners.items() if n > 1]
+    if doubles:
+        print(f"FAIL  {len(doubles)} slots reserved more than once")
+        failures += 1
+    if not failures:
+        print("OK    no double bookings")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress concurrent slot reservations")
+    parser.add_argument("--reserves", type=int, default=500, help="Simultaneous reserve attempts")
+    parser.add_argument("--slots", type=int, default=12, help="Distinct start times (30 min apart) they compete for")
+    parser.add_argument("--duration", type=int, default=60, help="Slot length in minutes")
+    parser.add_argument("--buffer", type=int, default=30, help="Travel buffer either side, minutes")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds before the burst counts as deadlocked")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stress.db")
+        # Read by db_pool at import time
+        os.environ["BOOKINGS_DB_PATH"] = path
+        sys.exit(asyncio.run(main_async(args, path)))
+
+
+if __name__ == "__main__":
+    main()
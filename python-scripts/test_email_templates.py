@@ -0,0 +1,23 @@
+"""minify_html must keep Outlook conditional comments intact.
+
+    python -m pytest test_email_templates.py
+"""
+
+from email_templates import minify_html
+
+
+def test_minify_strips_plain_comments():
+    assert minify_html("<p>a</p>\n  <!-- note -->\n  <p>b</p>") == "<p>a</p>\n<p>b</p>"
+
+
+def test_minify_keeps_mso_conditional():
+    block = "<!--[if mso]><table><tr><td><![endif]-->"
+    assert minify_html(f"<!-- x -->{block}<p>body</p>") == f"{block}<p>body</p>"
+
+
+def test_minify_keeps_downlevel_revealed_conditional():
+    block = "<!--[if !mso]><!--><div>BODY</div><!--<![endif]-->"
+    assert minify_html(block) == block
+    assert minify_html(f"<!--[if mso]>MSO<![endif]-->\n<!-- drop -->\n{block}") == (
+        f"<!--[if mso]>MSO<![endif]-->\n{block}"
+    )
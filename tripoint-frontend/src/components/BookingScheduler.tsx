@@ -242,6 +242,12 @@ export function BookingScheduler({ zoneCalcPostcode }: BookingSchedulerProps) {
     const [selectedDateIndex, setSelectedDateIndex] = useState(0);
     const [calendarOpen, setCalendarOpen] = useState(false);
     const calendarRef = useRef<HTMLDivElement>(null);
+    /* one Idempotency-Key per booking attempt, so a retried submit replays the first reserve */
+    const reserveKeyRef = useRef<string>('');
+
+    useEffect(() => {
+        reserveKeyRef.current = '';
+    }, [booking, selectedSlot]);
     const [prevStep, setPrevStep] = useState<1 | 2 | 3>(1);
 
     // Derive step from state
@@ -394,13 +400,20 @@ export function BookingScheduler({ zoneCalcPostcode }: BookingSchedulerProps) {
         }
 
         setSubmitting(true);
+        if (!reserveKeyRef.current) reserveKeyRef.current = crypto.randomUUID();
         try {
             const response = await fetch('/api/booking/reserve', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'Idempotency-Key': reserveKeyRef.current },
                 body: JSON.stringify({ ...booking, slot_start_iso: selectedSlot }),
             });
             const json = await response.json();
+            if (response.status === 409) {
+                /* slot was taken since availability loaded: refresh the grid */
+                await fetchAvailability(booking.postcode, booking.service_ids);
+                setError(json.detail || 'That slot has just been taken. Please choose another time.');
+                return;
+            }
             if (!response.ok) throw new Error(json.detail || 'Booking failed');
             trackEvent('confirm_booking');
             if (json.status === 'pending_deposit' && json.payment_url) {
@@ -26,6 +26,8 @@ export function PaymentPage() {
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState<string | null>(null);
     const [paying, setPaying] = useState(false);
+    /* per page load: a double tap or retry gets the same checkout session back */
+    const [paymentKey] = useState(() => crypto.randomUUID());
 
     useEffect(() => {
         if (!token) return;
@@ -48,7 +50,7 @@ export function PaymentPage() {
         try {
             const res = await fetch('/api/payments/deposit-session', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'Idempotency-Key': `deposit-${paymentKey}` },
                 body: JSON.stringify({ token }),
             });
             const json = await res.json();
@@ -72,7 +74,7 @@ export function PaymentPage() {
         try {
             const res = await fetch('/api/payments/balance-session', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'Idempotency-Key': `balance-${paymentKey}` },
                 body: JSON.stringify({ token }),
             });
             const json = await res.json();
@@ -35,6 +35,19 @@ interface Booking {
     payment_link_token: string;
 }
 
+interface StatsTotals {
+    bookings: number;
+    by_status: Record<string, number>;
+    booked_value: number;
+    deposits_taken: number;
+    outstanding_balance: number;
+}
+
+interface Stats {
+    totals: StatsTotals;
+    by_zone: Record<string, StatsTotals>;
+}
+
 const STATUS_COLOURS: Record<string, string> = {
     PENDING_DEPOSIT: 'bg-amber-100 text-amber-800',
     DEPOSIT_PAID: 'bg-yellow-100 text-yellow-800',
@@ -90,6 +103,9 @@ export function AdminDashboardPage() {
     const [statusFilter, setStatusFilter] = useState<string>('');
     const [copiedId, setCopiedId] = useState<string | null>(null);
     const [actionLoading, setActionLoading] = useState<string | null>(null);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [loadingMore, setLoadingMore] = useState(false);
+    const [stats, setStats] = useState<Stats | null>(null);
     const navigate = useNavigate();
 
     const handleLogout = async () => {
@@ -118,6 +134,7 @@ export function AdminDashboardPage() {
             const json = await res.json();
             if (!res.ok) throw new Error(json.detail || 'Failed to load');
             setBookings(json.bookings || []);
+            setNextCursor(json.next_cursor || null);
         } catch (e) {
             setError(e instanceof Error ? e.message : 'Failed to load bookings');
         } finally {
@@ -125,16 +142,43 @@ export function AdminDashboardPage() {
         }
     };
 
+    const loadMoreBookings = async () => {
+        if (!nextCursor) return;
+        setLoadingMore(true);
+        try {
+            const params = new URLSearchParams({ cursor: nextCursor });
+            if (statusFilter) params.set('status', statusFilter);
+            const res = await fetchApi(`/admin/bookings?${params}`);
+            const json = await res.json();
+            if (!res.ok) throw new Error(json.detail || 'Failed to load');
+            setBookings((prev) => [...prev, ...(json.bookings || [])]);
+            setNextCursor(json.next_cursor || null);
+        } catch (e) {
+            setError(e instanceof Error ? e.message : 'Failed to load bookings');
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
+    const loadStats = async () => {
+        const res = await fetchApi('/admin/stats');
+        if (res.ok) setStats(await res.json());
+    };
+
     useEffect(() => {
         loadBookings();
     }, [statusFilter]);
 
+    useEffect(() => {
+        loadStats();
+    }, []);
+
     const handleComplete = async (id: string) => {
         setActionLoading(id);
         try {
             const res = await fetchApi(`/admin/bookings/${id}/complete`, { method: 'POST' });
             if (!res.ok) throw new Error('Failed');
-            await loadBookings();
+            await Promise.all([loadBookings(), loadStats()]);
         } finally {
             setActionLoading(null);
         }
@@ -145,7 +189,7 @@ export function AdminDashboardPage() {
         try {
             const res = await fetchApi(`/admin/bookings/${id}/mark-paid`, { method: 'POST' });
             if (!res.ok) throw new Error('Failed');
-            await loadBookings();
+            await Promise.all([loadBookings(), loadStats()]);
         } finally {
             setActionLoading(null);
         }
@@ -162,7 +206,7 @@ export function AdminDashboardPage() {
                 setCopiedId(id);
                 setTimeout(() => setCopiedId(null), 2000);
             }
-            await loadBookings();
+            await Promise.all([loadBookings(), loadStats()]);
         } finally {
             setActionLoading(null);
         }
@@ -197,6 +241,28 @@ export function AdminDashboardPage() {
                         </div>
                     </div>
 
+                    {stats && (
+                        <div className="mb-6 grid grid-cols-2 gap-3 sm:grid-cols-4">
+                            {[
+                                ['Bookings', String(stats.totals.bookings)],
+                                ['Awaiting deposit', String(stats.totals.by_status.PENDING_DEPOSIT || 0)],
+                                ['Deposits taken', `£${stats.totals.deposits_taken / 100}`],
+                                ['Outstanding balances', `£${stats.totals.outstanding_balance / 100}`],
+                            ].map(([label, value]) => (
+                                <div key={label} className="rounded-xl border border-border-default bg-surface-alt p-4">
+                                    <div className="text-xs text-text-muted">{label}</div>
+                                    <div className="text-lg font-semibold text-text-primary">{value}</div>
+                                </div>
+                            ))}
+                            <div className="col-span-2 text-xs text-text-muted sm:col-span-4">
+                                Jobs per zone:{' '}
+                                {Object.entries(stats.by_zone)
+                                    .map(([zone, z]) => `${zone} ${z.bookings - (z.by_status.CANCELLED || 0)}`)
+                                    .join(' · ')}
+                            </div>
+                        </div>
+                    )}
+
                     <div className="mb-4 flex items-center gap-2">
                         <label className="text-sm font-medium text-text-primary">Filter:</label>
                         <select
@@ -307,6 +373,14 @@ export function AdminDashboardPage() {
                             {bookings.length === 0 && (
                                 <div className="py-12 text-center text-text-muted">No bookings found</div>
                             )}
+                            {nextCursor && (
+                                <div className="flex justify-center border-t border-border-default py-4">
+                                    <CTAButton variant="outline" onClick={loadMoreBookings} disabled={loadingMore} className="flex items-center gap-2">
+                                        {loadingMore && <Loader2 className="h-4 w-4 animate-spin" />}
+                                        Load more
+                                    </CTAButton>
+                                </div>
+                            )}
                         </div>
                     )}
                 </div>
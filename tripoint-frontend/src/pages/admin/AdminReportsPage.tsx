@@ -57,6 +57,8 @@ export function AdminReportsPage() {
     const [dateTo, setDateTo] = useState('');
     const [copiedId, setCopiedId] = useState<string | null>(null);
     const [actionLoading, setActionLoading] = useState<string | null>(null);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [loadingMore, setLoadingMore] = useState(false);
     const [createModalOpen, setCreateModalOpen] = useState(false);
     const [createBookingId, setCreateBookingId] = useState('');
     const [createLoading, setCreateLoading] = useState(false);
@@ -78,20 +80,25 @@ export function AdminReportsPage() {
         return true;
     };
 
+    const reportParams = () => {
+        const params = new URLSearchParams();
+        if (statusFilter) params.set('status', statusFilter);
+        if (searchQuery) params.set('q', searchQuery);
+        if (dateFrom) params.set('date_from', dateFrom);
+        if (dateTo) params.set('date_to', dateTo);
+        return params;
+    };
+
     const loadReports = async () => {
         if (!(await loadSession())) return;
         setLoading(true);
         setError(null);
         try {
-            const params = new URLSearchParams();
-            if (statusFilter) params.set('status', statusFilter);
-            if (searchQuery) params.set('q', searchQuery);
-            if (dateFrom) params.set('date_from', dateFrom);
-            if (dateTo) params.set('date_to', dateTo);
-            const res = await fetchApi(`/admin/reports?${params}`);
+            const res = await fetchApi(`/admin/reports?${reportParams()}`);
             const json = await res.json();
             if (!res.ok) throw new Error(json.detail || 'Failed to load');
             setReports(json.reports || []);
+            setNextCursor(json.next_cursor || null);
         } catch (e) {
             setError(e instanceof Error ? e.message : 'Failed to load reports');
         } finally {
@@ -99,6 +106,24 @@ export function AdminReportsPage() {
         }
     };
 
+    const loadMoreReports = async () => {
+        if (!nextCursor) return;
+        setLoadingMore(true);
+        try {
+            const params = reportParams();
+            params.set('cursor', nextCursor);
+            const res = await fetchApi(`/admin/reports?${params}`);
+            const json = await res.json();
+            if (!res.ok) throw new Error(json.detail || 'Failed to load');
+            setReports((prev) => [...prev, ...(json.reports || [])]);
+            setNextCursor(json.next_cursor || null);
+        } catch (e) {
+            setError(e instanceof Error ? e.message : 'Failed to load reports');
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     useEffect(() => {
         loadReports();
     }, [statusFilter, searchQuery, dateFrom, dateTo]);
@@ -295,6 +320,14 @@ export function AdminReportsPage() {
                             {reports.length === 0 && (
                                 <div className="py-12 text-center text-text-muted">No reports found</div>
                             )}
+                            {nextCursor && (
+                                <div className="flex justify-center border-t border-border-default py-4">
+                                    <CTAButton variant="outline" onClick={loadMoreReports} disabled={loadingMore} className="flex items-center gap-2">
+                                        {loadingMore && <Loader2 className="h-4 w-4 animate-spin" />}
+                                        Load more
+                                    </CTAButton>
+                                </div>
+                            )}
                         </div>
                     )}
                 </div>